@@ -0,0 +1,383 @@
+import asyncio
+import ipaddress
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+
+from config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+# Ответы агента, означающие перегрузку: лимит одновременных вызовов уменьшается
+OVERLOAD_STATUS_CODES = (429, 502, 503, 504)
+
+# Token bucket в Redis: тот же расчет, что TokenBucket.take, атомарно для всех воркеров;
+# время берется из Redis, чтобы часы воркеров не влияли на лимит
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class Overloaded(Exception):
+    """The upstream call was not admitted: the wait queue is full or the wait timed out"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """Take one token; returns 0 or the seconds until a token is available"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / rate
+
+
+@lru_cache(maxsize=16)
+def _networks(proxies: Tuple[str, ...]) -> tuple:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def is_trusted_proxy(host: Optional[str], config: Settings = settings) -> bool:
+    """Whether the address belongs to `trusted_proxies`"""
+    try:
+        address = ipaddress.ip_address(host or "")
+    except ValueError:
+        return False
+    return any(address in network for network in _networks(tuple(config.trusted_proxies)))
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], config: Settings = settings) -> str:
+    """
+    Address of the client behind the connection
+
+    The peer address, unless the peer is a trusted proxy: then the rightmost
+    X-Forwarded-For entry not added by a trusted proxy. Entries to the left
+    of it come from the client and are not trusted.
+    """
+    if not is_trusted_proxy(peer, config) or not forwarded_for:
+        return peer or "unknown"
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop, config):
+            return hop
+    return hops[0] if hops else peer
+
+
+class ClientRateLimiter:
+    """Token bucket per client (address, see `client_address`)
+
+    Buckets live in an LRU-ordered dict bounded by `client_rate_max_clients`;
+    an evicted client simply starts again with a full bucket. With a shared
+    Redis connection (STATE_BACKEND=redis, see `start`) the buckets are Redis
+    hashes updated by a script, so a client gets its rate once across all
+    workers; a bucket expires once it would be full again. If Redis fails
+    the request is let through.
+    """
+
+    def __init__(self, config: Settings, prefix: str = "tailsense:ratelimit:"):
+        self.config = config
+        self.prefix = prefix
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._script = None
+        self.limited = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.client_rate_limit > 0
+
+    def start(self, shared=None) -> None:
+        """Keep the buckets in Redis (a redis.asyncio client) instead of this process"""
+        self._script = shared.register_script(TOKEN_BUCKET_SCRIPT) if shared is not None else None
+
+    async def check(self, client: str) -> float:
+        """Returns 0 if the request is allowed, else the Retry-After seconds"""
+        if not self.enabled:
+            return 0.0
+        if self._script is None:
+            retry_after = self._take(client)
+        else:
+            try:
+                burst = max(self.config.client_rate_burst, 1)
+                retry_after = float(await self._script(
+                    keys=[self.prefix + client], args=[self.config.client_rate_limit, burst]
+                ))
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Shared rate limit check failed, letting the request through: {e}")
+                return 0.0
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+    def _take(self, client: str) -> float:
+        now = time.monotonic()
+        burst = max(self.config.client_rate_burst, 1)
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(burst, now)
+            while len(self._buckets) > self.config.client_rate_max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(self.config.client_rate_limit, burst, now)
+
+    def snapshot(self) -> Dict[str, float]:
+        result = {
+            "enabled": self.enabled,
+            "shared": self._script is not None,
+            "rate": self.config.client_rate_limit,
+            "burst": self.config.client_rate_burst,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+        if self._script is None:
+            result["clients"] = len(self._buckets)
+        return result
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    queued: int = 0
+    shed_queue_full: int = 0
+    shed_timeout: int = 0
+    increases: int = 0
+    decreases: int = 0
+    overloads: int = 0
+
+
+class Slot:
+    """Admitted upstream call; marks when the first response byte arrived"""
+
+    def __init__(self, kind: str, queue_time: float):
+        self.kind = kind
+        self.queue_time = queue_time
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def mark(self) -> None:
+        """Record the latency sample (stream mode: time to the response headers)"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+
+class AdaptiveLimiter:
+    """Adaptive limit of concurrent upstream agent calls (AIMD)
+
+    The limit grows by one per window of successful calls while it is
+    fully used and shrinks multiplicatively when the agent signals overload
+    (429, 502-504, timeouts) or when the smoothed latency exceeds
+    `agent_latency_tolerance` times the typical fast-call latency
+    (latency gradient; the baseline is the 10th percentile of the last
+    `agent_latency_window` calls). Calls above the limit wait in a bounded
+    FIFO queue; when the queue is full or the wait exceeds
+    `agent_queue_timeout`, the call is shed with Overloaded so the client
+    gets a fast 503 instead of piling up on the agent.
+
+    Latency baselines are kept per call kind: a stream run reports the time
+    to its response headers, a blocking run the time of the whole answer.
+    The whole answer takes as long as the answer is, so blocking runs use the
+    wider `agent_run_latency_tolerance` (0 leaves them to overload signals).
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.limit = float(config.agent_concurrency_initial)
+        self.in_flight = 0
+        self.stats = AdmissionStats()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._smoothed: Dict[str, float] = {}
+        self._last_decrease = 0.0
+        self._queue_times: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.agent_concurrency_max > 0
+
+    def slot(self, kind: str) -> "_Admission":
+        """Async context manager admitting one upstream call
+
+        Raises:
+            Overloaded: The call was shed
+        """
+        return _Admission(self, kind)
+
+    async def acquire(self, kind: str) -> Slot:
+        started = time.monotonic()
+        if not self.enabled or (self.in_flight < int(self.limit) and not self._waiters):
+            self.in_flight += 1
+            return self._admit(kind, started)
+
+        if len(self._waiters) >= self.config.agent_queue_size:
+            self.stats.shed_queue_full += 1
+            raise Overloaded("queue_full")
+
+        self.stats.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.config.agent_queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted at the same moment: give it back
+                self.in_flight -= 1
+                self._grant()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats.shed_timeout += 1
+                raise Overloaded("queue_timeout")
+            raise
+        return self._admit(kind, started)
+
+    def _admit(self, kind: str, started: float) -> Slot:
+        queue_time = time.monotonic() - started
+        self._queue_times.append(queue_time)
+        self.stats.admitted += 1
+        return Slot(kind, queue_time)
+
+    def _grant(self) -> None:
+        """Wake queued calls while there is room under the limit"""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def release(self, slot: Slot, error: Optional[BaseException]) -> None:
+        self.in_flight -= 1
+        if self.enabled:
+            self._update(slot, error)
+        self._grant()
+
+    def _update(self, slot: Slot, error: Optional[BaseException]) -> None:
+        now = time.monotonic()
+        if is_overload(error):
+            self.stats.overloads += 1
+            self._decrease(now, "agent overload")
+            return
+        if error is not None or slot.latency is None:
+            return
+
+        samples = self._samples.setdefault(slot.kind, deque(maxlen=self.config.agent_latency_window))
+        samples.append(slot.latency)
+        smoothed = self._smoothed.get(slot.kind, slot.latency)
+        smoothed = self._smoothed[slot.kind] = 0.8 * smoothed + 0.2 * slot.latency
+        baseline = sorted(samples)[len(samples) // 10]
+
+        if slot.kind == "run":
+            tolerance = self.config.agent_run_latency_tolerance
+        else:
+            tolerance = self.config.agent_latency_tolerance
+        if tolerance > 0 and len(samples) >= 10 and smoothed > tolerance * baseline:
+            self._decrease(now, f"latency {smoothed:.2f}s vs {baseline:.2f}s baseline")
+        elif self.in_flight + 1 >= int(self.limit) and self.limit < self.config.agent_concurrency_max:
+            # Additive increase: +1 per `limit` successful calls at full utilization
+            self.limit = min(self.limit + 1.0 / self.limit, float(self.config.agent_concurrency_max))
+            self.stats.increases += 1
+
+    def _decrease(self, now: float, reason: str) -> None:
+        # Не чаще одного раза за типичную задержку вызова: ответы, начатые
+        # до снижения лимита, не должны снижать его повторно
+        baseline = min((min(samples) for samples in self._samples.values() if samples), default=0.0)
+        if now - self._last_decrease < max(baseline, 0.5):
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.limit * self.config.agent_backoff_ratio, float(self.config.agent_concurrency_min))
+        self.stats.decreases += 1
+        logger.info(f"Agent concurrency limit {previous:.1f} -> {self.limit:.1f} ({reason})")
+
+    def snapshot(self) -> Dict[str, float]:
+        """Limit, occupancy, queue time percentiles and shedding counters"""
+        queue_times = sorted(self._queue_times)
+
+        def percentile(q: float) -> float:
+            if not queue_times:
+                return 0.0
+            return round(queue_times[min(int(q * len(queue_times)), len(queue_times) - 1)] * 1000, 1)
+
+        return {
+            "enabled": self.enabled,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued_now": len(self._waiters),
+            "queue_size": self.config.agent_queue_size,
+            "admitted": self.stats.admitted,
+            "queued": self.stats.queued,
+            "shed_queue_full": self.stats.shed_queue_full,
+            "shed_timeout": self.stats.shed_timeout,
+            "queue_time_p50_ms": percentile(0.5),
+            "queue_time_p95_ms": percentile(0.95),
+            "queue_time_max_ms": round(queue_times[-1] * 1000, 1) if queue_times else 0.0,
+            "increases": self.stats.increases,
+            "decreases": self.stats.decreases,
+            "overloads": self.stats.overloads,
+        }
+
+
+class _Admission:
+    def __init__(self, limiter: AdaptiveLimiter, kind: str):
+        self.limiter = limiter
+        self.kind = kind
+        self.slot: Optional[Slot] = None
+
+    async def __aenter__(self) -> Slot:
+        self.slot = await self.limiter.acquire(self.kind)
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.slot.mark()
+        self.limiter.release(self.slot, exc)
+
+
+def is_overload(error: Optional[BaseException]) -> bool:
+    """Whether the upstream error means the agent (or OpenAI behind it) is saturated"""
+    if isinstance(error, httpx.TimeoutException):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in OVERLOAD_STATUS_CODES
+    return False
+
+
+# Глобальные ограничители: частота запросов клиентов и одновременные вызовы агента
+client_limiter = ClientRateLimiter(settings)
+agent_limiter = AdaptiveLimiter(settings)
@@ -0,0 +1,218 @@
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import msgspec
+
+from config import Settings, settings
+from metrics import metrics
+from tracing import inject_headers
+
+logger = logging.getLogger(__name__)
+
+
+# Схема ответа LangFlow: только путь до текста ответа. Остальные поля (artifacts, logs,
+# content_blocks с результатами инструментов и т.д.) декодер пропускает, не создавая объектов
+class MessageData(msgspec.Struct):
+    text: str
+
+
+class Message(msgspec.Struct):
+    data: MessageData
+
+
+class Results(msgspec.Struct):
+    message: Message
+
+
+class ComponentOutput(msgspec.Struct):
+    results: Results
+
+
+class FlowOutput(msgspec.Struct):
+    outputs: List[ComponentOutput]
+
+
+class RunResponse(msgspec.Struct):
+    """The part of a LangFlow run response the backend reads"""
+    outputs: List[FlowOutput]
+
+
+class StreamEvent(msgspec.Struct):
+    """One LangFlow stream event; `data` stays undecoded until it is needed
+
+    Most events (add_message, end_vertex, ...) carry whole messages with
+    their content blocks and are only passed over.
+    """
+    event: str = ""
+    data: msgspec.Raw = msgspec.Raw(b"null")
+
+
+class TokenData(msgspec.Struct):
+    chunk: str = ""
+
+
+class EndData(msgspec.Struct):
+    result: RunResponse
+
+
+run_decoder = msgspec.json.Decoder(RunResponse)
+event_decoder = msgspec.json.Decoder(StreamEvent)
+token_decoder = msgspec.json.Decoder(TokenData)
+end_decoder = msgspec.json.Decoder(EndData)
+
+
+class AgentClient:
+    """Shared async HTTP client for the LangFlow agent
+
+    Keeps one long-lived httpx.AsyncClient per process so that keep-alive
+    connections to LangFlow are reused between chat requests instead of
+    opening a new TCP connection for every call.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        """Create the pooled client (called from the application lifespan)"""
+        if self._client is not None:
+            return
+
+        limits = httpx.Limits(
+            max_connections=self.config.agent_max_connections,
+            max_keepalive_connections=self.config.agent_max_keepalive_connections,
+            keepalive_expiry=self.config.agent_keepalive_expiry,
+        )
+        timeout = httpx.Timeout(
+            self.config.request_timeout,
+            connect=self.config.agent_connect_timeout,
+        )
+        self._client = httpx.AsyncClient(
+            limits=limits,
+            timeout=timeout,
+            headers={
+                "Content-Type": "application/json",
+                "x-api-key": self.config.external_api_key,
+            },
+        )
+        logger.info(
+            f"Agent client started (max_connections={self.config.agent_max_connections}, "
+            f"max_keepalive={self.config.agent_max_keepalive_connections})"
+        )
+
+    async def close(self) -> None:
+        """Close pooled connections (called on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Agent client closed")
+
+    @property
+    def health_url(self) -> str:
+        """Health endpoint of the LangFlow instance serving the flow"""
+        return self.config.external_api_url.split("/api/v1/run")[0] + "/health"
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Agent client is not started")
+        return self._client
+
+    async def run(self, payload: Dict[str, Any]) -> bytes:
+        """Send a run request to the agent flow and return the raw response body
+
+        The body is parsed with `extract_message_text`, which reads only the
+        answer text instead of building the whole outputs tree.
+
+        The trace context is passed to LangFlow in the traceparent header.
+
+        Raises:
+            httpx.TimeoutException: Upstream did not answer in time
+            httpx.TransportError: Connection to upstream failed
+            httpx.HTTPStatusError: Upstream answered with an error status
+        """
+        with metrics.upstream_call("agent", "run"):
+            response = await self.client.post(self.config.external_api_url, json=payload, headers=inject_headers())
+            response.raise_for_status()
+            return response.content
+
+    async def open_stream(self, payload: Dict[str, Any]) -> httpx.Response:
+        """Start a run in LangFlow stream mode and return the open response
+
+        The status is checked before returning, so upstream errors surface
+        here with the same exceptions as `run`. The caller must close the
+        response (see `iter_stream_events`).
+        """
+        with metrics.upstream_call("agent", "stream"):
+            request = self.client.build_request(
+                "POST",
+                self.config.external_api_url,
+                params={"stream": "true"},
+                json=payload,
+                headers=inject_headers(),
+            )
+            response = await self.client.send(request, stream=True)
+            if response.is_error:
+                await response.aread()
+                await response.aclose()
+                response.raise_for_status()
+        return response
+
+
+async def iter_stream_events(response: httpx.Response) -> AsyncIterator[StreamEvent]:
+    """Yield LangFlow stream events and close the response"""
+    try:
+        async for line in response.aiter_lines():
+            line = line.strip()
+            if line.startswith("data:"):
+                line = line[len("data:"):].strip()
+            if not line:
+                continue
+            try:
+                yield event_decoder.decode(line)
+            except msgspec.DecodeError:
+                logger.warning(f"Skipping malformed stream line from external API: {line[:200]}")
+    finally:
+        await response.aclose()
+
+
+def message_text(run: RunResponse) -> str:
+    """Answer text of a decoded run response
+
+    Raises:
+        ValueError: The response has no outputs
+    """
+    if not run.outputs or not run.outputs[0].outputs:
+        raise ValueError("Run response has no outputs")
+    return run.outputs[0].outputs[0].results.message.data.text
+
+
+def extract_message_text(body: bytes) -> str:
+    """Extract the answer text from a LangFlow run response body
+
+    Raises:
+        ValueError: Not JSON or unexpected response structure
+    """
+    return message_text(run_decoder.decode(body))
+
+
+def token_chunk(event: StreamEvent) -> str:
+    """Text chunk of a token stream event, empty for an unexpected structure"""
+    try:
+        return token_decoder.decode(event.data).chunk
+    except msgspec.ValidationError:
+        return ""
+
+
+def end_message_text(event: StreamEvent) -> str:
+    """Whole answer text carried by the end stream event
+
+    Raises:
+        ValueError: Unexpected event structure
+    """
+    return message_text(end_decoder.decode(event.data).result)
+
+
+# Глобальный клиент агента
+agent_client = AgentClient(settings)
@@ -0,0 +1,305 @@
+import json
+import logging
+import math
+import re
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, Tuple[str, ...], str]
+
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d")
+
+# Слова, меняющие смысл вопроса на противоположный при почти том же написании
+NEGATIONS = frozenset({"не", "нет", "ни", "без", "нельзя", "запрещено", "противопоказан", "противопоказано"})
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercase, unify ё/е and drop punctuation and extra whitespace"""
+    if not text:
+        return ""
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return " ".join(words)
+
+
+def make_cache_key(animal: Optional[str], symptoms: List[str], question: str) -> CacheKey:
+    """Normalized (animal, symptoms, question) key; symptom order does not matter"""
+    normalized_symptoms = sorted({normalize_text(s) for s in symptoms if normalize_text(s)})
+    return normalize_text(animal), tuple(normalized_symptoms), normalize_text(question)
+
+
+def exact_terms(text: str) -> Tuple[str, ...]:
+    """Numbers and negations of a normalized question, in order
+
+    Character n-grams barely notice "0 2 мг" versus "2 мг" or "чем лечить"
+    versus "чем не лечить", so the similarity tier only matches questions
+    whose exact terms are equal.
+    """
+    return tuple(word for word in text.split() if word in NEGATIONS or _NUMBER_RE.search(word))
+
+
+def embed_text(text: str, ngram: int = 3) -> Dict[int, float]:
+    """Hashed character n-gram embedding as a sparse unit vector
+
+    Cheap and dependency-free; good enough to match rephrasings and typos of
+    the same short question, which is what the similarity tier is for; the
+    meaning-changing words are compared separately (see `exact_terms`).
+    """
+    vector: Dict[int, float] = {}
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(max(len(padded) - ngram + 1, 1)):
+            bucket = zlib.crc32(padded[i:i + ngram].encode("utf-8"))
+            vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if norm:
+        for bucket in vector:
+            vector[bucket] /= norm
+    return vector
+
+
+@lru_cache(maxsize=4096)
+def cached_embedding(text: str) -> Dict[int, float]:
+    """embed_text of questions read back from Redis, computed once per process (do not mutate)"""
+    return embed_text(text)
+
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """Cosine similarity of two sparse unit vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+@dataclass
+class CacheEntry:
+    key: CacheKey
+    answer: str
+    embedding: Dict[int, float]
+    created_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class CacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    stores: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+
+class AnswerCache:
+    """Answer cache with an exact tier and a similarity tier
+
+    Entries live in one LRU-ordered dict bounded by `cache_max_entries` and
+    expire after `cache_ttl_seconds`. The similarity tier is off by default
+    (`cache_similarity_threshold` 1.0); when enabled it only compares
+    questions within the same (animal, symptoms) group with the same numbers
+    and negations, so an answer is never served across animal types, doses
+    or "do" versus "do not".
+
+    With a shared Redis connection (STATE_BACKEND=redis, see `start`) the
+    entries are kept in Redis instead, so all workers serve the same
+    answers: one hash per (animal, symptoms) group, fields are normalized
+    questions, values are [stored_at, answer]. A group expires
+    `cache_ttl_seconds` after its last write, older fields are dropped when
+    read; the total size is bounded by the Redis maxmemory policy rather than
+    `cache_max_entries`.
+    """
+
+    def __init__(self, config: Settings, prefix: str = "tailsense:cache:"):
+        self.config = config
+        self.prefix = prefix
+        self.stats = CacheStats()
+        self.shared = None
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        # (animal, symptoms) -> keys of entries in that group
+        self._groups: Dict[Tuple[str, Tuple[str, ...]], set] = {}
+
+    def start(self, shared=None) -> None:
+        """Keep the entries in Redis (a redis.asyncio client) instead of this process"""
+        self.shared = shared
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.cache_enabled and self.config.cache_max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.config.cache_ttl_seconds
+
+    def _remove(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        group = self._groups.get(key[:2])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._groups[key[:2]]
+
+    def get(self, key: CacheKey) -> Tuple[Optional[str], str]:
+        """Look up an answer
+
+        Returns:
+            (answer, tier) where tier is "exact", "semantic" or "miss"
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._expired(entry):
+                self._remove(key)
+                self.stats.expirations += 1
+            else:
+                self._entries.move_to_end(key)
+                self.stats.exact_hits += 1
+                return entry.answer, "exact"
+
+        threshold = self.config.cache_similarity_threshold
+        if threshold < 1.0:
+            query = embed_text(key[2])
+            terms = exact_terms(key[2])
+            best_key, best_score = None, threshold
+            for candidate_key in list(self._groups.get(key[:2], ())):
+                candidate = self._entries[candidate_key]
+                if self._expired(candidate):
+                    self._remove(candidate_key)
+                    self.stats.expirations += 1
+                    continue
+                if exact_terms(candidate_key[2]) != terms:
+                    continue
+                score = cosine(query, candidate.embedding)
+                if score >= best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.stats.semantic_hits += 1
+                return self._entries[best_key].answer, "semantic"
+
+        self.stats.misses += 1
+        return None, "miss"
+
+    async def lookup(self, key: CacheKey) -> Tuple[Optional[str], str]:
+        """Look up an answer in Redis when shared, else in this process (see `get`)"""
+        if self.shared is None:
+            return self.get(key)
+
+        group_key = self._shared_key(key)
+        if self.config.cache_similarity_threshold < 1.0:
+            fields = await self.shared.hgetall(group_key)
+        else:
+            value = await self.shared.hget(group_key, key[2])
+            fields = {key[2].encode("utf-8"): value} if value is not None else {}
+
+        answers: Dict[str, str] = {}
+        expired = []
+        now = time.time()
+        for question, value in fields.items():
+            stored_at, answer = json.loads(value)
+            if now - stored_at > self.config.cache_ttl_seconds:
+                expired.append(question)
+            else:
+                answers[question.decode("utf-8")] = answer
+        if expired:
+            self.stats.expirations += len(expired)
+            await self.shared.hdel(group_key, *expired)
+
+        if key[2] in answers:
+            self.stats.exact_hits += 1
+            return answers[key[2]], "exact"
+        match = self._most_similar(key[2], answers)
+        if match is not None:
+            self.stats.semantic_hits += 1
+            return answers[match], "semantic"
+        self.stats.misses += 1
+        return None, "miss"
+
+    def _most_similar(self, question: str, candidates: Iterable[str]) -> Optional[str]:
+        """Candidate question closest to the question above the similarity threshold"""
+        threshold = self.config.cache_similarity_threshold
+        if threshold >= 1.0:
+            return None
+        query = embed_text(question)
+        terms = exact_terms(question)
+        best, best_score = None, threshold
+        for candidate in candidates:
+            if exact_terms(candidate) != terms:
+                continue
+            score = cosine(query, cached_embedding(candidate))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _shared_key(self, key: CacheKey) -> str:
+        return self.prefix + json.dumps([key[0], list(key[1])], ensure_ascii=False, separators=(",", ":"))
+
+    async def store(self, key: CacheKey, answer: str) -> None:
+        """Store an answer in Redis when shared, else in this process (see `put`)"""
+        if self.shared is None:
+            self.put(key, answer)
+            return
+        if not answer or not key[2]:
+            return
+        group_key = self._shared_key(key)
+        value = json.dumps([round(time.time(), 3), answer], ensure_ascii=False)
+        async with self.shared.pipeline(transaction=False) as pipe:
+            pipe.hset(group_key, key[2], value)
+            pipe.expire(group_key, self.config.cache_ttl_seconds)
+            await pipe.execute()
+        self.stats.stores += 1
+
+    def put(self, key: CacheKey, answer: str) -> None:
+        """Store an answer, evicting the least recently used entries if full"""
+        if not answer or not key[2]:
+            return
+        self._remove(key)
+        self._entries[key] = CacheEntry(key=key, answer=answer, embedding=embed_text(key[2]))
+        self._groups.setdefault(key[:2], set()).add(key)
+        self.stats.stores += 1
+
+        while len(self._entries) > self.config.cache_max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats.evictions += 1
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._groups.clear()
+        if self.shared is not None:
+            keys = [key async for key in self.shared.scan_iter(match=self.prefix + "*", count=500)]
+            if keys:
+                await self.shared.delete(*keys)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Hit/miss counters and current size"""
+        lookups = self.stats.exact_hits + self.stats.semantic_hits + self.stats.misses
+        hits = self.stats.exact_hits + self.stats.semantic_hits
+        result = {
+            "enabled": self.enabled,
+            "backend": "redis" if self.shared is not None else "memory",
+            "exact_hits": self.stats.exact_hits,
+            "semantic_hits": self.stats.semantic_hits,
+            "misses": self.stats.misses,
+            "bypassed": self.stats.bypassed,
+            "stores": self.stats.stores,
+            "evictions": self.stats.evictions,
+            "expirations": self.stats.expirations,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.shared is None:
+            result["size"] = len(self._entries)
+            result["max_entries"] = self.config.cache_max_entries
+        return result
+
+
+# Глобальный кэш ответов агента
+answer_cache = AnswerCache(settings)
@@ -0,0 +1,138 @@
+"""
+Prompt size of long consultations: the old frontend context message versus
+the agent input the backend builds from the session (context_builder),
+without LLM calls.
+
+Consultations are replayed from the benchmark.yaml question/answer pairs
+through a memory SessionStore; answers are padded with the following
+reference answers up to --answer-chars, as real agent answers are longer
+than the references. The LangFlow agent memory is simulated: it stores
+every input_value and answer the agent produced in the session and puts
+the last n_messages of them into the prompt. Reported per variant:
+
+    request    mean / max tokens of the input_value sent to the agent
+    prompt     mean / max tokens the agent LLM receives (memory + request)
+    total      prompt tokens summed over all turns of all consultations
+
+--cached-every N answers every Nth turn without the agent (answer cache or
+a coalesced call): the turn is stored in the session but not in the agent
+memory, so the next agent input carries it.
+
+Usage (from the backend directory, needs pyyaml):
+    python -m bench.context_replay --turns 40
+    python -m bench.context_replay --turns 80 --cached-every 5
+"""
+
+import argparse
+import asyncio
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List
+
+import yaml
+
+from config import Settings
+from context_builder import build_agent_input, estimate_tokens
+from session_store import SessionStore
+
+ANIMAL = "Корова"
+SYMPTOMS = ["Лихорадка", "Слюнотечение", "Хромота", "Снижение аппетита"]
+
+
+def legacy_context_message(animal: str, symptoms: List[str], message: str, history: List[Dict[str, Any]]) -> str:
+    """The context message as the frontend built it before the builder"""
+    parts = [f"Животное: {animal}", f"Наблюдаемые симптомы: {', '.join(symptoms)}"]
+    if history:
+        parts.append("Предыдущие сообщения:")
+        for msg in history[-4:]:
+            role = "Пользователь" if msg["role"] == "user" else "Ветеринар"
+            parts.append(f"{role}: {msg['content']}")
+    parts.append(f"Текущий вопрос: {message}")
+    return "\n".join(parts)
+
+
+def consultations(items: List[Dict[str, str]], count: int, turns: int, answer_chars: int):
+    """Question/answer sequences cycling through the benchmark items"""
+    for c in range(count):
+        dialog = []
+        for t in range(turns):
+            i = (c * turns + t) % len(items)
+            answer, j = items[i]["answer"], i
+            while len(answer) < answer_chars:
+                j = (j + 1) % len(items)
+                answer += " " + items[j]["answer"]
+            dialog.append((items[i]["question"], answer))
+        yield dialog
+
+
+async def replay(dialog, variant: str, config: Settings, cached_every: int) -> List[Dict[str, int]]:
+    """Runs one consultation, returns request and prompt tokens per agent turn"""
+    store = SessionStore(config)
+    await store.start()
+    history: List[Dict[str, Any]] = []
+    memory: List[str] = []
+    window = config.agent_memory_messages if config.agent_memory else 0
+    turns = []
+    for turn, (question, answer) in enumerate(dialog):
+        record = await store.get("s") or await store.update_profile("s", ANIMAL, SYMPTOMS)
+        agent_answered = not (cached_every and turn % cached_every == cached_every - 1)
+        if agent_answered:
+            if variant == "legacy":
+                request = legacy_context_message(ANIMAL, SYMPTOMS, question, history)
+            else:
+                request = build_agent_input(record, question, config, ANIMAL, SYMPTOMS)
+            recalled = memory[-window:] if window else []
+            turns.append({
+                "request": estimate_tokens(request),
+                "prompt": estimate_tokens(request) + sum(estimate_tokens(item) for item in recalled),
+            })
+            memory += [request, answer]
+        await store.append_turn("s", question, answer, agent_answered=agent_answered)
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    await store.close()
+    return turns
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, default=Path("../notebooks/benchmark.yaml"))
+    parser.add_argument("--consultations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--answer-chars", type=int, default=1500)
+    parser.add_argument("--cached-every", type=int, default=0, help="Answer every Nth turn without the agent")
+    parser.add_argument("--window", type=int, default=Settings().agent_memory_messages,
+                        help="n_messages of the agent memory")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        items = yaml.safe_load(f)["questions"]
+    dialogs = list(consultations(items, args.consultations, args.turns, args.answer_chars))
+
+    config = Settings(session_backend="memory", agent_memory_messages=args.window)
+    variants = {
+        "legacy (last 4 messages)": ("legacy", config),
+        "builder": ("builder", config),
+        "builder, agent without memory": ("builder", Settings(**{**config.model_dump(), "agent_memory": False})),
+    }
+
+    print(f"{len(dialogs)} consultations x {args.turns} turns, answers ~{args.answer_chars} chars, "
+          f"agent memory {args.window} messages, budget {config.context_max_tokens} tokens")
+    print(f"{'variant':<32} {'request':>13} {'prompt':>15} {'total':>11}")
+    baseline = None
+    for name, (variant, variant_config) in variants.items():
+        turns = [
+            turn for dialog in dialogs
+            for turn in asyncio.run(replay(dialog, variant, variant_config, args.cached_every))
+        ]
+        requests = [turn["request"] for turn in turns]
+        prompts = [turn["prompt"] for turn in turns]
+        total = sum(prompts)
+        baseline = baseline or total
+        print(
+            f"{name:<32} {statistics.mean(requests):>6.0f} / {max(requests):>5} "
+            f"{statistics.mean(prompts):>7.0f} / {max(prompts):>5} {total:>11} ({total / baseline - 1:+.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark of PDF ingestion with a local fake embedder.
+
+Compares the notebook approach (parse the whole file, then embed and upsert
+batches of 30 one at a time) with the pipelined rag.ingest, checks that an
+interrupted pipeline run resumes without re-embedding stored chunks, and
+measures the persistent embedding cache and incremental re-ingestion of an
+unchanged file and of an edited edition (one page removed). Embedding and upsert latency are simulated, no
+network is used.
+
+Usage (from the backend directory):
+    python -m bench.ingest_bench ../data_sourse/papers --call-latency 0.3
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from pypdf import PdfReader, PdfWriter
+
+from rag.embedding_cache import with_cache
+from rag.embeddings import FakeEmbedder
+from rag.ingest import IngestConfig, IngestPipeline, MemorySink, collect_pdfs, count_pages, parse_page_range
+
+
+async def sequential_baseline(paths, embedder, sink, config: IngestConfig) -> int:
+    """Notebook-style ingestion: one file, one batch of 30 at a time"""
+    stored = 0
+    for path in paths:
+        pages = count_pages(str(path))
+        chunks = parse_page_range(str(path), 0, pages, config.chunk_size, config.chunk_overlap)
+        for i in range(0, len(chunks), 30):
+            batch = chunks[i:i + 30]
+            vectors = await embedder.embed([text for _, text in batch])
+            await sink.upsert([
+                {"id": f"{path.name}:{i + j}", "vector": vector, "payload": {"file_hash": path.name}}
+                for j, vector in enumerate(vectors)
+            ])
+            stored += len(batch)
+    return stored
+
+
+class CrashingSink(MemorySink):
+    """Memory sink that fails after a number of upserts, to test resume"""
+
+    def __init__(self, crash_after: int, upsert_latency: float = 0.0):
+        super().__init__(upsert_latency)
+        self.crash_after = crash_after
+
+    async def upsert(self, points):
+        if self.upserts >= self.crash_after:
+            raise RuntimeError("simulated crash")
+        await super().upsert(points)
+
+
+def write_edited_edition(path: Path, target_dir: Path, removed_page: int) -> Path:
+    """Copy of the PDF with one page removed, under the same file name"""
+    reader = PdfReader(str(path))
+    writer = PdfWriter()
+    for page_number, page in enumerate(reader.pages):
+        if page_number != removed_page:
+            writer.add_page(page)
+    edited = target_dir / path.name
+    with open(edited, "wb") as f:
+        writer.write(f)
+    return edited
+
+
+def make_embedder(args) -> FakeEmbedder:
+    return FakeEmbedder(dim=args.dim, call_latency=args.call_latency, text_latency=args.text_latency)
+
+
+def make_config(args, state_dir: Path) -> IngestConfig:
+    return IngestConfig(
+        parse_workers=args.parse_workers,
+        embed_workers=args.embed_workers,
+        batch_size=args.batch_size,
+        pages_per_task=args.pages_per_task,
+        state_dir=state_dir,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", default=["../data_sourse/papers"])
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding size (1536 in production)")
+    parser.add_argument("--call-latency", type=float, default=0.3, help="Simulated latency per embedding call")
+    parser.add_argument("--text-latency", type=float, default=0.002, help="Simulated latency per embedded text")
+    parser.add_argument("--upsert-latency", type=float, default=0.05, help="Simulated latency per upsert")
+    parser.add_argument("--parse-workers", type=int, default=IngestConfig.parse_workers)
+    parser.add_argument("--embed-workers", type=int, default=IngestConfig.embed_workers)
+    parser.add_argument("--batch-size", type=int, default=IngestConfig.batch_size)
+    parser.add_argument("--pages-per-task", type=int, default=IngestConfig.pages_per_task)
+    parser.add_argument("--removed-page", type=int, default=100, help="Page dropped in the edited edition")
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    paths = [path for path, _ in collect_pdfs(args.inputs)]
+    print(f"Files: {', '.join(p.name for p in paths)}")
+    print(f"{'mode':<24} {'time, s':>8} {'embedded':>9} {'moved':>6} {'removed':>8} {'embed calls':>12}")
+
+    def row(mode, seconds, embedded, calls, moved=0, removed=0):
+        print(f"{mode:<24} {seconds:>8.1f} {embedded:>9} {moved:>6} {removed:>8} {calls:>12}")
+
+    def run_pipeline(mode, embedder, sink, state_dir, run_paths):
+        started = time.perf_counter()
+        reports = asyncio.run(IngestPipeline(embedder, sink, make_config(args, Path(state_dir))).run(run_paths))
+        row(mode, time.perf_counter() - started, sum(r.added for r in reports), embedder.calls,
+            sum(r.moved for r in reports), sum(r.removed for r in reports))
+        return reports
+
+    if not args.skip_baseline:
+        embedder, sink = make_embedder(args), MemorySink(args.upsert_latency)
+        started = time.perf_counter()
+        stored = asyncio.run(sequential_baseline(paths, embedder, sink, IngestConfig()))
+        row("sequential (notebook)", time.perf_counter() - started, stored, embedder.calls)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        sink = MemorySink(args.upsert_latency)
+        run_pipeline("pipeline", make_embedder(args), sink, state_dir, paths)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Empty collection each time; the second run reads all vectors from the embedding cache
+        for mode in ("embedding cache, cold", "embedding cache, warm"):
+            with tempfile.TemporaryDirectory() as state_dir:
+                embedder = with_cache(make_embedder(args), Path(cache_dir))
+                run_pipeline(mode, embedder, MemorySink(args.upsert_latency), state_dir, paths)
+
+    with tempfile.TemporaryDirectory() as state_dir, tempfile.TemporaryDirectory() as edited_dir:
+        # Fresh state dir: the file is parsed again, but nothing is embedded
+        run_pipeline("re-ingest, unchanged", make_embedder(args), sink, state_dir, paths)
+
+        edited = [write_edited_edition(path, Path(edited_dir), args.removed_page) for path in paths]
+        run_pipeline("re-ingest, page removed", make_embedder(args), sink, state_dir, edited)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        embedder, sink = make_embedder(args), CrashingSink(crash_after=3, upsert_latency=args.upsert_latency)
+        started = time.perf_counter()
+        try:
+            asyncio.run(IngestPipeline(embedder, sink, make_config(args, Path(state_dir))).run(paths))
+        except Exception:
+            pass
+        row("pipeline, crashed", time.perf_counter() - started, len(sink.points), embedder.calls)
+
+        # Resume with the same state dir; only the missing chunks are embedded
+        resumed_sink = MemorySink(args.upsert_latency)
+        resumed_sink.points = dict(sink.points)
+        reports = run_pipeline("pipeline, resumed", make_embedder(args), resumed_sink, state_dir, paths)
+        print(f"Total after resume: {len(resumed_sink.points)} points ({', '.join(r.status for r in reports)})")
+
+
+if __name__ == "__main__":
+    main()
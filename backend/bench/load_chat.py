@@ -0,0 +1,384 @@
+"""
+Latency and throughput load test for POST /api/v1/chat.
+
+Starts a local stub agent (bench.stub_agent, with injectable latency and
+error rates) and the backend as subprocesses, one uvicorn worker each, then
+replays the benchmark.yaml questions against the backend at each load level
+and reports p50/p95/p99 latency, throughput, the error breakdown by the
+backend's status mapping (429 rate limit, 503 timeout/unreachable, 500 other
+upstream errors) and event-loop lag.
+
+Load levels are either closed-loop (`--concurrency 20 50 200`: that many vets,
+each sends the next question as soon as the previous answer arrives) or
+open-loop (`--rate 5 20`: Poisson arrivals per second, independent of how
+fast the backend answers). Event-loop lag is measured by probing GET /health,
+which does no network I/O, while the level runs: a blocking call inside a
+handler shows up as probe latency far above the idle baseline.
+
+Every virtual vet sends its own X-Client-Id, as the frontend does, so the
+backend's per-client rate limit (--client-rate, off by default) applies per
+vet; the load generator runs on the loopback address, which the default
+TRUSTED_PROXIES trusts. After each level the
+adaptive agent concurrency limit, the p95 wait in its queue and the number
+of calls shed with 503 are read from GET /api/v1/admission.
+
+--workers 1 2 4 repeats all levels against a backend started with that many
+uvicorn worker processes (WEB_CONCURRENCY) and prints the throughput of each
+level relative to one worker. To measure backend CPU rather than agent
+latency, make the agent fast and its answers long (--latency 0.02
+--answer-chars 20000) and run on a box with spare cores: the stub agent
+(started with as many workers) and the load generator use CPU too. With
+several workers the admission figures come from whichever worker answered
+GET /api/v1/admission.
+
+Usage (from the backend directory):
+    python -m bench.load_chat --latency 0.5 --concurrency 20 50 200
+    python -m bench.load_chat --rate 10 50 --errors "429=0.05,500=0.02,timeout=0.01" --backend-timeout 5
+    python -m bench.load_chat --concurrency 50 --max-p95 1.5 --max-lag 0.05   # non-zero exit on regression
+    python -m bench.load_chat --rate 50 100 --agent-limit 10 --queue-size 20 --client-rate 0.5
+    python -m bench.load_chat --workers 1 2 4 --latency 0.02 --answer-chars 20000 --concurrency 64 --duration 15
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import yaml
+
+STATUS_GROUPS = ("200", "429", "503", "500", "other", "client_error")
+
+
+def wait_for(url: str, timeout: float = 15.0) -> None:
+    """Waits until the service answers on the given URL"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Service at {url} did not start in {timeout}s")
+
+
+@contextmanager
+def spawn_services(args, workers: int = 1):
+    """Runs the stub agent and the backend (with that many worker processes) for the duration of the test"""
+    env = dict(os.environ)
+    env["STUB_LATENCY"] = str(args.latency)
+    env["STUB_JITTER"] = str(args.jitter)
+    env["STUB_ERRORS"] = args.errors
+    env["STUB_ANSWER_CHARS"] = str(args.answer_chars)
+    env["EXTERNAL_API_URL"] = f"http://127.0.0.1:{args.stub_port}/api/v1/run/stub-flow"
+    if args.backend_timeout is not None:
+        env["REQUEST_TIMEOUT"] = str(args.backend_timeout)
+    env["CLIENT_RATE_LIMIT"] = str(args.client_rate)
+    if args.agent_limit is not None:
+        env["AGENT_CONCURRENCY_INITIAL"] = str(args.agent_limit)
+    if args.queue_size is not None:
+        env["AGENT_QUEUE_SIZE"] = str(args.queue_size)
+
+    uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning", "--host", "127.0.0.1",
+               "--workers", str(workers)]
+    quiet = {"env": env, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    processes = [
+        subprocess.Popen(uvicorn + ["bench.stub_agent:app", "--port", str(args.stub_port)], **quiet),
+        subprocess.Popen(uvicorn + ["main:app", "--port", str(args.backend_port)], **quiet),
+    ]
+    try:
+        wait_for(f"http://127.0.0.1:{args.stub_port}/health")
+        wait_for(f"http://127.0.0.1:{args.backend_port}/health")
+        yield f"http://127.0.0.1:{args.backend_port}"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                # The stub keeps injected "timeout" requests hanging, don't wait for them
+                process.kill()
+                process.wait()
+
+
+def load_questions(path: Path) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [item["question"] for item in yaml.safe_load(f)["questions"]]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def status_group(status_code: int) -> str:
+    key = str(status_code)
+    return key if key in STATUS_GROUPS else "other"
+
+
+class LevelRecorder:
+    """Latencies and status counts of one load level"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ok_latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.probes: List[float] = []
+
+    async def send(self, client: httpx.AsyncClient, question: str, use_cache: bool, vet: int) -> None:
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                "/api/v1/chat",
+                json={"input_value": question, "use_cache": use_cache},
+                headers={"X-Client-Id": f"vet-{vet}"},
+            )
+            group = status_group(response.status_code)
+        except httpx.HTTPError:
+            group = "client_error"
+        latency = time.perf_counter() - started
+        self.latencies.append(latency)
+        self.statuses[group] += 1
+        if group == "200":
+            self.ok_latencies.append(latency)
+
+
+def probe_loop(base_url: str, recorder: LevelRecorder, interval: float, stop: threading.Event) -> None:
+    """Measures GET /health latency until `stop` is set.
+
+    Runs in its own thread with a blocking client, so the load generator's
+    busy event loop does not inflate the measurement.
+    """
+    with httpx.Client(base_url=base_url, timeout=30.0) as client:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                client.get("/health")
+                recorder.probes.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                pass
+            stop.wait(interval)
+
+
+async def idle_probe_baseline(base_url: str, samples: int = 20) -> float:
+    """Median /health latency with no load, subtracted from probes to get lag"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0) as client:
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            await client.get("/health")
+            timings.append(time.perf_counter() - started)
+            await asyncio.sleep(0.02)
+    return statistics.median(timings)
+
+
+def admission_snapshot(base_url: str) -> Optional[Dict[str, Any]]:
+    """Agent admission counters of the backend, None if it does not expose them"""
+    try:
+        response = httpx.get(f"{base_url}/api/v1/admission", timeout=5.0)
+        response.raise_for_status()
+        return response.json()["agent"]
+    except (httpx.HTTPError, KeyError, ValueError):
+        return None
+
+
+async def run_level(base_url: str, questions: List[str], args, concurrency: int = 0, rate: float = 0) -> Dict[str, Any]:
+    """Runs one closed-loop (concurrency) or open-loop (rate) level for args.duration seconds"""
+    recorder = LevelRecorder()
+    limits = httpx.Limits(max_connections=concurrency or None, max_keepalive_connections=concurrency or 100)
+    stop_probe = threading.Event()
+    counter = iter(range(10 ** 9))
+
+    def next_question() -> str:
+        return questions[next(counter) % len(questions)]
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        probe = threading.Thread(target=probe_loop, args=(base_url, recorder, args.probe_interval, stop_probe))
+        probe.start()
+        started = time.perf_counter()
+        deadline = started + args.duration
+
+        if concurrency:
+            async def vet(number: int) -> None:
+                while time.perf_counter() < deadline:
+                    await recorder.send(client, next_question(), args.use_cache, number)
+
+            await asyncio.gather(*(vet(number) for number in range(concurrency)))
+        else:
+            in_flight = set()
+            while time.perf_counter() < deadline:
+                vet = random.randrange(args.vets)
+                task = asyncio.create_task(recorder.send(client, next_question(), args.use_cache, vet))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                await asyncio.sleep(random.expovariate(rate))
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+        elapsed = time.perf_counter() - started
+        stop_probe.set()
+        probe.join()
+
+    lags = [max(0.0, probe_time - args.probe_baseline) for probe_time in recorder.probes]
+    return {
+        "admission": admission_snapshot(base_url),
+        "mode": "closed" if concurrency else "open",
+        "concurrency": concurrency or None,
+        "rate": rate or None,
+        "requests": len(recorder.latencies),
+        "elapsed": elapsed,
+        "throughput": recorder.statuses["200"] / elapsed,
+        "latency": {
+            "p50": percentile(recorder.ok_latencies, 0.50),
+            "p95": percentile(recorder.ok_latencies, 0.95),
+            "p99": percentile(recorder.ok_latencies, 0.99),
+            "max": max(recorder.ok_latencies, default=None),
+        },
+        "statuses": {group: recorder.statuses[group] for group in STATUS_GROUPS},
+        "loop_lag": {
+            "probes": len(lags),
+            "p50": percentile(lags, 0.50),
+            "p99": percentile(lags, 0.99),
+            "max": max(lags, default=None),
+        },
+    }
+
+
+def fmt(value: Optional[float], scale: float = 1.0) -> str:
+    return "-" if value is None else f"{value * scale:.2f}"
+
+
+def print_header() -> None:
+    print(
+        f"{'level':>10} {'reqs':>6} {'ok/s':>7} {'p50':>6} {'p95':>6} {'p99':>6} "
+        f"{'429':>5} {'503':>5} {'500':>5} {'other':>5} {'client':>6} {'lag p99,ms':>10} {'lag max,ms':>10} "
+        f"{'limit':>6} {'queue p95,ms':>12} {'shed':>5}"
+    )
+
+
+def print_row(result: Dict[str, Any], shed_before: int = 0) -> None:
+    level = f"c={result['concurrency']}" if result["mode"] == "closed" else f"r={result['rate']:g}/s"
+    latency, statuses, lag = result["latency"], result["statuses"], result["loop_lag"]
+    admission = result["admission"] or {}
+    shed = admission.get("shed_queue_full", 0) + admission.get("shed_timeout", 0) - shed_before
+    print(
+        f"{level:>10} {result['requests']:>6} {result['throughput']:>7.1f} "
+        f"{fmt(latency['p50']):>6} {fmt(latency['p95']):>6} {fmt(latency['p99']):>6} "
+        f"{statuses['429']:>5} {statuses['503']:>5} {statuses['500']:>5} {statuses['other']:>5} "
+        f"{statuses['client_error']:>6} {fmt(lag['p99'], 1000):>10} {fmt(lag['max'], 1000):>10} "
+        f"{fmt(admission.get('limit')):>6} {fmt(admission.get('queue_time_p95_ms')):>12} "
+        f"{shed if admission else '-':>5}"
+    )
+
+
+def print_scaling(results: List[Dict[str, Any]], worker_counts: List[int]) -> None:
+    """Throughput per level and worker count, relative to the first worker count"""
+    print(f"\nThroughput, ok/s (x vs {worker_counts[0]} worker{'s' if worker_counts[0] > 1 else ''})")
+    print(f"{'level':>10} " + " ".join(f"{f'w={workers}':>14}" for workers in worker_counts))
+    levels = [result for result in results if result["workers"] == worker_counts[0]]
+    for index, base in enumerate(levels):
+        level = f"c={base['concurrency']}" if base["mode"] == "closed" else f"r={base['rate']:g}/s"
+        cells = []
+        for workers in worker_counts:
+            result = [r for r in results if r["workers"] == workers][index]
+            ratio = result["throughput"] / base["throughput"] if base["throughput"] else 0.0
+            cells.append(f"{result['throughput']:>7.1f} ({ratio:.2f}x)")
+        print(f"{level:>10} " + " ".join(f"{cell:>14}" for cell in cells))
+
+
+def check_thresholds(results: List[Dict[str, Any]], args) -> List[str]:
+    """Human-readable threshold violations, empty if all levels pass"""
+    failures = []
+    for result in results:
+        level = f"concurrency {result['concurrency']}" if result["mode"] == "closed" else f"rate {result['rate']}"
+        p95, lag_max = result["latency"]["p95"], result["loop_lag"]["max"]
+        if args.max_p95 is not None and (p95 is None or p95 > args.max_p95):
+            failures.append(f"{level}: p95 {fmt(p95)}s > {args.max_p95}s")
+        if args.max_lag is not None and lag_max is not None and lag_max > args.max_lag:
+            failures.append(f"{level}: event-loop lag {lag_max * 1000:.0f}ms > {args.max_lag * 1000:.0f}ms")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=None, help="Closed-loop levels (vets)")
+    parser.add_argument("--rate", type=float, nargs="+", default=None, help="Open-loop levels, requests/s")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--questions", type=Path, default=Path("../notebooks/benchmark.yaml"))
+    parser.add_argument("--use-cache", action="store_true", help="Allow backend answer cache hits")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="Event-loop lag probe interval")
+    parser.add_argument("--vets", type=int, default=100, help="Distinct clients (API keys) in open-loop levels")
+    stub = parser.add_argument_group("stub agent")
+    stub.add_argument("--latency", type=float, default=0.5, help="Stub agent latency, seconds")
+    stub.add_argument("--jitter", type=float, default=0.3, help="Relative latency spread")
+    stub.add_argument("--errors", default="", help='Injected failures, e.g. "429=0.05,500=0.02,timeout=0.01"')
+    stub.add_argument("--answer-chars", type=int, default=0, help="Pad stub answers to this many characters")
+    stub.add_argument("--backend-timeout", type=float, default=None,
+                      help="Backend REQUEST_TIMEOUT, set it low when injecting timeouts")
+    backend = parser.add_argument_group("spawned backend")
+    backend.add_argument("--client-rate", type=float, default=0.0,
+                         help="Backend CLIENT_RATE_LIMIT per vet, requests/s (0: off)")
+    backend.add_argument("--agent-limit", type=int, default=None, help="Backend AGENT_CONCURRENCY_INITIAL")
+    backend.add_argument("--queue-size", type=int, default=None, help="Backend AGENT_QUEUE_SIZE")
+    backend.add_argument("--workers", type=int, nargs="+", default=[1],
+                         help="Backend worker processes; levels are repeated for each count")
+    parser.add_argument("--backend-url", default=None, help="Use a running backend instead of spawning one")
+    parser.add_argument("--stub-port", type=int, default=7861)
+    parser.add_argument("--backend-port", type=int, default=8001)
+    parser.add_argument("--max-p95", type=float, default=None, help="Fail if any level has a higher p95, seconds")
+    parser.add_argument("--max-lag", type=float, default=None, help="Fail if event-loop lag exceeds this, seconds")
+    parser.add_argument("--output", type=Path, default=None, help="Write results as JSON")
+    args = parser.parse_args()
+    if args.concurrency is None and args.rate is None:
+        args.concurrency = [20, 50, 200]
+
+    questions = load_questions(args.questions)
+    worker_counts = [None] if args.backend_url else args.workers
+    results = []
+    for workers in worker_counts:
+        services = nullcontext(args.backend_url) if args.backend_url else spawn_services(args, workers)
+        with services as base_url:
+            args.probe_baseline = asyncio.run(idle_probe_baseline(base_url))
+            if workers is not None:
+                print(f"\nBackend workers: {workers}")
+            print(f"{len(questions)} questions, {args.duration:g}s per level, stub latency {args.latency:g}s "
+                  f"(jitter {args.jitter:g}), errors: {args.errors or 'none'}")
+            print(f"Idle /health baseline {args.probe_baseline * 1000:.1f}ms")
+            print_header()
+            levels = [{"concurrency": c} for c in args.concurrency or []] + [{"rate": r} for r in args.rate or []]
+            for level in levels:
+                before = admission_snapshot(base_url) or {}
+                results.append({**asyncio.run(run_level(base_url, questions, args, **level)), "workers": workers})
+                print_row(results[-1], before.get("shed_queue_full", 0) + before.get("shed_timeout", 0))
+
+    if len(worker_counts) > 1:
+        print_scaling(results, worker_counts)
+
+    if args.output:
+        report = {"config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+                  "levels": results}
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    failures = check_thresholds(results, args)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
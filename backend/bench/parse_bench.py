@@ -0,0 +1,208 @@
+"""
+CPU time and memory of parsing LangFlow responses and encoding our own.
+
+A LangFlow run response carries the whole outputs tree: the chat message
+twice (results.message and its data), content blocks with every tool call
+and its output (the retrieved chunks), artifacts, logs and messages. The
+backend reads one string from it. Variants for the run response:
+
+    json       response.json() and a dict walk (as before)
+    orjson     orjson.loads and the same dict walk
+    msgspec    agent_client.extract_message_text: typed decode of the answer
+               path only, the rest of the tree is skipped without objects
+
+The stream section parses a stream mode run of the same response: one
+add_message event per agent step, token events and the end event, as
+json.loads of every line versus agent_client.iter_stream_events decoding.
+The encode section renders a /chat reply and an SSE token event with the
+stdlib (JSONResponse, json.dumps) and with orjson (ORJSONResponse).
+
+Reported per payload and variant: CPU time per response in microseconds
+(process time over --iterations) and the peak of memory allocated while
+parsing one response (tracemalloc).
+
+Payloads are synthetic LangFlow 1.6 responses with --tool-chunks retrieved
+chunks in the agent steps, or recorded responses of the real flow:
+    curl -s -X POST "$EXTERNAL_API_URL" -H "x-api-key: $EXTERNAL_API_KEY" \\
+         -H "Content-Type: application/json" \\
+         -d '{"input_value": "Почему корова хромает?", "output_type": "chat", "input_type": "chat"}' > run.json
+
+Usage (from the backend directory):
+    python -m bench.parse_bench --tool-chunks 0 10 30
+    python -m bench.parse_bench --payload run.json --iterations 2000
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from agent_client import end_message_text, event_decoder, extract_message_text, token_chunk
+
+ANSWER = "Мастит у коровы требует осмотра вымени и анализа молока. "
+TOOL_CHUNK = "Фрагмент руководства по ветеринарии крупного рогатого скота. "
+
+
+def walk(resp_json: Dict[str, Any]) -> str:
+    return resp_json["outputs"][0]["outputs"][0]["results"]["message"]["data"]["text"]
+
+
+def synthetic_response(tool_chunks: int, answer_chars: int, chunk_chars: int = 1000) -> bytes:
+    """Run response shaped like LangFlow 1.6 for the agent flow"""
+    answer = (ANSWER * (answer_chars // len(ANSWER) + 1))[:answer_chars]
+    documents = [
+        {"text": (TOOL_CHUNK * (chunk_chars // len(TOOL_CHUNK) + 1))[:chunk_chars],
+         "filename": "vet_manual.pdf", "page_number": i, "score": 0.8}
+        for i in range(tool_chunks)
+    ]
+    content_blocks = [{
+        "title": "Agent Steps",
+        "contents": [
+            {"type": "text", "duration": 3, "header": {"title": "Input", "icon": "MessageSquare"},
+             "text": "Почему корова хромает?"},
+            {"type": "tool_use", "name": "search_documents", "tool_input": {"query": "хромота корова"},
+             "output": documents, "error": None, "duration": 812,
+             "header": {"title": "Executed **search_documents**", "icon": "Hammer"}},
+            {"type": "text", "duration": 4000, "header": {"title": "Output", "icon": "MessageSquare"},
+             "text": answer},
+        ],
+        "allow_markdown": True,
+        "media_url": None,
+    }]
+    data = {
+        "timestamp": "2025-10-30 12:00:00 UTC", "sender": "Machine", "sender_name": "AI", "session_id": "s",
+        "text": answer, "files": [], "error": False, "edit": False,
+        "properties": {
+            "text_color": "", "background_color": "", "edited": False,
+            "source": {"id": "Agent-1", "display_name": "Agent", "source": "gpt-4o-mini"},
+            "icon": "", "allow_markdown": False, "positive_feedback": None, "state": "complete", "targets": [],
+        },
+        "category": "message", "content_blocks": content_blocks, "id": "m", "flow_id": "f", "duration": None,
+    }
+    message = {"text_key": "text", "data": data, "default_value": "", **{key: data[key] for key in data if key != "id"}}
+    component = {
+        "results": {"message": message},
+        "artifacts": {"message": answer, "sender": "Machine", "sender_name": "AI", "files": [], "type": "object"},
+        "outputs": {"message": {"message": answer, "type": "text"}},
+        "logs": {"message": []},
+        "messages": [{"message": answer, "sender": "Machine", "sender_name": "AI", "session_id": "s",
+                      "stream_url": None, "component_id": "ChatOutput-1", "files": [], "type": "message"}],
+        "timedelta": None, "duration": None, "component_display_name": "Chat Output",
+        "component_id": "ChatOutput-1", "used_frozen_result": False,
+    }
+    run = {"session_id": "s", "outputs": [{"inputs": {"input_value": "Почему корова хромает?"}, "outputs": [component]}]}
+    return json.dumps(run, ensure_ascii=False).encode("utf-8")
+
+
+def stream_lines(body: bytes, steps: int, token_chars: int = 20) -> List[str]:
+    """Stream mode lines for a run response: add_message per agent step, tokens, end"""
+    run = json.loads(body)
+    message = run["outputs"][0]["outputs"][0]["results"]["message"]
+    answer = walk(run)
+    lines = [json.dumps({"event": "add_message", "data": message}, ensure_ascii=False) for _ in range(steps)]
+    lines += [
+        json.dumps({"event": "token", "data": {"chunk": answer[i:i + token_chars], "id": "m"}}, ensure_ascii=False)
+        for i in range(0, len(answer), token_chars)
+    ]
+    lines.append(json.dumps({"event": "end", "data": {"result": run}}, ensure_ascii=False))
+    return lines
+
+
+def parse_stream_json(lines: List[str]) -> str:
+    chunks = []
+    for line in lines:
+        event = json.loads(line)
+        if event["event"] == "token":
+            chunks.append(event["data"]["chunk"])
+        elif event["event"] == "end":
+            return "".join(chunks) or walk(event["data"]["result"])
+    return ""
+
+
+def parse_stream_lean(lines: List[str]) -> str:
+    chunks = []
+    for line in lines:
+        event = event_decoder.decode(line)
+        if event.event == "token":
+            chunks.append(token_chunk(event))
+        elif event.event == "end":
+            return "".join(chunks) or end_message_text(event)
+    return ""
+
+
+def measure(parse: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    """CPU time per call in microseconds and peak allocation of one call in KiB"""
+    parse()
+    started = time.process_time()
+    for _ in range(iterations):
+        parse()
+    cpu = (time.process_time() - started) / iterations * 1e6
+
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu": cpu, "peak": peak / 1024}
+
+
+def print_rows(title: str, variants: Dict[str, Callable[[], Any]], iterations: int) -> None:
+    print(title)
+    baseline = None
+    for name, parse in variants.items():
+        result = measure(parse, iterations)
+        baseline = baseline or result["cpu"]
+        print(f"  {name:<16} {result['cpu']:>9.1f} {result['peak']:>10.1f} {baseline / result['cpu']:>7.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload", type=Path, nargs="*", default=[], help="Recorded LangFlow run responses")
+    parser.add_argument("--tool-chunks", type=int, nargs="+", default=[0, 10, 30],
+                        help="Retrieved chunks in synthetic responses")
+    parser.add_argument("--answer-chars", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=3, help="add_message events per stream")
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    payloads = {path.name: path.read_bytes() for path in args.payload}
+    if not payloads:
+        payloads = {
+            f"synthetic, {n} chunks": synthetic_response(n, args.answer_chars) for n in args.tool_chunks
+        }
+
+    print(f"{'':<18} {'cpu us':>9} {'peak KiB':>10} {'speedup':>8}")
+    for name, body in payloads.items():
+        answer = extract_message_text(body)
+        assert walk(json.loads(body)) == answer
+        print_rows(f"run response: {name} ({len(body) / 1024:.0f} KiB)", {
+            "json": lambda: walk(json.loads(body)),
+            "orjson": lambda: walk(orjson.loads(body)),
+            "msgspec": lambda: extract_message_text(body),
+        }, args.iterations)
+
+        lines = stream_lines(body, args.steps)
+        assert parse_stream_json(lines) == parse_stream_lean(lines) == answer
+        print_rows(f"stream: {len(lines)} events ({sum(map(len, lines)) / 1024:.0f} KiB)", {
+            "json": lambda: parse_stream_json(lines),
+            "msgspec": lambda: parse_stream_lean(lines),
+        }, max(args.iterations // 10, 1))
+
+    reply = {"message": extract_message_text(next(iter(payloads.values()))), "session_id": "s"}
+    print_rows("encode: /chat reply", {
+        "JSONResponse": lambda: JSONResponse(reply).body,
+        "ORJSONResponse": lambda: ORJSONResponse(reply).body,
+    }, args.iterations)
+    token = {"chunk": reply["message"][:20]}
+    print_rows("encode: SSE token", {
+        "json.dumps": lambda: json.dumps(token, ensure_ascii=False),
+        "orjson.dumps": lambda: orjson.dumps(token).decode(),
+    }, args.iterations * 10)
+
+
+if __name__ == "__main__":
+    main()
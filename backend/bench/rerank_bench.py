@@ -0,0 +1,107 @@
+"""
+Prompt size versus answer support of the rerank stage, without LLM calls.
+
+For every benchmark.yaml question the retriever returns 30 candidates (as
+the agent flow does); each variant then selects the context for the prompt:
+the first k candidates in retrieval order, or the top-k passages of the
+reranker (with adjacent chunks merged). Reported per variant:
+
+    chars      mean prompt context size
+    support    share of the reference answer's terms found in the context,
+               a cheap proxy for whether the answer can be grounded
+    ms         rerank time per question (p50)
+
+Answer accuracy with the LLM judge is measured by bench.run_benchmark with
+--rerank. Candidates come from the BM25 index alone, or from the hybrid
+retriever when --local-index is given (needs OpenAI for question embeddings).
+
+Usage (from the backend directory):
+    python -m bench.rerank_bench --top-k 3 5 8
+    python -m bench.rerank_bench --local-index .vector_index/TailSense --cross-encoder
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import yaml
+
+from rag.lexical_index import DEFAULT_LEXICAL_DIR, BM25Index, HybridRetriever, tokenize
+from rag.rerank import Reranker, make_scorer
+
+
+def support(reference: str, hits: List[Dict]) -> float:
+    """Share of the reference answer terms present in the selected context"""
+    terms = set(tokenize(reference))
+    if not terms:
+        return 1.0
+    context = set(tokenize(" ".join(hit["payload"].get("text", "") for hit in hits)))
+    return len(terms & context) / len(terms)
+
+
+def load_candidates(args, items) -> List[List[Dict]]:
+    lexical = BM25Index(args.lexical_index)
+    if not args.local_index:
+        return [lexical.hits(item["question"], args.candidates) for item in items]
+
+    from rag.embedding_cache import with_cache
+    from rag.embeddings import OpenAIEmbedder
+    from rag.local_index import LocalRetriever
+
+    retriever = HybridRetriever(LocalRetriever(with_cache(OpenAIEmbedder()), args.local_index), lexical)
+
+    async def fetch():
+        return [await retriever.search(item["question"], args.candidates) for item in items]
+
+    return asyncio.run(fetch())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, default=Path("../notebooks/benchmark.yaml"))
+    parser.add_argument("--collection", default="TailSense")
+    parser.add_argument("--lexical-index", type=Path, default=None,
+                        help="BM25 index directory (default: .lexical_index/<collection>/bm25)")
+    parser.add_argument("--local-index", type=Path, default=None, help="Hybrid candidates from this vector index")
+    parser.add_argument("--candidates", type=int, default=30)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--cross-encoder", action="store_true", help="Also test the cross-encoder scorer")
+    args = parser.parse_args()
+    args.lexical_index = args.lexical_index or DEFAULT_LEXICAL_DIR / args.collection / "bm25"
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        items = yaml.safe_load(f)["questions"]
+    candidates = load_candidates(args, items)
+    lexical = BM25Index(args.lexical_index)
+
+    scorers = {"lexical": make_scorer("lexical", lexical)}
+    if args.cross_encoder:
+        scorers["cross-encoder"] = make_scorer("cross-encoder")
+
+    print(f"{len(items)} questions, {args.candidates} candidates each")
+    print(f"{'variant':<28} {'chars':>7} {'support':>8} {'ms':>7}")
+
+    def row(name, selections, timings=None):
+        chars = statistics.mean(sum(len(hit["payload"].get("text", "")) for hit in hits) for hits in selections)
+        supported = statistics.mean(support(item["answer"], hits) for item, hits in zip(items, selections))
+        ms = f"{statistics.median(timings) * 1000:>7.2f}" if timings else f"{'-':>7}"
+        print(f"{name:<28} {chars:>7.0f} {supported:>8.3f} {ms}")
+
+    row(f"retrieval order, k={args.candidates}", candidates)
+    for k in args.top_k:
+        row(f"retrieval order, k={k}", [hits[:k] for hits in candidates])
+        for name, scorer in scorers.items():
+            reranker = Reranker(scorer, top_k=k)
+            selections, timings = [], []
+            for item, hits in zip(items, candidates):
+                started = time.perf_counter()
+                selections.append(reranker.rerank(item["question"], hits))
+                timings.append(time.perf_counter() - started)
+            row(f"{name} rerank, k={k}", selections, timings)
+
+
+if __name__ == "__main__":
+    main()
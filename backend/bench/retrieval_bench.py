@@ -0,0 +1,175 @@
+"""
+Recall@k and latency of the local vector index variants versus Qdrant.
+
+Ground truth is exact float32 cosine search over the same vectors. Each
+variant (float32 / int8 storage, exact / IVF / HNSW search) is built in a
+temporary directory and queried with the same query vectors; Qdrant is
+queried too when --qdrant is given.
+
+Vectors come either from an exported index (`--index`, see
+`python -m rag.local_index export`) with the benchmark.yaml questions as
+queries, or from a synthetic clustered corpus (`--synthetic`, no network).
+
+Usage (from the backend directory):
+    python -m bench.retrieval_bench --synthetic 30000
+    python -m bench.retrieval_bench --index .vector_index/TailSense --qdrant
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import yaml
+
+from rag.local_index import LocalVectorIndex, build_index, normalize, top_k
+
+
+def synthetic_corpus(count: int, dim: int, queries: int, clusters: int = 200, seed: int = 0):
+    """Clustered unit vectors (topics of a book) and noisy queries near them"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim)))
+    topics = rng.integers(0, clusters, count)
+    vectors = normalize(centers[topics] + rng.standard_normal((count, dim)) / np.sqrt(dim) * 1.2)
+    picked = rng.integers(0, count, queries)
+    query_vectors = normalize(vectors[picked] + rng.standard_normal((queries, dim)) / np.sqrt(dim) * 1.5)
+    payloads = [
+        {"text": f"chunk {i}", "filename": f"book-{i % 4}.pdf", "page_number": i // 20, "chunk_index": i}
+        for i in range(count)
+    ]
+    return [str(i) for i in range(count)], vectors, payloads, query_vectors
+
+
+def load_exported(path: Path, questions: Path):
+    """Vectors and payloads of an exported index, benchmark questions as queries"""
+    from rag.embedding_cache import with_cache
+    from rag.embeddings import OpenAIEmbedder
+
+    index = LocalVectorIndex(path)
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+    if index.scales is not None:
+        vectors = vectors * index.scales[:, None]
+    payloads = [index.payloads.get(row) for row in range(len(index))]
+
+    with open(questions, "r", encoding="utf-8") as f:
+        texts = [item["question"] for item in yaml.safe_load(f)["questions"]]
+    query_vectors = np.asarray(asyncio.run(with_cache(OpenAIEmbedder()).embed(texts)), dtype=np.float32)
+    return [str(point_id) for point_id in index.ids], vectors, payloads, query_vectors
+
+
+def recall(found: List[List[str]], truth: List[List[str]]) -> float:
+    return statistics.mean(len(set(f) & set(t)) / len(t) for f, t in zip(found, truth))
+
+
+def directory_size(path: Path) -> int:
+    return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+
+
+def measure(search, query_vectors) -> Dict[str, object]:
+    """Runs every query once and returns found ids and latency percentiles"""
+    found, timings = [], []
+    for query in query_vectors:
+        started = time.perf_counter()
+        found.append(search(query))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "found": found,
+        "p50": timings[len(timings) // 2] * 1000,
+        "p95": timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+    }
+
+
+def qdrant_search(args, query_vectors) -> Dict[str, object]:
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    try:
+        return measure(
+            lambda query: [
+                str(point.id)
+                for point in client.query_points(args.collection, query=query.tolist(), limit=args.k).points
+            ],
+            query_vectors,
+        )
+    finally:
+        client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--synthetic", type=int, default=None, help="Synthetic corpus size")
+    source.add_argument("--index", type=Path, default=None, help="Exported index directory")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200, help="Synthetic query count")
+    parser.add_argument("--questions", type=Path, default=Path("../notebooks/benchmark.yaml"))
+    parser.add_argument("--k", type=int, default=30)
+    parser.add_argument("--ivf-lists", type=int, default=None, help="Default: 4 x sqrt(corpus size)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--qdrant", action="store_true", help="Also query the Qdrant collection")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "TailSense"))
+    args = parser.parse_args()
+
+    if args.index:
+        ids, vectors, payloads, query_vectors = load_exported(args.index, args.questions)
+    else:
+        ids, vectors, payloads, query_vectors = synthetic_corpus(args.synthetic or 30000, args.dim, args.queries)
+    vectors = normalize(vectors)
+    ivf_lists = args.ivf_lists or int(4 * np.sqrt(len(ids)))
+    print(f"{len(ids)} vectors x {vectors.shape[1]}, {len(query_vectors)} queries, recall@{args.k}")
+
+    id_array = np.asarray(ids)
+    truth = [list(id_array[top_k(vectors @ normalize(query), args.k)]) for query in query_vectors]
+
+    try:
+        import hnswlib  # noqa: F401
+        with_hnsw = True
+    except ImportError:
+        with_hnsw = False
+        print("hnswlib is not installed, HNSW variants skipped")
+
+    print(f"{'variant':<26} {'build, s':>9} {'size, MB':>9} {'p50, ms':>8} {'p95, ms':>8} {'recall':>7}")
+
+    def row(name, build_s, size, result):
+        size_text = f"{size / 1024 ** 2:>9.1f}" if size is not None else f"{'-':>9}"
+        build_text = f"{build_s:>9.1f}" if build_s is not None else f"{'-':>9}"
+        print(
+            f"{name:<26} {build_text} {size_text} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+            f"{recall(result['found'], truth):>7.3f}"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "int8"):
+            path = Path(tmp) / dtype
+            started = time.perf_counter()
+            index = build_index(path, ids, vectors, payloads, dtype, ivf_lists=ivf_lists, hnsw=with_hnsw)
+            build_s = time.perf_counter() - started
+            size = directory_size(path)
+
+            def search(query, **options):
+                rows, _ = index.search(query, args.k, **options)
+                return list(index.ids[rows])
+
+            row(f"{dtype} flat", build_s, size, measure(lambda q: search(q, mode="flat"), query_vectors))
+            for nprobe in args.nprobe:
+                result = measure(lambda q: search(q, mode="ivf", nprobe=nprobe), query_vectors)
+                row(f"{dtype} ivf{ivf_lists} nprobe={nprobe}", None, None, result)
+            if with_hnsw:
+                row(f"{dtype} hnsw", None, None, measure(lambda q: search(q, mode="hnsw"), query_vectors))
+
+            # Full hit with payloads, as the backend retrieval service returns it
+            result = measure(lambda q: [hit["id"] for hit in index.hits(q, args.k, mode="flat")], query_vectors)
+            row(f"{dtype} flat + payloads", None, None, result)
+
+    if args.qdrant:
+        row(f"qdrant {args.collection}", None, None, qdrant_search(args, query_vectors))
+
+
+if __name__ == "__main__":
+    main()
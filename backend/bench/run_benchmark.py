@@ -0,0 +1,368 @@
+"""
+Concurrent accuracy benchmark on the question sets in notebooks/*.yaml.
+
+Replaces the sequential `evaluate_answers()` loop of benchmark.ipynb:
+questions are answered and judged concurrently (bounded by --concurrency
+and a shared --rate limit on LLM calls), answering of one question overlaps
+judging of another, and per-stage latency (embed, retrieve, generate, judge)
+is recorded. Results are written as one structured JSON file.
+
+Targets:
+    rag      direct RAG path: cached embeddings + Qdrant + gpt-4o-mini
+    backend  the running backend POST /api/v1/chat
+
+Usage (from the backend directory):
+    python -m bench.run_benchmark ../notebooks/benchmark.yaml --target rag --concurrency 8
+    python -m bench.run_benchmark ../notebooks/*.yaml --target backend --backend-url http://localhost:8000
+    python -m bench.run_benchmark ../notebooks/benchmark.yaml --hybrid --limit 8   # fewer chunks, BM25 + vectors
+    python -m bench.run_benchmark ../notebooks/benchmark.yaml --rerank lexical --rerank-top-k 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+JUDGE_MODEL = "gpt-4o-mini"
+VERDICTS = ("Correct", "Partially correct", "Incorrect")
+
+JUDGE_PROMPT = """Ты - эксперт по ветеринарии. Твоя задача - оценить качество ответа искусственного интеллекта на ветеринарный вопрос.
+
+Вопрос: {question}
+
+Ответ ИИ: {ai_answer}
+
+Эталонный ответ (правильный): {correct_answer}
+
+Проанализируй ответ ИИ и сравни его с эталонным ответом. Учитывай:
+- Фактическую точность информации
+- Полноту ответа
+- Соответствие медицинской терминологии
+- Практическую применимость
+
+Дай оценку по одной из трех категорий:
+1. Correct - ответ полностью или в основном соответствует эталону
+2. Partially correct - ответ содержит верную информацию, но неполный или имеет незначительные неточности
+3. Incorrect - ответ содержит существенные ошибки или не соответствует эталону
+"""
+
+JUDGE_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "EvaluationResult",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"result": {"type": "string", "enum": list(VERDICTS)}},
+            "required": ["result"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class RateLimiter:
+    """Token bucket shared by all concurrent LLM calls"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class QuestionResult:
+    dataset: str
+    index: int
+    question: str
+    reference: str
+    answer: str = ""
+    verdict: Optional[str] = None
+    sources: List[str] = field(default_factory=list)
+    prompt_chars: Optional[int] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class RagTarget:
+    """Direct RAG path (same retrieval and prompt as the notebook)"""
+
+    def __init__(self, args, limiter: RateLimiter):
+        from rag.answer import RagAnswerer
+        from rag.embedding_cache import with_cache
+        from rag.embeddings import OpenAIEmbedder
+
+        embedder = with_cache(OpenAIEmbedder(), None if args.no_embedding_cache else args.embedding_cache)
+        self.embedder = embedder
+        if args.local_index:
+            from rag.local_index import LocalRetriever
+
+            self.retriever = LocalRetriever(embedder, args.local_index, limit=args.limit)
+        else:
+            from rag.retrieval import QdrantRetriever
+
+            self.retriever = QdrantRetriever(embedder, collection=args.collection, limit=args.limit)
+        if args.hybrid:
+            from rag.lexical_index import BM25Index, DEFAULT_LEXICAL_DIR, HybridRetriever
+
+            lexical_path = args.lexical_index or DEFAULT_LEXICAL_DIR / args.collection / "bm25"
+            self.retriever = HybridRetriever(
+                self.retriever, BM25Index(lexical_path), limit=args.limit, candidates=args.candidates,
+            )
+        reranker = None
+        if args.rerank:
+            from rag.lexical_index import BM25Index, DEFAULT_LEXICAL_DIR
+            from rag.rerank import Reranker, make_scorer
+
+            lexical_path = args.lexical_index or DEFAULT_LEXICAL_DIR / args.collection / "bm25"
+            lexical = BM25Index(lexical_path) if lexical_path.exists() else None
+            reranker = Reranker(make_scorer(args.rerank, lexical), top_k=args.rerank_top_k)
+        self.answerer = RagAnswerer(self.retriever, limiter=limiter, reranker=reranker)
+
+    async def answer(self, question: str, result: QuestionResult) -> None:
+        answer = await self.answerer.answer(question)
+        result.answer = answer.text
+        result.sources = answer.sources
+        result.prompt_chars = answer.prompt_chars
+        result.timings.update(answer.timings)
+
+    async def close(self) -> None:
+        await self.retriever.close()
+
+
+class BackendTarget:
+    """The running backend chat endpoint"""
+
+    def __init__(self, args, limiter: RateLimiter):
+        import httpx
+
+        self.client = httpx.AsyncClient(base_url=args.backend_url, timeout=args.timeout)
+        self.limiter = limiter
+        self.use_cache = args.backend_cache
+
+    async def answer(self, question: str, result: QuestionResult) -> None:
+        await self.limiter.acquire()
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/v1/chat",
+            json={"input_value": question, "use_cache": self.use_cache},
+        )
+        result.timings["generate"] = time.perf_counter() - started
+        response.raise_for_status()
+        result.answer = response.json()["message"]
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+async def judge(client, limiter: RateLimiter, question: str, ai_answer: str, reference: str) -> str:
+    """LLM judge verdict: Correct, Partially correct or Incorrect"""
+    await limiter.acquire()
+    completion = await client.chat.completions.create(
+        model=JUDGE_MODEL,
+        messages=[{"role": "user", "content": JUDGE_PROMPT.format(
+            question=question, ai_answer=ai_answer, correct_answer=reference,
+        )}],
+        response_format=JUDGE_SCHEMA,
+    )
+    return json.loads(completion.choices[0].message.content)["result"]
+
+
+def load_questions(paths: List[Path]) -> List[QuestionResult]:
+    results = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+        for i, item in enumerate(data["questions"]):
+            results.append(QuestionResult(
+                dataset=path.stem, index=i, question=item["question"], reference=item["answer"],
+            ))
+    return results
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    position = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[position]
+
+
+def summarize(results: List[QuestionResult]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {"datasets": {}, "latency": {}}
+
+    for dataset in sorted({r.dataset for r in results}):
+        items = [r for r in results if r.dataset == dataset]
+        counts = {verdict: sum(r.verdict == verdict for r in items) for verdict in VERDICTS}
+        judged = sum(counts.values())
+        summary["datasets"][dataset] = {
+            "total": len(items),
+            "errors": sum(r.error is not None for r in items),
+            "correct_count": counts["Correct"],
+            "partially_correct_count": counts["Partially correct"],
+            "incorrect_count": counts["Incorrect"],
+            "overall_accuracy": (
+                (counts["Correct"] + counts["Partially correct"] * 0.5) / judged * 100 if judged else None
+            ),
+        }
+
+    prompt_sizes = [r.prompt_chars for r in results if r.prompt_chars is not None]
+    if prompt_sizes:
+        summary["prompt_chars"] = {"mean": statistics.mean(prompt_sizes), "max": max(prompt_sizes)}
+
+    stages = sorted({stage for r in results for stage in r.timings})
+    for stage in stages:
+        values = [r.timings[stage] for r in results if stage in r.timings]
+        summary["latency"][stage] = {
+            "mean": statistics.mean(values),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": max(values),
+        }
+    return summary
+
+
+async def run(args) -> Dict[str, Any]:
+    limiter = RateLimiter(args.rate)
+    target = RagTarget(args, limiter) if args.target == "rag" else BackendTarget(args, limiter)
+    judge_client = None
+    if not args.no_judge:
+        from openai import AsyncOpenAI
+
+        judge_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    results = load_questions(args.datasets)
+    answer_slots = asyncio.Semaphore(args.concurrency)
+    judge_slots = asyncio.Semaphore(args.judge_concurrency or args.concurrency)
+    done = 0
+
+    async def evaluate(result: QuestionResult) -> None:
+        nonlocal done
+        started = time.perf_counter()
+        try:
+            # Separate slots let new questions be answered while earlier ones are judged
+            async with answer_slots:
+                await target.answer(result.question, result)
+            if judge_client is not None:
+                async with judge_slots:
+                    judge_started = time.perf_counter()
+                    result.verdict = await judge(
+                        judge_client, limiter, result.question, result.answer, result.reference
+                    )
+                    result.timings["judge"] = time.perf_counter() - judge_started
+        except Exception as e:
+            result.error = f"{e.__class__.__name__}: {e}"
+        result.timings["total"] = time.perf_counter() - started
+        done += 1
+        status = result.verdict or ("error" if result.error else "answered")
+        print(f"[{done}/{len(results)}] {result.dataset}#{result.index}: {status} ({result.timings['total']:.1f}s)")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(evaluate(result) for result in results))
+    finally:
+        await target.close()
+    wall_time = time.perf_counter() - started
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "target": args.target,
+            "datasets": [str(path) for path in args.datasets],
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "limit": args.limit,
+            "retrieval": ("hybrid" if args.hybrid else "dense") + (" local" if args.local_index else " qdrant"),
+            "rerank": f"{args.rerank} top {args.rerank_top_k}" if args.rerank else None,
+            "backend_url": args.backend_url if args.target == "backend" else None,
+        },
+        "wall_time": wall_time,
+        "summary": summarize(results),
+        "results": [asdict(result) for result in results],
+    }
+    embedder = getattr(target, "embedder", None)
+    if embedder is not None and hasattr(embedder, "hits"):
+        report["embedding_cache"] = {"hits": embedder.hits, "misses": embedder.misses, "calls": embedder.calls}
+    return report
+
+
+def print_summary(report: Dict[str, Any]) -> None:
+    print(f"\n📊 Wall time: {report['wall_time']:.1f}s")
+    for dataset, stats in report["summary"]["datasets"].items():
+        accuracy = stats["overall_accuracy"]
+        accuracy_text = f"{accuracy:.1f}%" if accuracy is not None else "n/a"
+        print(
+            f"{dataset}: ✅ {stats['correct_count']}  🟡 {stats['partially_correct_count']}  "
+            f"❌ {stats['incorrect_count']}  errors {stats['errors']}  📈 accuracy {accuracy_text}"
+        )
+    if "prompt_chars" in report["summary"]:
+        print(f"Prompt size: {report['summary']['prompt_chars']['mean']:.0f} chars on average")
+    for stage, stats in report["summary"]["latency"].items():
+        print(f"  {stage:<9} p50 {stats['p50']:.2f}s  p95 {stats['p95']:.2f}s  max {stats['max']:.2f}s")
+    if "embedding_cache" in report:
+        cache = report["embedding_cache"]
+        print(f"Embedding cache: {cache['hits']} hits, {cache['misses']} misses, {cache['calls']} API calls")
+
+
+def main() -> None:
+    from rag.embedding_cache import DEFAULT_CACHE_DIR
+    from rag.ingest import COLLECTION_NAME
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("datasets", nargs="*", type=Path, default=[Path("../notebooks/benchmark.yaml")])
+    parser.add_argument("--target", choices=("rag", "backend"), default="rag")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions answered at the same time")
+    parser.add_argument("--judge-concurrency", type=int, default=None, help="Judge calls at the same time")
+    parser.add_argument("--rate", type=float, default=5.0, help="LLM calls per second, 0 = unlimited")
+    parser.add_argument("--no-judge", action="store_true", help="Only collect answers and latency")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", COLLECTION_NAME))
+    parser.add_argument("--limit", type=int, default=30, help="Chunks retrieved per question (rag target)")
+    parser.add_argument("--local-index", type=Path, default=None, help="Search a rag.local_index instead of Qdrant")
+    parser.add_argument("--hybrid", action="store_true", help="Fuse vector and BM25 results (rag.lexical_index)")
+    parser.add_argument("--lexical-index", type=Path, default=None,
+                        help="BM25 index directory (default: .lexical_index/<collection>/bm25)")
+    parser.add_argument("--candidates", type=int, default=50, help="Candidates per retriever before fusion")
+    parser.add_argument("--rerank", choices=("lexical", "cross-encoder"), default=None,
+                        help="Rerank the --limit retrieved chunks down to --rerank-top-k passages")
+    parser.add_argument("--rerank-top-k", type=int, default=6)
+    parser.add_argument("--embedding-cache", type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    parser.add_argument("--backend-url", default="http://localhost:8000")
+    parser.add_argument("--backend-cache", action="store_true", help="Allow backend answer cache hits")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Result file (default: bench_results/benchmark-<timestamp>.json)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_summary(report)
+
+    output = args.output or Path("bench_results") / f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Results: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Local stub of the LangFlow run endpoint for load testing the backend.
+
+Answers every run request after a configurable delay with a response shaped
+like the real flow output, so backend concurrency can be measured without
+LLM or Qdrant calls.
+
+Latency and failures are injectable through the environment:
+    STUB_LATENCY   mean delay per run request, seconds
+    STUB_JITTER    relative spread of the delay, 0.5 = uniform 50%..150%
+    STUB_ERRORS    failure rates, e.g. "429=0.05,500=0.02,timeout=0.01";
+                   "timeout" stalls for STUB_HANG seconds so that the backend
+                   request timeout fires
+    STUB_ANSWER_CHARS  pad answers to this length, like long RAG answers, so
+                   that parsing responses costs the backend real CPU time
+
+Usage:
+    STUB_LATENCY=0.5 STUB_ERRORS="429=0.05" uvicorn bench.stub_agent:app --port 7861
+"""
+
+import asyncio
+import json
+import os
+import random
+import uuid
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.5"))
+STUB_JITTER = float(os.getenv("STUB_JITTER", "0"))
+STUB_HANG = float(os.getenv("STUB_HANG", "300"))
+STUB_ANSWER_CHARS = int(os.getenv("STUB_ANSWER_CHARS", "0"))
+
+
+def parse_error_rates(spec: str) -> Dict[str, float]:
+    """Parses "429=0.05,timeout=0.01" into {"429": 0.05, "timeout": 0.01}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, rate = item.split("=")
+        rates[kind.strip()] = float(rate)
+    if sum(rates.values()) > 1:
+        raise ValueError(f"Error rates add up to more than 1: {spec}")
+    return rates
+
+
+STUB_ERRORS = parse_error_rates(os.getenv("STUB_ERRORS", ""))
+
+app = FastAPI(title="TailSense stub agent")
+
+
+def build_run_response(text: str, session_id: str) -> dict:
+    """Builds a response with the same nesting as the LangFlow run API"""
+    return {
+        "session_id": session_id,
+        "outputs": [
+            {
+                "inputs": {"input_value": text},
+                "outputs": [
+                    {
+                        "results": {
+                            "message": {
+                                "text": text,
+                                "data": {"text": text, "sender": "Machine"},
+                            }
+                        }
+                    }
+                ],
+            }
+        ],
+    }
+
+
+def draw_latency() -> float:
+    return STUB_LATENCY * random.uniform(1 - STUB_JITTER, 1 + STUB_JITTER)
+
+
+def draw_failure():
+    """Injected failure kind for this request, or None"""
+    roll = random.random()
+    for kind, rate in STUB_ERRORS.items():
+        if roll < rate:
+            return kind
+        roll -= rate
+    return None
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+async def stream_run(answer: str, session_id: str, latency: float):
+    """Emits the answer word by word in LangFlow stream mode format"""
+    words = answer.split(" ")
+    for i, word in enumerate(words):
+        await asyncio.sleep(latency / len(words))
+        chunk = word if i == 0 else " " + word
+        yield json.dumps({"event": "token", "data": {"chunk": chunk}}, ensure_ascii=False) + "\n\n"
+    end = {"event": "end", "data": {"result": build_run_response(answer, session_id)}}
+    yield json.dumps(end, ensure_ascii=False) + "\n\n"
+
+
+@app.post("/api/v1/run/{flow_id}")
+async def run(flow_id: str, request: Request, stream: bool = False):
+    payload = await request.json()
+    session_id = payload.get("session_id") or str(uuid.uuid4())
+    answer = f"Stub answer to: {payload.get('input_value', '')}"
+    if len(answer) < STUB_ANSWER_CHARS:
+        filler = " Рекомендуется осмотр ветеринаром и контроль температуры."
+        answer += (filler * (STUB_ANSWER_CHARS // len(filler) + 1))[:STUB_ANSWER_CHARS - len(answer)]
+    latency = draw_latency()
+
+    failure = draw_failure()
+    if failure == "timeout":
+        await asyncio.sleep(STUB_HANG)
+    elif failure is not None:
+        await asyncio.sleep(latency)
+        return JSONResponse({"detail": f"Injected {failure}"}, status_code=int(failure))
+
+    if stream:
+        return StreamingResponse(stream_run(answer, session_id, latency), media_type="text/event-stream")
+    await asyncio.sleep(latency)
+    return build_run_response(answer, session_id)
@@ -18,7 +18,15 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = False
-    
+    # Процессы-воркеры (python main.py; uvicorn --workers читает ту же переменную). Общие через Redis только
+    # кэш ответов, лимит частоты клиентов и сессии; лимит вызовов агента, предохранитель, проверка
+    # доступности агента, объединение одинаковых вопросов и метрики — свои в каждом воркере
+    web_concurrency: int = 1
+    shutdown_grace_seconds: float = 60.0  # сколько ждать завершения текущих запросов при остановке
+
+    # Общее состояние воркеров (кэш ответов, лимит частоты клиентов): memory — свое в каждом процессе, redis — общее
+    state_backend: str = "memory"
+
     # CORS настройки
     cors_origins: list[str] = ["*"]
     cors_methods: list[str] = ["GET", "POST", "PUT", "DELETE"]
@@ -26,6 +34,94 @@ class Settings(BaseSettings):
     
     # Timeout настройки
     request_timeout: int = 30
+    agent_connect_timeout: float = 5.0
+    
+    # Пул соединений к внешнему API
+    agent_max_connections: int = 100
+    agent_max_keepalive_connections: int = 20
+    agent_keepalive_expiry: float = 30.0
+    
+    # Ограничение частоты запросов к чату на клиента (token bucket), 0 — без ограничения
+    client_rate_limit: float = 1.0  # запросов в секунду
+    client_rate_burst: int = 10
+    client_rate_max_clients: int = 10000
+    # Адреса прокси, которым верим X-Forwarded-For и X-Client-Id (адрес или подсеть), например frontend
+    trusted_proxies: list[str] = ["127.0.0.1", "::1"]
+    
+    # Адаптивный лимит одновременных вызовов агента (AIMD), 0 в agent_concurrency_max отключает.
+    # Лимит и очередь — на воркер: агент получает до web_concurrency * agent_concurrency_max вызовов
+    agent_concurrency_initial: int = 20
+    agent_concurrency_min: int = 2
+    agent_concurrency_max: int = 200
+    agent_latency_tolerance: float = 2.5  # снижать лимит, если задержка выше базовой в N раз
+    agent_run_latency_tolerance: float = 6.0  # то же для вызовов без потока: время всего ответа, 0 — не учитывать
+    agent_latency_window: int = 100
+    agent_backoff_ratio: float = 0.7
+    agent_queue_size: int = 100  # ожидающие вызовы сверх лимита, остальные получают 503
+    agent_queue_timeout: float = 10.0
+    
+    # Предохранитель (circuit breaker), повторы и дублирование медленных вызовов агента.
+    # Каждый воркер считает свои сбои и размыкается сам
+    breaker_failure_threshold: int = 5  # сбоев подряд до размыкания
+    breaker_open_seconds: float = 30.0  # сколько отвечать резервным текстом до пробного вызова
+    breaker_half_open_probes: int = 1
+    agent_retry_attempts: int = 2  # только для сбоев до обработки запроса: соединение, 429, 502, 503
+    agent_retry_backoff: float = 0.2
+    agent_retry_backoff_max: float = 2.0
+    agent_hedge_enabled: bool = False  # второй вызов, если первый дольше p95 (только без истории сессии)
+    agent_hedge_min_delay: float = 1.0
+    agent_hedge_min_samples: int = 20
+    
+    # Фоновая проверка доступности внешнего API (в каждом воркере)
+    health_check_interval: float = 15.0
+    health_check_timeout: float = 5.0
+    
+    # Метрики Prometheus (/metrics) и заголовок Server-Timing
+    metrics_enabled: bool = True
+    metrics_loop_lag_interval: float = 0.25  # период проверки задержки event loop, секунды
+    
+    # Трассировка OpenTelemetry: none, console, file или otlp
+    tracing_exporter: str = "none"
+    tracing_sample_ratio: float = 0.1  # доля новых трасс; запросы с traceparent следуют решению frontend
+    tracing_service_name: str = "tailsense-backend"
+    tracing_file: str = ".traces.jsonl"  # для file: JSON-строки спанов
+    tracing_otlp_endpoint: str = ""  # для otlp: по умолчанию http://localhost:4318/v1/traces
+    
+    # Кэш ответов агента
+    cache_enabled: bool = True
+    cache_max_entries: int = 1000
+    cache_ttl_seconds: int = 6 * 60 * 60
+    cache_similarity_threshold: float = 1.0  # < 1.0 включает поиск похожих вопросов (числа и отрицания должны совпадать)
+    coalesce_enabled: bool = True  # одинаковые вопросы в полете разделяют один вызов агента
+    
+    # Поиск по базе знаний (POST /api/v1/retrieve): none, local или qdrant
+    retrieval_backend: str = "none"
+    vector_index_path: str = ".vector_index/TailSense"  # индекс rag.local_index
+    collection_name: str = "TailSense"
+    retrieval_limit: int = 30
+    retrieval_mode: str = "auto"  # auto, flat, ivf или hnsw
+    retrieval_nprobe: int = 16
+    retrieval_hybrid: bool = False  # объединять с BM25 (rag.lexical_index) через RRF
+    lexical_index_path: str = ".lexical_index/TailSense/bm25"
+    retrieval_candidates: int = 50
+    retrieval_rrf_k: int = 60
+    retrieval_rerank: str = "none"  # none, lexical или cross-encoder (rag.rerank)
+    rerank_top_k: int = 6
+    
+    # Хранилище сессий (/api/v1/sessions): none, memory, sqlite или redis
+    session_backend: str = "memory"
+    session_ttl_seconds: int = 7 * 24 * 60 * 60
+    session_max_entries: int = 10000  # только для memory
+    session_max_messages: int = 40  # дословно хранимые сообщения, более ранние — в кратком содержании
+    session_summary_chars: int = 4000
+    session_sqlite_path: str = ".sessions.sqlite3"
+    redis_url: str = "redis://localhost:6379/0"
+    
+    # Вход агента из сессии: агент хранит историю сам (Memory), передается только то, чего он не видел
+    context_max_tokens: int = 1500  # бюджет input_value
+    context_summary_tokens: int = 400  # из них на краткое содержание
+    agent_memory: bool = True  # false — агент без памяти, история передается в каждом запросе
+    agent_memory_messages: int = 100  # n_messages в Memory агента
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,159 @@
+"""
+Agent input built from the stored session within a token budget.
+
+The LangFlow agent keeps the session history itself (Memory component,
+n_messages=100), so repeating the last messages in every request is not
+needed. The input carries only what the agent has not seen:
+
+- the animal and symptoms, in the first agent request of the session and
+  after they change;
+- messages missing from the agent memory (turns answered from the cache,
+  by a coalesced call or while the session history was lost, and messages
+  pushed out of the n_messages window): the last ones verbatim, earlier
+  ones condensed;
+- the question.
+
+Condensed lines come from the session summary, where every message is
+shortened once when it is folded out of the verbatim history.
+"""
+
+import math
+import re
+from typing import List, Optional, Tuple
+
+from config import Settings
+
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Ветеринар"}
+QUESTION_CHARS = 200  # длина вопроса пользователя в кратком содержании
+ANSWER_CHARS = 300  # длина ответа ветеринара в кратком содержании
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+MARKDOWN = re.compile(r"[*_#>`]+")
+
+# (role, text) verbatim, or (None, line) already condensed
+Entry = Tuple[Optional[str], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Token estimate without a tokenizer: about three characters per token in Russian, rounded up"""
+    return math.ceil(len(text) / 3)
+
+
+def shorten(text: str, max_chars: int) -> str:
+    """First sentences of the text that fit into max_chars, on one line without markdown"""
+    text = " ".join(MARKDOWN.sub("", text).split())
+    if len(text) <= max_chars:
+        return text
+
+    result = ""
+    for sentence in SENTENCE_END.split(text):
+        if len(result) + len(sentence) + 1 > max_chars:
+            break
+        result = f"{result} {sentence}".strip()
+
+    # Первое предложение длиннее лимита — обрезаем по слову
+    if not result:
+        result = text[:max_chars].rsplit(" ", 1)[0]
+    return result + " …"
+
+
+def message_line(role: str, text: str) -> str:
+    return f"{ROLE_NAMES.get(role, 'Ветеринар')}: {text}"
+
+
+def summary_line(role: str, text: str) -> str:
+    """One condensed line of the session summary"""
+    return message_line(role, shorten(text, QUESTION_CHARS if role == "user" else ANSWER_CHARS))
+
+
+def missing_entries(record, config: Settings) -> Tuple[List[Entry], int]:
+    """
+    Messages of the session the agent memory does not have
+
+    Returns:
+        (entries, omitted): entries in order, oldest first; omitted counts
+        missing messages that are no longer stored at all
+    """
+    total = record.message_count
+    verbatim_from = total - len(record.history)
+    summary_from = verbatim_from - len(record.summary)
+
+    window = config.agent_memory_messages
+    if not config.agent_memory or record.agent_messages == 0:
+        missing = [(0, total)]
+    else:
+        # Pushed out of the memory window, and turns answered without the agent since its last answer
+        missing = [(0, total - window)] if record.agent_messages > window else []
+        missing.append((record.agent_seen, total))
+
+    entries: List[Entry] = []
+    omitted = 0
+    seen = set()
+    for start, end in missing:
+        for index in range(max(start, 0), end):
+            if index in seen:
+                continue
+            seen.add(index)
+            if index >= verbatim_from:
+                entries.append(record.history[index - verbatim_from])
+            elif index >= summary_from:
+                entries.append((None, record.summary[index - summary_from]))
+            else:
+                omitted += 1
+    return entries, omitted
+
+
+def build_agent_input(record, question: str, config: Settings, animal: Optional[str] = None,
+                      symptoms: Optional[List[str]] = None) -> str:
+    """
+    Agent input for the question in the session of `record`
+
+    The animal and symptoms of the request take precedence over the stored
+    ones. The record is not changed: what the agent saw is recorded by
+    SessionStore.append_turn once the agent has answered.
+    """
+    animal = animal or record.animal
+    symptoms = list(symptoms or record.symptoms)
+
+    header = []
+    if record.agent_messages == 0 or [animal, symptoms] != record.agent_profile:
+        if animal:
+            header.append(f"Животное: {animal}")
+        if symptoms:
+            header.append(f"Наблюдаемые симптомы: {', '.join(symptoms)}")
+
+    entries, omitted = missing_entries(record, config)
+    line = f"Текущий вопрос: {question}" if header or entries or omitted else question
+    budget = config.context_max_tokens - estimate_tokens("\n".join(header + [line]))
+
+    # Последние реплики дословно, пока остается место после краткого содержания
+    recent: List[str] = []
+    recent_budget = budget - config.context_summary_tokens
+    cut = len(entries)
+    while cut > 0 and entries[cut - 1][0] is not None:
+        text = message_line(*entries[cut - 1])
+        cost = estimate_tokens(text) + 1
+        if cost > recent_budget:
+            break
+        recent.insert(0, text)
+        recent_budget -= cost
+        cut -= 1
+
+    # Остальное — кратким содержанием, ранние строки отбрасываются первыми
+    lines = [text if role is None else summary_line(role, text) for role, text in entries[:cut]]
+    summary_budget = budget - sum(estimate_tokens(text) + 1 for text in recent)
+    while lines and sum(estimate_tokens(text) + 1 for text in lines) > summary_budget - 20:
+        lines = lines[1:]
+        omitted += 1
+
+    parts = list(header)
+    if lines or omitted:
+        parts.append("Краткое содержание предыдущей части консультации:")
+        if omitted:
+            parts.append(f"(ранее: еще {omitted} сообщений)")
+        parts.extend(lines)
+    if recent:
+        parts.append("Предыдущие сообщения:")
+        parts.extend(recent)
+    parts.append(line)
+    return "\n".join(parts)
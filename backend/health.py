@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from agent_client import AgentClient, agent_client
+from config import Settings, settings
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Background poller of the agent health endpoint
+
+    Probes the agent on a fixed interval and keeps the last result in memory,
+    so request handlers can read the agent status without any network I/O.
+    """
+
+    def __init__(self, client: AgentClient, config: Settings):
+        self.client = client
+        self.config = config
+        self.status = "unknown"
+        self.latency_ms: Optional[float] = None
+        self.last_checked: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_available(self) -> bool:
+        """False only when the agent is known to be down"""
+        return self.status != "down"
+
+    async def check_once(self) -> None:
+        """Probe the agent once and record the outcome"""
+        started = time.perf_counter()
+        try:
+            with metrics.upstream_call("agent", "health"):
+                response = await self.client.client.get(
+                    self.client.health_url,
+                    timeout=self.config.health_check_timeout,
+                )
+                response.raise_for_status()
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            self.last_error = str(e) or e.__class__.__name__
+            if self.status != "down":
+                logger.warning(f"External API health check failed: {self.last_error}")
+            self.status = "down"
+        else:
+            if self.status == "down":
+                logger.info("External API is available again")
+            self.status = "up"
+            self.consecutive_failures = 0
+            self.last_error = None
+        finally:
+            self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.last_checked = datetime.now().isoformat()
+
+    async def _run(self) -> None:
+        while True:
+            await self.check_once()
+            await asyncio.sleep(self.config.health_check_interval)
+
+    def start(self) -> None:
+        """Start the polling task (called from the application lifespan)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Cancel the polling task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Last known agent status"""
+        return {
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "last_checked": self.last_checked,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "last_error": self.last_error,
+        }
+
+
+# Глобальный монитор состояния агента
+health_monitor = HealthMonitor(agent_client, settings)
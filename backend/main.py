@@ -1,17 +1,75 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import requests
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import aclosing, asynccontextmanager
+import httpx
 import logging
+import math
+import orjson
+import os
+import time
+import uuid
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-from models import ChatRequest, ChatResponse, ErrorResponse, HealthResponse
+from models import (
+    AgentHealth, ChatRequest, CircuitHealth, ErrorResponse, HealthResponse,
+    RetrievedChunk, RetrieveRequest, RetrieveResponse,
+    SessionInfo, SessionMessage, SessionUpdate,
+)
 from config import settings
+from agent_client import agent_client, end_message_text, extract_message_text, iter_stream_events, token_chunk
+from health import health_monitor
+from metrics import MetricsMiddleware, metrics, record_stage, stage
+from tracing import TracingMiddleware, set_span_attributes, tracing
+from answer_cache import CacheKey, answer_cache, make_cache_key
+from admission import Overloaded, agent_limiter, client_address, client_limiter, is_trusted_proxy
+from resilience import CircuitOpen, agent_breaker, fallback_message, is_failure
+from retrieval_service import retrieval_service
+from context_builder import build_agent_input
+from session_store import SessionRecord, session_store
+from shared_state import shared_state
+from single_flight import Flight, single_flight
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream connections on startup and close them on shutdown
+
+    Uvicorn runs the shutdown part only after in-flight requests finished
+    (or SHUTDOWN_GRACE_SECONDS passed), so streams being relayed keep their
+    upstream connections while the worker drains.
+    """
+    if settings.web_concurrency > 1:
+        logger.warning(
+            f"Worker {os.getpid()} of {settings.web_concurrency}: the agent concurrency limit, circuit breaker, "
+            f"health monitor, request coalescing and metrics are per worker"
+        )
+    tracing.start()
+    await agent_client.start()
+    await retrieval_service.start()
+    await session_store.start()
+    await shared_state.start()
+    answer_cache.start(shared_state.redis)
+    client_limiter.start(shared_state.redis)
+    health_monitor.start()
+    metrics.start()
+    try:
+        yield
+    finally:
+        await metrics.stop()
+        await health_monitor.stop()
+        await shared_state.close()
+        await session_store.close()
+        await retrieval_service.close()
+        await agent_client.close()
+        tracing.close()
+
 
 # Create FastAPI application
 app = FastAPI(
@@ -20,6 +78,8 @@ app = FastAPI(
     version=settings.api_version,
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS configuration
@@ -29,22 +89,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=settings.cors_methods,
     allow_headers=settings.cors_headers,
+    expose_headers=["Server-Timing", "X-Cache", "X-Fallback"],
+)
+
+# Request metrics and Server-Timing header
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
+# Server span per request, continuing the frontend trace (outermost middleware)
+app.add_middleware(TracingMiddleware)
+
+# Component statistics exported as gauges on /metrics
+metrics.add_collector("cache", "Answer cache", answer_cache.snapshot)
+metrics.add_collector("coalescing", "Coalescing of identical agent requests", single_flight.snapshot)
+metrics.add_collector("admission", "Agent concurrency limiter", agent_limiter.snapshot)
+metrics.add_collector("client_limiter", "Per-client rate limiter", client_limiter.snapshot)
+metrics.add_collector(
+    "circuit", "Agent circuit breaker",
+    lambda: {**agent_breaker.snapshot(), "open": agent_breaker.state == "open"},
+)
+metrics.add_collector(
+    "agent", "Agent health monitor",
+    lambda: {**health_monitor.snapshot(), "up": health_monitor.status == "up"},
 )
+metrics.add_collector("sessions", "Session store", session_store.snapshot)
 
 
 # Dependency for checking external API availability
 async def check_external_api():
-    """Check external API service availability"""
-    try:
-        # Simple availability check without full request
-        response = requests.head(
-            settings.external_api_url.split("/api/v1/run")[0] + "/health",
-            timeout=5
+    """Check external API service availability from the background health monitor"""
+    if not health_monitor.is_available:
+        logger.warning(
+            f"External API might be unavailable: {health_monitor.last_error} "
+            f"({health_monitor.consecutive_failures} failed checks)"
+        )
+    return True  # Continue working even if health check failed
+
+
+# Dependency for per-client rate limiting of chat requests
+def client_identity(http_request: Request) -> str:
+    """
+    Rate limit key: the client address
+    
+    Behind a trusted proxy (TRUSTED_PROXIES) the address comes from
+    X-Forwarded-For. All frontend users share its address, so requests from
+    a trusted proxy are further split by the X-Client-Id it sends; the header
+    from any other peer is ignored, as rotating it would bypass the limit.
+    """
+    peer = http_request.client.host if http_request.client else None
+    address = client_address(peer, http_request.headers.get("x-forwarded-for"))
+    client_id = http_request.headers.get("x-client-id")
+    if client_id and is_trusted_proxy(peer):
+        return f"{address}/{client_id}"
+    return address
+
+
+async def enforce_client_rate_limit(http_request: Request):
+    """Reject clients that exceed their request rate with 429 and Retry-After"""
+    retry_after = await client_limiter.check(client_identity(http_request))
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
         )
-        return True
-    except Exception as e:
-        logger.warning(f"External API might be unavailable: {e}")
-        return True  # Continue working even if health check failed
 
 
 @app.get(
@@ -55,10 +162,13 @@ async def check_external_api():
 )
 async def health_check():
     """Health check endpoint"""
+    available = health_monitor.is_available and agent_breaker.state != "open"
     return HealthResponse(
-        status="healthy",
+        status="healthy" if available else "degraded",
         timestamp=datetime.now().isoformat(),
-        version=settings.api_version
+        version=settings.api_version,
+        agent=AgentHealth(**health_monitor.snapshot()),
+        circuit=CircuitHealth(**agent_breaker.snapshot())
     )
 
 
@@ -80,130 +190,654 @@ async def health_check():
             }
         },
         400: {"model": ErrorResponse, "description": "Bad request"},
+        429: {"model": ErrorResponse, "description": "Client or AI service rate limit exceeded"},
         500: {"model": ErrorResponse, "description": "Internal server error"},
-        503: {"model": ErrorResponse, "description": "External service unavailable"}
+        503: {"model": ErrorResponse, "description": "External service unavailable or overloaded"}
     }
 )
 async def chat(
     request: ChatRequest,
-    api_available: bool = Depends(check_external_api)
+    http_response: Response,
+    api_available: bool = Depends(check_external_api),
+    rate_limited: None = Depends(enforce_client_rate_limit)
 ):
     """
     Process chat request to AI assistant
     
     Accepts user message and returns response from veterinary AI assistant.
     Automatically generates session_id if not provided.
+    The agent input is built from the stored session (see context_builder).
+    Repeated questions are answered from the answer cache, identical questions
+    arriving while one is in flight share its agent call (see X-Cache header).
     """
-    try:
-        # Подготовка заголовков для внешнего API
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": settings.external_api_key
-        }
-        
-        # Подготовка payload для внешнего API
-        payload = {
-            "output_type": request.output_type,
-            "input_type": request.input_type,
-            "input_value": request.input_value,
+    record = await load_session(request)
+    cache_key, cached_answer, cache_status = await lookup_cached_answer(request, record)
+    http_response.headers["X-Cache"] = cache_status
+    set_span_attributes({"tailsense.session_id": request.session_id, "tailsense.cache": cache_status})
+    if cached_answer is not None:
+        await record_session_turn(request, cached_answer, agent_answered=False)
+        return {
+            "message": cached_answer,
             "session_id": request.session_id
         }
-        
-        logger.info(f"Sending request to external API with session_id: {request.session_id}")
-        
-        # Send request to external API
-        response = requests.post(
-            settings.external_api_url,
-            json=payload,
-            headers=headers,
-            timeout=settings.request_timeout
+    
+    try:
+        agent_breaker.check()
+        flight_key = coalescing_key(request, record)
+        flight, leader = single_flight.run(
+            flight_key,
+            lambda flight: fetch_answer(request, record, cache_key, flight, hedge=bool(record and not record.message_count))
         )
+        if not leader:
+            http_response.headers["X-Cache"] = "COALESCED"
+            set_span_attributes({"tailsense.cache": "COALESCED"})
+            logger.info(f"Joined in-flight agent request for session_id: {request.session_id}")
         
-        # Check response status
-        response.raise_for_status()
-        
-        # Parse response
-        resp_json = response.json()
-        
-        # Extract message text
+        waited = time.perf_counter()
         try:
-            message_text = resp_json["outputs"][0]["outputs"][0]["results"]["message"]["data"]["text"]
-            session_id = resp_json.get("session_id", request.session_id)
-        except (KeyError, IndexError, TypeError) as e:
-            logger.error(f"Error parsing response structure: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail="Unexpected response structure from external API"
-            )
+            message_text = await flight.result()
+        finally:
+            single_flight.leave(flight)
+        if not leader:
+            record_stage("coalesced", time.perf_counter() - waited)
+        # The agent ran in the leader's session only (or in a throwaway one if the
+        # hedged duplicate won): the others pass the turn on in their next input
+        await record_session_turn(request, message_text, agent_answered=leader and flight.agent_session)
         
         # Return simplified response
         return {
             "message": message_text,
-            "session_id": session_id
+            "session_id": request.session_id
+        }
+    
+    except CircuitOpen as e:
+        # Agent is down: answer with the fallback text at once instead of waiting for a timeout
+        http_response.headers["X-Fallback"] = "circuit-open"
+        http_response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return {
+            "message": fallback_message(request.animal),
+            "session_id": request.session_id
         }
+    
+    except HTTPException:
+        raise
+    
+    except httpx.HTTPError as e:
+        raise upstream_http_exception(e)
+    
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error"
+        )
+
+
+@app.post(
+    "/api/v1/chat/stream",
+    summary="Stream AI assistant response",
+    description="Sends message to veterinary AI assistant and streams the response as Server-Sent Events",
+    responses={
+        200: {
+            "description": "Event stream: `token` events with text chunks, then `end` or `error`",
+            "content": {
+                "text/event-stream": {
+                    "example": (
+                        'event: token\ndata: {"chunk": "Мастит"}\n\n'
+                        'event: end\ndata: {"message": "Мастит ...", '
+                        '"session_id": "550e8400-e29b-41d4-a716-446655440000"}\n\n'
+                    )
+                }
+            }
+        },
+        429: {"model": ErrorResponse, "description": "Client or AI service rate limit exceeded"},
+        500: {"model": ErrorResponse, "description": "Internal server error"},
+        503: {"model": ErrorResponse, "description": "External service unavailable or overloaded"}
+    }
+)
+async def chat_stream(
+    request: ChatRequest,
+    api_available: bool = Depends(check_external_api),
+    rate_limited: None = Depends(enforce_client_rate_limit)
+):
+    """
+    Stream chat response from AI assistant
+    
+    Relays LangFlow stream mode token by token. Errors before the first byte
+    are returned with the same status codes as /api/v1/chat; errors after
+    that are sent as an `error` event. Identical questions arriving while one
+    is in flight follow its stream instead of starting another run. When the
+    client disconnects, the agent run is cancelled unless others follow it.
+    """
+    stream_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    
+    record = await load_session(request)
+    cache_key, cached_answer, cache_status = await lookup_cached_answer(request, record)
+    stream_headers["X-Cache"] = cache_status
+    set_span_attributes({"tailsense.session_id": request.session_id, "tailsense.cache": cache_status})
+    if cached_answer is not None:
+        async def replay():
+            await record_session_turn(request, cached_answer, agent_answered=False)
+            yield sse_event("token", {"chunk": cached_answer})
+            yield sse_event("end", {"message": cached_answer, "session_id": request.session_id})
         
-    except requests.exceptions.Timeout:
-        logger.error("Request timeout to external API")
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=stream_headers)
+    
+    try:
+        agent_breaker.check()
+        flight_key = coalescing_key(request, record)
+        flight, leader = single_flight.run(
+            flight_key, lambda flight: stream_answer(request, record, cache_key, flight)
+        )
+        if not leader:
+            stream_headers["X-Cache"] = "COALESCED"
+            set_span_attributes({"tailsense.cache": "COALESCED"})
+            logger.info(f"Joined in-flight agent stream for session_id: {request.session_id}")
+        waited = time.perf_counter()
+        await flight.wait_opened()
+        if not leader:
+            record_stage("coalesced", time.perf_counter() - waited)
+    except CircuitOpen as e:
+        message_text = fallback_message(request.animal)
+        
+        async def fallback():
+            yield sse_event("token", {"chunk": message_text})
+            yield sse_event("end", {"message": message_text, "session_id": request.session_id, "fallback": True})
+        
+        stream_headers.update({"X-Fallback": "circuit-open", "Retry-After": str(math.ceil(e.retry_after))})
+        return StreamingResponse(fallback(), media_type="text/event-stream", headers=stream_headers)
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        raise upstream_http_exception(e)
+    
+    async def relay():
+        try:
+            async for chunk in flight.follow():
+                yield sse_event("token", {"chunk": chunk})
+        except HTTPException as e:
+            yield sse_event("error", {"error": e.detail})
+            return
+        except httpx.HTTPError as e:
+            yield sse_event("error", {"error": upstream_http_exception(e).detail})
+            return
+        except Exception as e:
+            logger.error(f"Unexpected stream error: {e}")
+            yield sse_event("error", {"error": "Internal server error"})
+            return
+        finally:
+            # Client disconnected (e.g. the user cancelled): the agent run stops if nobody else follows it
+            single_flight.leave(flight)
+        
+        await record_session_turn(request, flight.text, agent_answered=leader)
+        yield sse_event("end", {
+            "message": flight.text,
+            "session_id": request.session_id
+        })
+    
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers=stream_headers
+    )
+
+
+@app.get(
+    "/api/v1/cache",
+    summary="Answer cache statistics",
+    description="Returns hit/miss counters and size of the answer cache and coalesced agent calls"
+)
+async def cache_stats():
+    """Answer cache statistics"""
+    return {**answer_cache.snapshot(), "coalescing": single_flight.snapshot()}
+
+
+@app.get(
+    "/api/v1/admission",
+    summary="Admission control statistics",
+    description="Returns the adaptive agent concurrency limit, wait queue and rate limiting counters"
+)
+async def admission_stats():
+    """Admission control statistics"""
+    return {"agent": agent_limiter.snapshot(), "clients": client_limiter.snapshot()}
+
+
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Prometheus metrics",
+    description="Request latency and size histograms, upstream call latency, event loop lag and component statistics"
+)
+async def prometheus_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled, set METRICS_ENABLED")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.delete(
+    "/api/v1/cache",
+    summary="Clear answer cache",
+    description="Drops all cached answers, e.g. after the knowledge base was updated"
+)
+async def clear_cache():
+    """Clear answer cache"""
+    await answer_cache.clear()
+    return answer_cache.snapshot()
+
+
+@app.post(
+    "/api/v1/retrieve",
+    response_model=RetrieveResponse,
+    summary="Search the knowledge base",
+    description="Returns the knowledge base chunks closest to the query",
+    responses={
+        503: {"model": ErrorResponse, "description": "Retrieval is disabled"}
+    }
+)
+async def retrieve(request: RetrieveRequest):
+    """
+    Search the knowledge base
+    
+    Served from the in-process vector index (RETRIEVAL_BACKEND=local) or
+    Qdrant (RETRIEVAL_BACKEND=qdrant). Only this endpoint and the benchmarks
+    use it: the agent flow still queries remote Qdrant itself, so chat
+    latency and prompt size do not depend on these settings.
+    """
+    if not retrieval_service.enabled:
         raise HTTPException(
             status_code=503,
-            detail="Request timeout to AI service"
+            detail="Retrieval is disabled, set RETRIEVAL_BACKEND"
         )
     
-    except requests.exceptions.ConnectionError:
-        logger.error("Connection error to external API")
+    started = time.perf_counter()
+    try:
+        with stage("retrieve"):
+            hits = await retrieval_service.search(request.query, request.limit)
+    except Exception as e:
+        logger.error(f"Retrieval error: {e}")
         raise HTTPException(
             status_code=503,
-            detail="Unable to connect to AI service"
+            detail="Knowledge base search failed"
+        )
+    
+    return RetrieveResponse(
+        backend=retrieval_service.backend,
+        took_ms=round((time.perf_counter() - started) * 1000, 1),
+        results=[
+            RetrievedChunk(
+                id=hit["id"],
+                score=hit["score"],
+                text=hit["payload"].get("text", ""),
+                filename=hit["payload"].get("filename"),
+                page_number=hit["payload"].get("page_number"),
+                chunk_index=hit["payload"].get("chunk_index"),
+            )
+            for hit in hits
+        ]
+    )
+
+
+async def lookup_cached_answer(request: ChatRequest,
+                               record: Optional[SessionRecord]) -> Tuple[Optional[CacheKey], Optional[str], str]:
+    """
+    Look up the request in the answer cache; cache errors count as a miss
+    
+    Sessions with history bypass the cache: the agent answers them with its
+    memory of the conversation, so the answer must not come from, or go
+    into, the answer cache.
+    
+    Returns:
+        (cache_key, answer, status): cache_key is None when the result must not
+        be cached; status is the X-Cache header value
+    """
+    if not answer_cache.enabled:
+        return None, None, "DISABLED"
+    
+    if not request.use_cache or record is None or record.message_count > 0:
+        answer_cache.stats.bypassed += 1
+        return None, None, "BYPASS"
+    
+    animal, symptoms = effective_profile(request, record)
+    cache_key = make_cache_key(animal, symptoms, request.question or request.input_value)
+    try:
+        with stage("cache"):
+            answer, tier = await answer_cache.lookup(cache_key)
+    except Exception as e:
+        logger.warning(f"Answer cache lookup failed: {e}")
+        return cache_key, None, "MISS"
+    if answer is not None:
+        logger.info(f"Answer cache {tier} hit for session_id: {request.session_id}")
+        return cache_key, answer, f"HIT-{tier.upper()}"
+    return cache_key, None, "MISS"
+
+
+def effective_profile(request: ChatRequest, record: Optional[SessionRecord]) -> Tuple[Optional[str], List[str]]:
+    """Animal and symptoms the agent answers for: the request's, else the ones stored in the session"""
+    if record is None:
+        return request.animal, list(request.symptoms)
+    return request.animal or record.animal, list(request.symptoms or record.symptoms)
+
+
+async def store_answer(cache_key: Optional[CacheKey], answer: str) -> None:
+    """Put the agent's answer into the answer cache; cache errors never fail the chat"""
+    if cache_key is None:
+        return
+    try:
+        await answer_cache.store(cache_key, answer)
+    except Exception as e:
+        logger.warning(f"Failed to cache answer: {e}")
+
+
+async def load_session(request: ChatRequest) -> Optional[SessionRecord]:
+    """
+    Stored session of the request, a new empty one if there is none
+    
+    Returns None when the lookup failed: the request is then answered
+    without the session context and bypasses the answer cache.
+    """
+    if not session_store.enabled:
+        return SessionRecord(session_id=request.session_id)
+    try:
+        with stage("session"):
+            record = await session_store.get(request.session_id)
+    except Exception as e:
+        logger.warning(f"Session lookup failed for {request.session_id}: {e}")
+        return None
+    return record or SessionRecord(session_id=request.session_id)
+
+
+async def record_session_turn(request: ChatRequest, answer: str, agent_answered: bool) -> None:
+    """Append the question and answer to the stored session; store errors never fail the chat"""
+    if not session_store.enabled:
+        return
+    try:
+        with stage("session"):
+            await session_store.append_turn(
+                request.session_id,
+                request.question or request.input_value,
+                answer,
+                animal=request.animal,
+                symptoms=request.symptoms,
+                agent_answered=agent_answered,
+            )
+    except Exception as e:
+        logger.warning(f"Failed to record session {request.session_id}: {e}")
+
+
+def coalescing_key(request: ChatRequest, record: Optional[SessionRecord]) -> Optional[CacheKey]:
+    """
+    Key under which identical in-flight requests share one agent call
+    
+    The normalized question with the effective profile, whether or not the
+    answer cache is used; None (no coalescing) for sessions that already have
+    history, whose answers depend on it.
+    """
+    if not single_flight.enabled or record is None or record.message_count > 0:
+        return None
+    animal, symptoms = effective_profile(request, record)
+    return make_cache_key(animal, symptoms, request.question or request.input_value)
+
+
+async def fetch_answer(request: ChatRequest, record: Optional[SessionRecord], cache_key: Optional[CacheKey],
+                       flight: Flight, hedge: bool = False) -> None:
+    """
+    Run the agent flow and deliver the whole answer to the flight
+    
+    The call goes through the circuit breaker with retries; `hedge` allows a
+    duplicate run when this one is slow (AGENT_HEDGE_ENABLED), for sessions
+    without history only, whose input does not rely on the agent memory.
+    The duplicate runs in a throwaway agent session, so the request's
+    session never stores the turn twice; if the duplicate wins, the turn
+    is not in the request's agent session and the next input carries it.
+    """
+    async def run(run_payload: Dict[str, Any], hedged: bool) -> Tuple[bytes, bool]:
+        return await agent_client.run(run_payload), hedged
+    
+    # Send request to external API over the shared connection pool
+    try:
+        async with agent_limiter.slot("run") as slot:
+            record_stage("queue", slot.queue_time)
+            logger.info(f"Sending request to external API with session_id: {request.session_id}")
+            payload = build_agent_payload(request, record)
+            hedge_payload = {**payload, "session_id": f"hedge-{uuid.uuid4()}"}
+            with stage("agent"):
+                body, hedged = await agent_breaker.call(
+                    lambda: run(payload, False),
+                    hedge=(lambda: run(hedge_payload, True)) if hedge else None,
+                )
+    except Overloaded as e:
+        raise overloaded_exception(e)
+    
+    flight.agent_session = not hedged
+    try:
+        message_text = extract_message_text(body)
+    except ValueError as e:
+        logger.error(f"Error parsing response structure: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Unexpected response structure from external API"
         )
     
-    except requests.exceptions.HTTPError as e:
+    await store_answer(cache_key, message_text)
+    flight.finish(message_text)
+
+
+async def stream_answer(request: ChatRequest, record: Optional[SessionRecord], cache_key: Optional[CacheKey],
+                        flight: Flight) -> None:
+    """Relay a LangFlow stream mode run into the flight token by token"""
+    try:
+        async with agent_limiter.slot("stream") as slot:
+            record_stage("queue", slot.queue_time)
+            logger.info(f"Streaming request to external API with session_id: {request.session_id}")
+            payload = build_agent_payload(request, record)
+            with stage("agent"):
+                upstream = await agent_breaker.call(lambda: agent_client.open_stream(payload))
+            slot.mark()
+            flight.open()
+            try:
+                await relay_stream_events(upstream, cache_key, flight)
+            except Exception as e:
+                # Only upstream failures mid-stream (timeouts, dropped connection) count against the agent
+                if is_failure(e):
+                    agent_breaker.record_failure(e)
+                raise
+    except Overloaded as e:
+        raise overloaded_exception(e)
+
+
+async def relay_stream_events(upstream: httpx.Response, cache_key: Optional[CacheKey], flight: Flight) -> None:
+    """Push LangFlow stream events into the flight until the end event"""
+    async with aclosing(iter_stream_events(upstream)) as events:
+        async for event in events:
+            kind = event.event
+            
+            if kind == "token":
+                chunk = token_chunk(event)
+                if chunk:
+                    flight.push(chunk)
+            
+            elif kind == "end":
+                if not flight.chunks:
+                    # Flow model without streaming: send the whole answer at once
+                    try:
+                        flight.push(end_message_text(event))
+                    except ValueError as e:
+                        logger.error(f"Error parsing stream result structure: {e}")
+                        raise HTTPException(
+                            status_code=500,
+                            detail="Unexpected response structure from external API"
+                        )
+                message_text = "".join(flight.chunks)
+                await store_answer(cache_key, message_text)
+                flight.finish(message_text)
+                return
+            
+            elif kind == "error":
+                logger.error(f"Error event from external API stream: {bytes(event.data)[:500]!r}")
+                raise HTTPException(status_code=500, detail="External API error")
+    
+    raise HTTPException(status_code=500, detail="Stream from AI service ended unexpectedly")
+
+
+def overloaded_exception(e: Overloaded) -> HTTPException:
+    """Fast 503 for an agent call shed by the admission controller"""
+    logger.warning(f"Agent call shed: {e.reason}")
+    return HTTPException(
+        status_code=503,
+        detail="AI service is overloaded, please retry later",
+        headers={"Retry-After": "1"}
+    )
+
+
+def build_agent_payload(request: ChatRequest, record: Optional[SessionRecord]) -> Dict[str, Any]:
+    """Build the LangFlow run payload: the question with the context the agent has not seen"""
+    animal, symptoms = effective_profile(request, record)
+    input_value = build_agent_input(
+        record or SessionRecord(session_id=request.session_id),
+        request.question or request.input_value,
+        settings,
+        animal=animal,
+        symptoms=symptoms,
+    )
+    return {
+        "output_type": request.output_type,
+        "input_type": request.input_type,
+        "input_value": input_value,
+        "session_id": request.session_id
+    }
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+def upstream_http_exception(e: httpx.HTTPError) -> HTTPException:
+    """Map an upstream httpx error to the HTTPException returned to the client"""
+    if isinstance(e, httpx.TimeoutException):
+        logger.error("Request timeout to external API")
+        return HTTPException(
+            status_code=503,
+            detail="Request timeout to AI service"
+        )
+    
+    if isinstance(e, httpx.HTTPStatusError):
         logger.error(f"HTTP error from external API: {e}")
         if e.response.status_code == 401:
-            raise HTTPException(
+            return HTTPException(
                 status_code=500,
                 detail="Authorization error in external API"
             )
         elif e.response.status_code == 429:
-            raise HTTPException(
+            return HTTPException(
                 status_code=429,
                 detail="Rate limit exceeded for AI service"
             )
         else:
-            raise HTTPException(
+            return HTTPException(
                 status_code=500,
                 detail=f"External API error: {e.response.status_code}"
             )
     
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+    logger.error("Connection error to external API")
+    return HTTPException(
+        status_code=503,
+        detail="Unable to connect to AI service"
+    )
+
+
+def require_session_store() -> None:
+    if not session_store.enabled:
         raise HTTPException(
-            status_code=500,
-            detail="Internal server error"
+            status_code=503,
+            detail="Session store is disabled, set SESSION_BACKEND"
         )
 
 
+def session_info(record: SessionRecord) -> SessionInfo:
+    return SessionInfo(
+        session_id=record.session_id,
+        animal=record.animal,
+        symptoms=record.symptoms,
+        summary=record.summary,
+        history=[SessionMessage(role=role, content=content) for role, content in record.history],
+        message_count=record.message_count,
+        created_at=datetime.fromtimestamp(record.created_at).isoformat(),
+        updated_at=datetime.fromtimestamp(record.updated_at).isoformat(),
+    )
+
+
+@app.get(
+    "/api/v1/sessions",
+    summary="Session store statistics",
+    description="Returns the session store backend, size and counters"
+)
+async def session_stats():
+    """Session store statistics"""
+    return session_store.snapshot()
+
+
 @app.get(
     "/api/v1/sessions/{session_id}",
+    response_model=SessionInfo,
     summary="Get session information",
-    description="Returns information about existing chat session"
+    description="Returns the stored animal, symptoms, history and summary of a chat session",
+    responses={
+        404: {"model": ErrorResponse, "description": "Session not found or expired"},
+        503: {"model": ErrorResponse, "description": "Session store is disabled"}
+    }
 )
 async def get_session_info(session_id: str):
     """Getting information about the session"""
-    # In real application there would be database logic here
-    return {
-        "session_id": session_id,
-        "status": "active",
-        "created_at": datetime.now().isoformat()
+    require_session_store()
+    record = await session_store.get(session_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session_info(record)
+
+
+@app.put(
+    "/api/v1/sessions/{session_id}",
+    response_model=SessionInfo,
+    summary="Create or update session",
+    description="Sets the animal and symptoms of a chat session, creating it if needed",
+    responses={
+        503: {"model": ErrorResponse, "description": "Session store is disabled"}
+    }
+)
+async def update_session(session_id: str, update: SessionUpdate):
+    """Create or update the session profile"""
+    require_session_store()
+    record = await session_store.update_profile(session_id, update.animal, update.symptoms)
+    return session_info(record)
+
+
+@app.delete(
+    "/api/v1/sessions/{session_id}",
+    summary="Delete session",
+    description="Drops the stored session, e.g. when the user starts a new consultation",
+    responses={
+        404: {"model": ErrorResponse, "description": "Session not found"},
+        503: {"model": ErrorResponse, "description": "Session store is disabled"}
     }
+)
+async def delete_session(session_id: str):
+    """Delete the session"""
+    require_session_store()
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "deleted": True}
 
 
 # Exception handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """HTTP exception handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail, "detail": None}
+        content={"error": exc.detail, "detail": None},
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -211,7 +845,7 @@ async def http_exception_handler(request, exc):
 async def general_exception_handler(request, exc):
     """General exception handler"""
     logger.error(f"Unhandled exception: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"error": "Internal server error", "detail": str(exc)}
     )
@@ -220,10 +854,15 @@ async def general_exception_handler(request, exc):
 if __name__ == "__main__":
     import uvicorn
     
+    # Несколько воркеров: CPU-работа (валидация, разбор JSON ответов агента) идет на всех ядрах.
+    # По SIGTERM воркер перестает принимать соединения и дожидается текущих запросов
     uvicorn.run(
         "main:app",
         host=settings.host,
         port=settings.port,
         reload=settings.debug,
+        workers=settings.web_concurrency,
+        proxy_headers=False,  # X-Forwarded-For разбирает client_identity по TRUSTED_PROXIES
+        timeout_graceful_shutdown=settings.shutdown_grace_seconds,
         log_level="info"
     )
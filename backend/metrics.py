@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from starlette.datastructures import MutableHeaders
+
+from config import Settings, settings
+from tracing import SpanKind, route_template, span
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    """Value that goes up and down, per label values"""
+
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class Histogram:
+    """Bucketed distribution per label values
+
+    Observations are counted in per-bucket slots (not cumulative), the
+    cumulative `le` counts are computed only when /metrics is scraped.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[Labels, List[float]] = {}  # bucket counts, then +Inf, then sum
+
+    def observe(self, value: float, *labels: str) -> None:
+        slots = self.values.get(labels)
+        if slots is None:
+            slots = self.values[labels] = [0.0] * (len(self.buckets) + 2)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, slots in self.values.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), slots):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{format_value(bound)}"'
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, le)} {format_value(cumulative)}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(slots[-1])}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {format_value(cumulative)}"
+
+
+class Timings:
+    """Durations of the processing stages of one request, for Server-Timing"""
+
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self, total: float) -> str:
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Этапы текущего запроса; фоновые задачи (вызов агента в single_flight) наследуют тот же объект
+current_timings: ContextVar[Optional[Timings]] = ContextVar("current_timings", default=None)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a stage duration to the current request (no-op outside a request)"""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block as a stage of the current request, traced as a span"""
+    started = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def outcome(error: Optional[BaseException]) -> str:
+    """Label of an upstream call result: ok, the HTTP status or the exception class"""
+    if error is None:
+        return "ok"
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    return error.__class__.__name__
+
+
+class Metrics:
+    """Process-wide metrics in the Prometheus text format
+
+    Everything runs on the event loop thread, so counters and histograms are
+    plain dict updates without locks; the text is rendered only on scrape.
+    Component snapshots (cache, admission, breaker, sessions) are read at
+    scrape time through collectors instead of being mirrored per request.
+    Each worker process has its own registry.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.http_requests = Histogram(
+            "tailsense_http_request_duration_seconds", "HTTP request duration until the last body byte",
+            ("method", "route", "status"),
+        )
+        self.http_in_flight = Gauge("tailsense_http_requests_in_flight", "HTTP requests being processed")
+        self.http_request_size = Histogram(
+            "tailsense_http_request_size_bytes", "HTTP request body size", ("route",), SIZE_BUCKETS
+        )
+        self.http_response_size = Histogram(
+            "tailsense_http_response_size_bytes", "HTTP response body size", ("route",), SIZE_BUCKETS
+        )
+        self.stages = Histogram(
+            "tailsense_stage_duration_seconds", "Duration of request processing stages (see Server-Timing)",
+            ("route", "stage"),
+        )
+        self.upstream = Histogram(
+            "tailsense_upstream_duration_seconds", "Upstream call duration (stream calls: until the headers)",
+            ("target", "operation", "outcome"),
+        )
+        self.loop_lag = Histogram(
+            "tailsense_event_loop_lag_seconds", "Delay of event loop timer callbacks", buckets=LAG_BUCKETS
+        )
+        self.loop_lag_max = Gauge(
+            "tailsense_event_loop_lag_max_seconds", "Largest event loop lag since the previous scrape"
+        )
+        self._metrics = [
+            self.http_requests, self.http_in_flight, self.http_request_size, self.http_response_size,
+            self.stages, self.upstream, self.loop_lag, self.loop_lag_max,
+        ]
+        self._collectors: Dict[str, Tuple[str, Callable[[], Dict[str, Any]]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.metrics_enabled
+
+    def add_collector(self, component: str, description: str, snapshot: Callable[[], Dict[str, Any]]) -> None:
+        """Export the numeric fields of a snapshot() as tailsense_<component>_<field> gauges
+
+        `description` names the component in the HELP line of every field.
+        """
+        self._collectors[component] = (description, snapshot)
+
+    @contextmanager
+    def upstream_call(self, target: str, operation: str) -> Iterator[None]:
+        """Time an upstream call by target, operation and outcome, traced as a client span"""
+        started = time.perf_counter()
+        error = None
+        try:
+            with span(f"{target} {operation}", kind=SpanKind.CLIENT):
+                yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self.enabled:
+                self.upstream.observe(time.perf_counter() - started, target, operation, outcome(error))
+
+    async def _measure_loop_lag(self) -> None:
+        interval = self.config.metrics_loop_lag_interval
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max.set(value=max(lag, self.loop_lag_max.values.get((), 0.0)))
+
+    def start(self) -> None:
+        """Start the event loop lag probe (called from the application lifespan)"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        self.loop_lag_max.values.clear()
+
+        for component, (description, snapshot) in self._collectors.items():
+            try:
+                values = snapshot()
+            except Exception as e:
+                logger.warning(f"Metrics collector {component} failed: {e}")
+                continue
+            for field, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"tailsense_{component}_{field}"
+                lines.append(f"# HELP {name} {description}: {field.replace('_', ' ')}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request metrics and the Server-Timing header
+
+    A plain ASGI wrapper rather than BaseHTTPMiddleware, so streamed
+    responses are passed through untouched. Stages recorded with `stage()`
+    before the response starts are sent in Server-Timing; the route label is
+    the path template of the matched route, so ids in paths do not create
+    new series.
+    """
+
+    def __init__(self, app, registry: "Metrics"):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        timings = Timings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        state = {"status": 500, "received": 0, "sent": 0}
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if timings.stages:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", timings.header(time.perf_counter() - started))
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        registry.http_in_flight.inc(amount=1)
+        try:
+            await self.app(scope, receive_counted, send_timed)
+        finally:
+            registry.http_in_flight.inc(amount=-1)
+            current_timings.reset(token)
+            route = route_template(scope) or "unmatched"
+            registry.http_requests.observe(
+                time.perf_counter() - started, scope["method"], route, str(state["status"])
+            )
+            registry.http_request_size.observe(state["received"], route)
+            registry.http_response_size.observe(state["sent"], route)
+            for name, seconds in timings.stages.items():
+                registry.stages.observe(seconds, route, name)
+
+
+# Глобальный реестр метрик
+metrics = Metrics(settings)
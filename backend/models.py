@@ -5,10 +5,14 @@ import uuid
 
 class ChatRequest(BaseModel):
     """Chat API request model"""
-    input_value: str = Field(..., description="User message text")
+    input_value: str = Field(..., description="User question; the backend adds the animal, symptoms and session history the agent has not seen")
     session_id: Optional[str] = Field(default=None, description="Session ID (auto-generated if not provided)")
     output_type: str = Field(default="chat", description="Output data type")
     input_type: str = Field(default="chat", description="Input data type")
+    animal: Optional[str] = Field(default=None, description="Animal type (default: the one stored in the session), part of the answer cache key")
+    symptoms: list[str] = Field(default_factory=list, description="Observed symptoms (default: the stored ones), part of the answer cache key")
+    use_cache: bool = Field(default=True, description="Set to false to bypass the answer cache")
+    question: Optional[str] = Field(default=None, description="Question as typed by the user, used instead of input_value if set")
 
     def __init__(self, **data):
         if "session_id" not in data or data["session_id"] is None:
@@ -16,47 +20,88 @@ class ChatRequest(BaseModel):
         super().__init__(**data)
 
 
-class MessageData(BaseModel):
-    """Message data model"""
-    text: str = Field(..., description="AI response text")
+class ErrorResponse(BaseModel):
+    """Error model"""
+    error: str = Field(..., description="Error description")
+    detail: Optional[str] = Field(None, description="Additional error details")
 
 
-class MessageResult(BaseModel):
-    """Message result model"""
-    message: MessageData
+class AgentHealth(BaseModel):
+    """External agent health model"""
+    status: str = Field(..., description="Agent status: up, down or unknown")
+    latency_ms: Optional[float] = Field(None, description="Latency of the last health probe")
+    last_checked: Optional[str] = Field(None, description="Timestamp of the last health probe")
+    consecutive_failures: int = Field(0, description="Failed probes in a row")
+    total_failures: int = Field(0, description="Failed probes since startup")
+    last_error: Optional[str] = Field(None, description="Error of the last failed probe")
 
 
-class OutputResult(BaseModel):
-    """Output result model"""
-    results: MessageResult
+class CircuitHealth(BaseModel):
+    """Agent circuit breaker model"""
+    state: str = Field(..., description="closed, open or half_open")
+    consecutive_failures: int = Field(0, description="Failed agent calls in a row")
+    retry_after: Optional[float] = Field(None, description="Seconds until an open circuit lets a probe through")
+    changed_at: Optional[str] = Field(None, description="Timestamp of the last state change")
+    last_error: Optional[str] = Field(None, description="Error of the last failed call")
+    opened: int = Field(0, description="Times the circuit opened since startup")
+    rejected: int = Field(0, description="Calls answered with the fallback while open")
+    retries: int = Field(0, description="Retried agent calls")
+    hedges: int = Field(0, description="Hedged (duplicated) agent calls")
+    hedge_wins: int = Field(0, description="Hedged calls that answered first")
 
 
-class Output(BaseModel):
-    """Output data model"""
-    outputs: list[OutputResult]
+class HealthResponse(BaseModel):
+    """Health check response model"""
+    status: str = Field(..., description="Service status")
+    timestamp: str = Field(..., description="Check timestamp")
+    version: str = Field(..., description="API version")
+    agent: Optional[AgentHealth] = Field(None, description="Last known external agent status")
+    circuit: Optional[CircuitHealth] = Field(None, description="Circuit breaker around agent calls")
 
 
-class ChatResponse(BaseModel):
-    """Chat API response model"""
-    outputs: list[Output]
-    session_id: str = Field(..., description="Session ID")
-    
-    def get_message_text(self) -> str:
-        """Extracts message text from response"""
-        try:
-            return self.outputs[0].outputs[0].results.message.text
-        except (IndexError, AttributeError):
-            return ""
+class RetrieveRequest(BaseModel):
+    """Knowledge base search request model"""
+    query: str = Field(..., description="Search query")
+    limit: Optional[int] = Field(default=None, ge=1, le=200, description="Number of chunks (default from settings)")
 
 
-class ErrorResponse(BaseModel):
-    """Error model"""
-    error: str = Field(..., description="Error description")
-    detail: Optional[str] = Field(None, description="Additional error details")
+class RetrievedChunk(BaseModel):
+    """Knowledge base chunk model"""
+    id: str = Field(..., description="Point id")
+    score: float = Field(..., description="Cosine similarity, or the RRF score in hybrid mode")
+    text: str = Field("", description="Chunk text")
+    filename: Optional[str] = Field(None, description="Source document")
+    page_number: Optional[int] = Field(None, description="Page in the source document")
+    chunk_index: Optional[int] = Field(None, description="Chunk position in the document")
 
 
-class HealthResponse(BaseModel):
-    """Health check response model"""
-    status: str = Field(..., description="Service status")
-    timestamp: str = Field(..., description="Check timestamp")
-    version: str = Field(..., description="API version")
+class RetrieveResponse(BaseModel):
+    """Knowledge base search response model"""
+    backend: str = Field(..., description="Retrieval backend: local or qdrant")
+    took_ms: float = Field(..., description="Search time including query embedding")
+    results: list[RetrievedChunk]
+
+
+class SessionMessage(BaseModel):
+    """Session history message model"""
+    role: str = Field(..., description="user or assistant")
+    content: str = Field(..., description="Message text")
+
+
+class SessionUpdate(BaseModel):
+    """Session profile update model"""
+    animal: Optional[str] = Field(default=None, description="Animal type")
+    symptoms: list[str] = Field(default_factory=list, description="Observed symptoms")
+
+
+class SessionInfo(BaseModel):
+    """Stored session model"""
+    session_id: str = Field(..., description="Session ID")
+    status: str = Field("active", description="Session status")
+    animal: Optional[str] = Field(None, description="Animal type")
+    symptoms: list[str] = Field(default_factory=list, description="Observed symptoms")
+    summary: list[str] = Field(default_factory=list, description="Condensed messages older than the stored history")
+    history: list[SessionMessage] = Field(default_factory=list, description="Last messages of the session")
+    message_count: int = Field(0, description="Messages in the session, including summarized ones")
+    created_at: str = Field(..., description="Creation timestamp")
+    updated_at: str = Field(..., description="Last update timestamp")
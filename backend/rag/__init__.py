@@ -0,0 +1,5 @@
+"""
+Knowledge base tooling: PDF ingestion into the vector store and embedders.
+
+Run from the backend directory, e.g. `python -m rag.ingest ../data_sourse/papers`.
+"""
@@ -0,0 +1,125 @@
+"""
+Direct RAG answering over the knowledge base, without LangFlow.
+
+Port of `ask_qdrant` from notebooks/benchmark.ipynb: retrieve chunks for the
+question and ask the chat model to answer from them only. Each stage is
+timed so that benchmarks can attribute latency.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from rag.retrieval import QdrantRetriever
+
+ANSWER_MODEL = "gpt-4o-mini"
+
+PROMPT_TEMPLATE = """Системное сообщение:
+Ты — опытный ветеринарный консультант. У тебя есть доступ к базе знаний — текстам, документам и фрагментам, которые были извлечены по запросу пользователя.
+Когда пользователь задаёт вопрос, ты:
+- извлекаешь релевантные фрагменты из этой базы;
+- используешь **только** информацию, содержащуюся в этих фрагментах;
+- **не** добавляешь никаких внешних знаний или догадок за пределами базы;
+- если база не содержит достаточной информации для ответа — честно говоришь об этом.
+
+Инструкции к ответу:
+1. Прочти вопрос пользователя.
+2. Проверь, какие фрагменты базы связаны с этим вопросом.
+3. На основе этих фрагментов сформулируй ответ.
+4. Если фрагментов недостаточно — скажи: «Извините, но у меня нет достаточной информации в базе, чтобы ответить на этот вопрос».
+5. Ответ должен быть на русском языке, понятным, профессиональным.
+6. Обязательно укажи источники: название документа / файл / страница, откуда взят фрагмент.
+
+Пользовательский вопрос:
+{question}
+
+Фрагменты контекста:
+{context}
+
+Источники информации:
+{sources}"""
+
+
+def format_source(payload: Dict[str, Any]) -> str:
+    filename = payload.get("filename", "Unknown")
+    page = payload.get("page_number", -1)
+    return f"{filename} (стр. {page})" if page != -1 else filename
+
+
+def build_prompt(question: str, hits: List[Dict[str, Any]]) -> str:
+    context = "\n\n".join(hit["payload"].get("text", "") for hit in hits)
+    sources = sorted({format_source(hit["payload"]) for hit in hits})
+    return PROMPT_TEMPLATE.format(
+        question=question,
+        context=context,
+        sources="\n".join(f"• {source}" for source in sources),
+    )
+
+
+@dataclass
+class RagAnswer:
+    text: str
+    sources: List[str]
+    prompt_chars: int
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class RagAnswerer:
+    """Retrieve -> rerank (optional) -> prompt -> generate, with per-stage timings in seconds"""
+
+    def __init__(
+        self,
+        retriever: QdrantRetriever,
+        client=None,
+        model: str = ANSWER_MODEL,
+        limiter=None,
+        reranker=None,
+    ):
+        if client is None:
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.retriever = retriever
+        self.client = client
+        self.model = model
+        self.limiter = limiter
+        self.reranker = reranker
+
+    async def answer(self, question: str, limit: Optional[int] = None) -> RagAnswer:
+        timings = {}
+
+        started = time.perf_counter()
+        query_vector = (await self.retriever.embedder.embed([question]))[0]
+        timings["embed"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if hasattr(self.retriever, "search_with_vector"):
+            # Hybrid retrieval also needs the question text for BM25
+            hits = await self.retriever.search_with_vector(question, query_vector, limit)
+        else:
+            hits = await self.retriever.search_vector(query_vector, limit)
+        timings["retrieve"] = time.perf_counter() - started
+
+        if self.reranker is not None:
+            started = time.perf_counter()
+            hits = await asyncio.to_thread(self.reranker.rerank, question, hits)
+            timings["rerank"] = time.perf_counter() - started
+
+        prompt = build_prompt(question, hits)
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        started = time.perf_counter()
+        completion = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        timings["generate"] = time.perf_counter() - started
+
+        return RagAnswer(
+            text=completion.choices[0].message.content,
+            sources=sorted({format_source(hit["payload"]) for hit in hits}),
+            prompt_chars=len(prompt),
+            timings=timings,
+        )
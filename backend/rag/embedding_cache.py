@@ -0,0 +1,216 @@
+"""
+Persistent content-addressed embedding cache.
+
+Vectors are keyed by hash(model, text) and stored as fixed-size float16 or
+float32 rows in one binary file that is read through a memory map; a small
+SQLite index maps keys to rows and tracks last access for size-bounded LRU
+eviction. Freed rows are reused, so the vector file never grows beyond the
+configured size. The cache is blocking; CachedEmbedder calls it from a
+worker thread, and a lock serializes access to the index and the map.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", ".embedding_cache"))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """On-disk embedding store for one (model, dimension) pair"""
+
+    def __init__(
+        self,
+        root: Path,
+        model: str,
+        dim: int,
+        dtype: str = "float16",
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.model = model
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = self.dim * self.dtype.itemsize
+        self.max_rows = max(max_bytes // self.row_bytes, 1)
+
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self.path = Path(root) / f"{slug}-{dim}"
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.path / f"vectors.{self.dtype.name}"
+        self.vectors_path.touch(exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(
+            self.path / "index.sqlite", isolation_level=None, timeout=30, check_same_thread=False
+        )
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS entries (
+                key BLOB PRIMARY KEY,
+                row INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access);
+            CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._check_meta()
+        self._map: Optional[np.memmap] = None
+
+    def _check_meta(self) -> None:
+        expected = {"dim": str(self.dim), "dtype": self.dtype.name}
+        stored = dict(self.db.execute("SELECT name, value FROM meta WHERE name IN ('dim', 'dtype')"))
+        if stored and stored != expected:
+            raise ValueError(f"Embedding cache at {self.path} was created with {stored}, not {expected}")
+        self.db.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", expected.items())
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('next_row', '0')")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _rows_view(self, max_row: int) -> np.ndarray:
+        """Memory map of the vector file covering at least `max_row`"""
+        if self._map is None or self._map.shape[0] <= max_row:
+            rows = os.path.getsize(self.vectors_path) // self.row_bytes
+            self._map = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+        return self._map
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vectors in input order, None for misses"""
+        with self._lock:
+            return self._get_many(texts)
+
+    def _get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        keys = [cache_key(self.model, text) for text in texts]
+        rows = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            rows.update(self.db.execute(f"SELECT key, row FROM entries WHERE key IN ({placeholders})", part))
+        if not rows:
+            return [None] * len(texts)
+
+        view = self._rows_view(max(rows.values()))
+        now = time.time()
+        self.db.execute("BEGIN")
+        self.db.executemany("UPDATE entries SET last_access = ? WHERE key = ?", ((now, key) for key in rows))
+        self.db.execute("COMMIT")
+        return [
+            view[rows[key]].astype(np.float32).tolist() if key in rows else None
+            for key in keys
+        ]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store vectors, evicting least recently used entries over the size limit"""
+        data = np.asarray(vectors, dtype=self.dtype)
+        if data.ndim != 2 or data.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of size {self.dim}, got shape {data.shape}")
+        with self._lock:
+            self._put_many(texts, data)
+
+    def _put_many(self, texts: Sequence[str], data: np.ndarray) -> None:
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Free rows before writing, so the vector file stays within the limit
+            self._evict(incoming=len(data))
+            with open(self.vectors_path, "r+b") as f:
+                for text, vector in zip(texts, data):
+                    key = cache_key(self.model, text)
+                    existing = self.db.execute("SELECT row FROM entries WHERE key = ?", (key,)).fetchone()
+                    row = existing[0] if existing else self._allocate_row()
+                    f.seek(row * self.row_bytes)
+                    f.write(vector.tobytes())
+                    self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, row, now))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _allocate_row(self) -> int:
+        free = self.db.execute("SELECT row FROM free_rows LIMIT 1").fetchone()
+        if free:
+            self.db.execute("DELETE FROM free_rows WHERE row = ?", free)
+            return free[0]
+        row = int(self.db.execute("SELECT value FROM meta WHERE name = 'next_row'").fetchone()[0])
+        self.db.execute("UPDATE meta SET value = ? WHERE name = 'next_row'", (str(row + 1),))
+        return row
+
+    def _evict(self, incoming: int) -> None:
+        count = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count + incoming <= self.max_rows:
+            return
+        # Evict down to 90% of the limit so that eviction does not run on every put
+        excess = count + incoming - int(self.max_rows * 0.9)
+        victims = self.db.execute(
+            "SELECT key, row FROM entries ORDER BY last_access LIMIT ?", (excess,)
+        ).fetchall()
+        self.db.executemany("DELETE FROM entries WHERE key = ?", ((key,) for key, _ in victims))
+        self.db.executemany("INSERT OR IGNORE INTO free_rows VALUES (?)", ((row,) for _, row in victims))
+        logger.info(f"Embedding cache: evicted {len(victims)} least recently used vectors")
+
+    def close(self) -> None:
+        with self._lock:
+            self._map = None
+            self.db.close()
+
+
+class CachedEmbedder:
+    """Embedder wrapper that only sends cache misses to the wrapped embedder"""
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model = embedder.model
+        self.dim = embedder.dim
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def calls(self) -> int:
+        return self.embedder.calls
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        # SQLite and the vector file are read in a thread, not on the event loop
+        vectors = await asyncio.to_thread(self.cache.get_many, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # Дубликаты внутри одного запроса эмбеддим один раз
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = dict(zip(unique_texts, await self.embedder.embed(unique_texts)))
+            await asyncio.to_thread(self.cache.put_many, list(fresh), list(fresh.values()))
+            for i in missing:
+                vectors[i] = fresh[texts[i]]
+        return vectors
+
+
+def with_cache(
+    embedder,
+    cache_dir: Optional[Path] = DEFAULT_CACHE_DIR,
+    dtype: str = "float16",
+    max_bytes: int = DEFAULT_MAX_BYTES,
+):
+    """Wrap an embedder with the persistent cache; `cache_dir=None` disables it"""
+    if cache_dir is None:
+        return embedder
+    return CachedEmbedder(embedder, EmbeddingCache(cache_dir, embedder.model, embedder.dim, dtype, max_bytes))
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import struct
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+
+class OpenAIEmbedder:
+    """Async OpenAI embedder with adaptive batch size and retry/backoff
+
+    Texts are sent in batches whose size adapts to the API: it grows by
+    `batch_step` after every successful call and is halved on a rate limit
+    error. Rate limits, timeouts and 5xx errors are retried with jittered
+    exponential backoff, honouring Retry-After when the API sends it.
+    """
+
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        dim: int = EMBEDDING_DIM,
+        api_key: Optional[str] = None,
+        batch_size: int = 128,
+        min_batch_size: int = 16,
+        max_batch_size: int = 512,
+        batch_step: int = 32,
+        max_retries: int = 8,
+        max_backoff: float = 60.0,
+    ):
+        import openai
+
+        self._openai = openai
+        self.client = openai.AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_step = batch_step
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.retries = 0
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, preserving order"""
+        vectors: List[List[float]] = []
+        position = 0
+        while position < len(texts):
+            batch = texts[position:position + self.batch_size]
+            vectors.extend(await self._embed_batch(batch))
+            position += len(batch)
+        return vectors
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        retryable = (
+            self._openai.RateLimitError,
+            self._openai.APITimeoutError,
+            self._openai.APIConnectionError,
+            self._openai.InternalServerError,
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.calls += 1
+                response = await self.client.embeddings.create(model=self.model, input=texts)
+                self.batch_size = min(self.batch_size + self.batch_step, self.max_batch_size)
+                return [item.embedding for item in response.data]
+
+            except retryable as e:
+                if attempt == self.max_retries:
+                    raise
+                if isinstance(e, self._openai.RateLimitError):
+                    # Following batches are sent smaller until the API stops throttling
+                    self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+                delay = self._backoff(attempt, e)
+                logger.warning(
+                    f"Embedding request failed ({e.__class__.__name__}), "
+                    f"batch size {self.batch_size}, retry in {delay:.1f}s"
+                )
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return min(2 ** attempt, self.max_backoff) * (0.5 + random.random() / 2)
+
+
+class FakeEmbedder:
+    """Deterministic local embedder for benchmarks and offline runs
+
+    Produces pseudo-random unit vectors derived from the text hash and can
+    simulate API latency per call and per text.
+    """
+
+    def __init__(
+        self,
+        model: str = "fake-embedding",
+        dim: int = EMBEDDING_DIM,
+        batch_size: int = 512,
+        call_latency: float = 0.0,
+        text_latency: float = 0.0,
+    ):
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.call_latency = call_latency
+        self.text_latency = text_latency
+        self.calls = 0
+        self.retries = 0
+
+    def vector(self, text: str) -> List[float]:
+        seed = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+        rng = random.Random(struct.unpack("<Q", seed)[0])
+        values = [rng.gauss(0.0, 1.0) for _ in range(self.dim)]
+        norm = sum(v * v for v in values) ** 0.5 or 1.0
+        return [v / norm for v in values]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for position in range(0, len(texts), self.batch_size):
+            batch = texts[position:position + self.batch_size]
+            self.calls += 1
+            await asyncio.sleep(self.call_latency + self.text_latency * len(batch))
+            vectors.extend(self.vector(text) for text in batch)
+        return vectors
@@ -0,0 +1,660 @@
+"""
+Parallel, resumable PDF ingestion into the Qdrant knowledge base.
+
+Pipeline: parse page ranges in a process pool -> chunk -> embed -> upsert,
+connected by bounded queues so that parsing, embedding and upserts of
+different files and page ranges overlap. Progress is checkpointed per file
+and page range, so an interrupted run resumes where it stopped.
+
+Re-ingestion is incremental: point ids are derived from (source, chunk
+content hash), so only new or changed chunks are embedded, chunks that moved
+only get their payload updated, and chunks that disappeared from the source
+are deleted.
+
+Usage (from the backend directory):
+    python -m rag.ingest ../data_sourse/papers --collection TailSense
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from rag.embedding_cache import DEFAULT_CACHE_DIR, with_cache
+from rag.embeddings import EMBEDDING_DIM, EMBEDDING_MODEL, FakeEmbedder, OpenAIEmbedder
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "TailSense"
+POINT_NAMESPACE = uuid.UUID("5f0c7a52-4f59-4b8e-9f1e-2a4f3f6f7b11")
+# Payload fields that change when an unchanged chunk moves in a new edition
+POSITION_FIELDS = ("file_hash", "page_number", "chunk_index")
+
+
+@dataclass
+class IngestConfig:
+    """Ingestion pipeline settings"""
+    chunk_size: int = 1000
+    chunk_overlap: int = 200
+    pages_per_task: int = 16
+    parse_workers: int = max(os.cpu_count() or 1, 1)
+    embed_workers: int = 4
+    upsert_workers: int = 2
+    batch_size: int = 256
+    queue_size: int = 8
+    state_dir: Path = Path(".ingest_state")
+
+
+# --- Парсинг PDF (выполняется в пуле процессов) ---
+
+def count_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+
+def parse_page_range(
+    pdf_path: str, start: int, end: int, chunk_size: int, chunk_overlap: int
+) -> List[Tuple[int, str]]:
+    """Extract and split pages [start, end) into (page_number, text) chunks"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+    chunks = []
+    for page_number in range(start, min(end, len(reader.pages))):
+        text = reader.pages[page_number].extract_text() or ""
+        chunks.extend((page_number, chunk) for chunk in splitter.split_text(text))
+    return chunks
+
+
+def file_md5(path: Path, block_size: int = 1 << 20) -> str:
+    """MD5 of a file, read in blocks instead of loading it whole"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def point_id(source: str, chunk_hash: str) -> str:
+    """Deterministic point id of a chunk within a source document
+
+    Identical chunks of one source map to the same point, and a chunk keeps
+    its id across editions of the file as long as its text is unchanged.
+    """
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{source}:{chunk_hash}"))
+
+
+# --- Чекпоинты ---
+
+class Checkpoint:
+    """Per-file ingestion progress stored as JSON in the state directory
+
+    Records the point ids of every fully processed page range, so a resumed
+    run does not parse those pages again but still knows which points belong
+    to the current edition of the file.
+    """
+
+    FORMAT = 2
+
+    def __init__(self, path: Path, filename: str, file_hash: str, config: IngestConfig):
+        self.path = path
+        self.data: Dict[str, Any] = {
+            "format": self.FORMAT,
+            "filename": filename,
+            "file_hash": file_hash,
+            "chunk_size": config.chunk_size,
+            "chunk_overlap": config.chunk_overlap,
+            "pages_per_task": config.pages_per_task,
+            "ranges": {},
+            "completed": False,
+        }
+
+    @classmethod
+    def load(cls, state_dir: Path, filename: str, file_hash: str, config: IngestConfig) -> "Checkpoint":
+        # Per source as well: identical files under different names are separate sources
+        name = f"{file_hash}-{content_hash(filename)[:12]}.json"
+        checkpoint = cls(state_dir / name, filename, file_hash, config)
+        if checkpoint.path.exists():
+            stored = json.loads(checkpoint.path.read_text(encoding="utf-8"))
+            same_layout = all(
+                stored.get(key) == checkpoint.data[key]
+                for key in ("format", "chunk_size", "chunk_overlap", "pages_per_task")
+            )
+            if same_layout:
+                checkpoint.data = stored
+            else:
+                logger.info(f"Chunking settings changed for {filename}, starting over")
+        return checkpoint
+
+    @property
+    def completed(self) -> bool:
+        return self.data["completed"]
+
+    def range_done(self, start: int) -> bool:
+        return str(start) in self.data["ranges"]
+
+    def range_ids(self, start: int) -> List[str]:
+        return self.data["ranges"][str(start)]["ids"]
+
+    def point_ids(self) -> set:
+        """Ids of all points of the file recorded so far"""
+        return {pid for stored in self.data["ranges"].values() for pid in stored["ids"]}
+
+    def restart(self) -> None:
+        """Forget the recorded progress; the file is ingested again from its first page"""
+        self.data["ranges"] = {}
+        self.data["completed"] = False
+
+    def complete_range(self, start: int, ids: List[str]) -> None:
+        self.data["ranges"][str(start)] = {"chunks": len(ids), "ids": ids}
+
+    def mark_completed(self) -> None:
+        self.data["completed"] = True
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+# --- Хранилища векторов ---
+
+class QdrantSink:
+    """Writes points to a Qdrant collection"""
+
+    def __init__(self, url: Optional[str], api_key: Optional[str], collection: str = COLLECTION_NAME):
+        from qdrant_client import AsyncQdrantClient
+
+        self.client = AsyncQdrantClient(url=url, api_key=api_key)
+        self.collection = collection
+
+    async def ensure_collection(self, dim: int) -> None:
+        from qdrant_client.models import Distance, VectorParams
+
+        if not await self.client.collection_exists(self.collection):
+            logger.info(f"Creating collection {self.collection}")
+            await self.client.create_collection(
+                collection_name=self.collection,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            )
+        schema = (await self.client.get_collection(self.collection)).payload_schema
+        for field_name in ("file_hash", "filename"):
+            if field_name not in schema:
+                await self.client.create_payload_index(
+                    collection_name=self.collection,
+                    field_name=field_name,
+                    field_schema="keyword",
+                )
+
+    async def existing_points(self, source: str) -> Dict[str, Dict[str, Any]]:
+        """Ids and position payload of all points of a source document"""
+        from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+        existing: Dict[str, Dict[str, Any]] = {}
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(
+                collection_name=self.collection,
+                scroll_filter=Filter(must=[FieldCondition(key="filename", match=MatchValue(value=source))]),
+                with_payload=list(POSITION_FIELDS),
+                with_vectors=False,
+                limit=1000,
+                offset=offset,
+            )
+            existing.update((str(point.id), point.payload or {}) for point in points)
+            if offset is None:
+                return existing
+
+    async def upsert(self, points: List[Dict[str, Any]]) -> None:
+        from qdrant_client.models import PointStruct
+
+        await self.client.upsert(
+            collection_name=self.collection,
+            points=[PointStruct(**point) for point in points],
+            wait=True,
+        )
+
+    async def update_payloads(self, updates: List[Tuple[str, Dict[str, Any]]]) -> None:
+        from qdrant_client.models import SetPayload, SetPayloadOperation
+
+        await self.client.batch_update_points(
+            collection_name=self.collection,
+            update_operations=[
+                SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[point]))
+                for point, payload in updates
+            ],
+            wait=True,
+        )
+
+    async def delete(self, ids: List[str]) -> None:
+        from qdrant_client.models import PointIdsList
+
+        await self.client.delete(
+            collection_name=self.collection,
+            points_selector=PointIdsList(points=ids),
+            wait=True,
+        )
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class MemorySink:
+    """Keeps points in memory; used by benchmarks and dry runs"""
+
+    def __init__(self, upsert_latency: float = 0.0):
+        self.points: Dict[str, Dict[str, Any]] = {}
+        self.upsert_latency = upsert_latency
+        self.upserts = 0
+
+    async def ensure_collection(self, dim: int) -> None:
+        pass
+
+    async def existing_points(self, source: str) -> Dict[str, Dict[str, Any]]:
+        return {
+            point_id: {key: point["payload"].get(key) for key in POSITION_FIELDS}
+            for point_id, point in self.points.items()
+            if point["payload"].get("filename") == source
+        }
+
+    async def upsert(self, points: List[Dict[str, Any]]) -> None:
+        await asyncio.sleep(self.upsert_latency)
+        self.upserts += 1
+        for point in points:
+            self.points[point["id"]] = point
+
+    async def update_payloads(self, updates: List[Tuple[str, Dict[str, Any]]]) -> None:
+        await asyncio.sleep(self.upsert_latency)
+        for point_id, payload in updates:
+            self.points[point_id]["payload"].update(payload)
+
+    async def delete(self, ids: List[str]) -> None:
+        await asyncio.sleep(self.upsert_latency)
+        for point_id in ids:
+            self.points.pop(point_id, None)
+
+    async def close(self) -> None:
+        pass
+
+
+# --- Конвейер ---
+
+@dataclass
+class FileReport:
+    filename: str
+    file_hash: str = ""
+    status: str = "pending"  # ingested, resumed, skipped
+    pages: int = 0
+    chunks: int = 0
+    added: int = 0
+    moved: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class _RangeState:
+    start: int
+    ids: List[str]
+    pending: int = 0
+    enqueued: bool = False
+
+
+@dataclass
+class _FileState:
+    path: Path
+    report: FileReport
+    checkpoint: Optional[Checkpoint] = None
+    existing: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    seen: set = field(default_factory=set)
+    pending: int = 0
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    started: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class _Batch:
+    state: _FileState
+    range_state: _RangeState
+    # New chunks: (point_id, chunk_hash, chunk_index, page_number, text)
+    chunks: List[Tuple[str, str, int, int, str]] = field(default_factory=list)
+    vectors: Optional[List[List[float]]] = None
+    # Moved chunks: (point_id, position payload)
+    updates: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)
+
+
+class IngestPipeline:
+    """Concurrent parse -> diff -> embed -> upsert pipeline with bounded queues"""
+
+    def __init__(self, embedder, sink, config: Optional[IngestConfig] = None):
+        self.embedder = embedder
+        self.sink = sink
+        self.config = config or IngestConfig()
+        self._embed_queue: "asyncio.Queue[Optional[_Batch]]" = asyncio.Queue(self.config.queue_size)
+        self._upsert_queue: "asyncio.Queue[Optional[_Batch]]" = asyncio.Queue(self.config.queue_size)
+
+    async def run(self, files: Sequence[Union[Path, Tuple[Path, str]]],
+                  executor: Optional[Executor] = None) -> List[FileReport]:
+        """Ingest all files and return a report per file
+
+        Files are paths or (path, source) pairs, see `collect_pdfs`; the
+        source names the file in the collection and defaults to its name.
+        """
+        await self.sink.ensure_collection(self.embedder.dim)
+        states = []
+        for item in files:
+            path, source = item if isinstance(item, tuple) else (item, item.name)
+            states.append(_FileState(path=path, report=FileReport(filename=source)))
+
+        own_executor = executor is None
+        executor = executor or ProcessPoolExecutor(max_workers=self.config.parse_workers)
+        try:
+            async with asyncio.TaskGroup() as tg:
+                embedders = [tg.create_task(self._embed_worker()) for _ in range(self.config.embed_workers)]
+                upserters = [tg.create_task(self._upsert_worker()) for _ in range(self.config.upsert_workers)]
+
+                files = asyncio.Semaphore(self.config.parse_workers)
+                await asyncio.gather(*(self._produce(state, executor, files) for state in states))
+
+                for _ in embedders:
+                    await self._embed_queue.put(None)
+                await asyncio.gather(*embedders)
+                for _ in upserters:
+                    await self._upsert_queue.put(None)
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures=True)
+
+        return [state.report for state in states]
+
+    async def _produce(self, state: _FileState, executor: Executor, files: asyncio.Semaphore) -> None:
+        """Parse one file range by range, diff against stored points and feed the workers"""
+        loop = asyncio.get_running_loop()
+        report = state.report
+
+        async with files:
+            report.file_hash = await asyncio.to_thread(file_md5, state.path)
+            checkpoint = Checkpoint.load(self.config.state_dir, report.filename, report.file_hash, self.config)
+            state.checkpoint = checkpoint
+
+            state.existing = await self.sink.existing_points(report.filename)
+            if checkpoint.completed:
+                # The same content may have been ingested before another edition
+                # replaced its points (v1 -> v2 -> v1): skip only if they are still stored
+                if set(state.existing) == checkpoint.point_ids():
+                    report.status = "skipped"
+                    logger.info(f"{report.filename}: already ingested, skipping")
+                    return
+                logger.info(f"{report.filename}: stored points differ from the checkpoint, ingesting again")
+                checkpoint.restart()
+
+            report.status = "resumed" if checkpoint.data["ranges"] else "ingested"
+            report.pages = await loop.run_in_executor(executor, count_pages, str(state.path))
+            starts = list(range(0, report.pages, self.config.pages_per_task))
+            logger.info(
+                f"{report.filename}: {report.pages} pages, {len(starts)} ranges, "
+                f"{len(state.existing)} stored points ({report.status})"
+            )
+
+            # Ranges are parsed ahead in a bounded window and consumed in order,
+            # so chunk indices are stable between runs
+            window = self.config.parse_workers * 2
+            futures: Dict[int, asyncio.Future] = {}
+            next_submit = 0
+            chunk_offset = 0
+
+            for start in starts:
+                while next_submit < len(starts) and len(futures) < window:
+                    submit_start = starts[next_submit]
+                    next_submit += 1
+                    if checkpoint.range_done(submit_start):
+                        continue
+                    futures[submit_start] = loop.run_in_executor(
+                        executor, parse_page_range, str(state.path), submit_start,
+                        submit_start + self.config.pages_per_task,
+                        self.config.chunk_size, self.config.chunk_overlap,
+                    )
+
+                if checkpoint.range_done(start):
+                    ids = checkpoint.range_ids(start)
+                    state.seen.update(ids)
+                    chunk_offset += len(ids)
+                    report.chunks += len(ids)
+                    report.unchanged += len(ids)
+                    continue
+
+                parsed = await futures.pop(start)
+                range_state = _RangeState(start=start, ids=[])
+                report.chunks += len(parsed)
+                new_chunks, updates = [], []
+
+                for i, (page_number, text) in enumerate(parsed):
+                    chunk_index = chunk_offset + i
+                    chunk_hash = content_hash(text)
+                    pid = point_id(report.filename, chunk_hash)
+                    range_state.ids.append(pid)
+                    if pid in state.seen:
+                        continue  # duplicate text within the same source
+                    state.seen.add(pid)
+
+                    stored = state.existing.get(pid)
+                    if stored is None:
+                        new_chunks.append((pid, chunk_hash, chunk_index, page_number, text))
+                        continue
+                    position = {"file_hash": report.file_hash, "page_number": page_number, "chunk_index": chunk_index}
+                    if any(stored.get(key) != value for key, value in position.items()):
+                        updates.append((pid, position))
+                    else:
+                        report.unchanged += 1
+                chunk_offset += len(parsed)
+
+                for i in range(0, len(new_chunks), self.config.batch_size):
+                    await self._enqueue(self._embed_queue, _Batch(
+                        state, range_state, chunks=new_chunks[i:i + self.config.batch_size]
+                    ))
+                for i in range(0, len(updates), self.config.batch_size):
+                    await self._enqueue(self._upsert_queue, _Batch(
+                        state, range_state, updates=updates[i:i + self.config.batch_size]
+                    ))
+                range_state.enqueued = True
+                self._maybe_complete_range(state, range_state)
+
+            # Stale points are removed only after the new edition is fully stored
+            if state.pending:
+                state.done.clear()
+                await state.done.wait()
+            stale = [pid for pid in state.existing if pid not in state.seen]
+            for i in range(0, len(stale), self.config.batch_size):
+                await self.sink.delete(stale[i:i + self.config.batch_size])
+            report.removed = len(stale)
+
+            checkpoint.mark_completed()
+            checkpoint.save()
+            report.seconds = time.perf_counter() - state.started
+            logger.info(
+                f"{report.filename}: +{report.added} new, {report.moved} moved, "
+                f"{report.unchanged} unchanged, -{report.removed} removed in {report.seconds:.1f}s"
+            )
+
+    async def _enqueue(self, queue: asyncio.Queue, batch: _Batch) -> None:
+        batch.state.pending += 1
+        batch.range_state.pending += 1
+        await queue.put(batch)
+
+    async def _embed_worker(self) -> None:
+        while (batch := await self._embed_queue.get()) is not None:
+            batch.vectors = await self.embedder.embed([chunk[4] for chunk in batch.chunks])
+            await self._upsert_queue.put(batch)
+
+    async def _upsert_worker(self) -> None:
+        while (batch := await self._upsert_queue.get()) is not None:
+            state = batch.state
+            report = state.report
+
+            if batch.chunks:
+                uploaded_at = datetime.now().isoformat()
+                await self.sink.upsert([
+                    {
+                        "id": pid,
+                        "vector": vector,
+                        "payload": {
+                            "text": text,
+                            "filename": report.filename,
+                            "file_hash": report.file_hash,
+                            "content_hash": chunk_hash,
+                            "page_number": page_number,
+                            "chunk_index": chunk_index,
+                            "upload_timestamp": uploaded_at,
+                        },
+                    }
+                    for (pid, chunk_hash, chunk_index, page_number, text), vector
+                    in zip(batch.chunks, batch.vectors)
+                ])
+                report.added += len(batch.chunks)
+            if batch.updates:
+                await self.sink.update_payloads(batch.updates)
+                report.moved += len(batch.updates)
+
+            state.pending -= 1
+            batch.range_state.pending -= 1
+            self._maybe_complete_range(state, batch.range_state)
+            if state.pending == 0:
+                state.done.set()
+
+    def _maybe_complete_range(self, state: _FileState, range_state: _RangeState) -> None:
+        if range_state.enqueued and range_state.pending == 0:
+            state.checkpoint.complete_range(range_state.start, range_state.ids)
+            state.checkpoint.save()
+
+
+def collect_pdfs(inputs: Sequence[str]) -> List[Tuple[Path, str]]:
+    """
+    Expand files and directories into a sorted list of (path, source) pairs
+
+    The source, which scopes the point ids and stale-point deletion of a
+    file, is its path relative to the input directory (POSIX separators),
+    so equally named files in different subdirectories do not collide; a
+    file given directly is named by its file name.
+    """
+    files = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            pdfs = sorted(p for p in path.rglob("*") if p.suffix.lower() == ".pdf")
+            files.extend((pdf, pdf.relative_to(path).as_posix()) for pdf in pdfs)
+        elif path.exists():
+            files.append((path, path.name))
+        else:
+            raise FileNotFoundError(f"PDF file not found: {path}")
+    return files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="PDF files or directories")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", COLLECTION_NAME))
+    parser.add_argument("--state-dir", type=Path, default=IngestConfig.state_dir)
+    parser.add_argument("--chunk-size", type=int, default=IngestConfig.chunk_size)
+    parser.add_argument("--chunk-overlap", type=int, default=IngestConfig.chunk_overlap)
+    parser.add_argument("--pages-per-task", type=int, default=IngestConfig.pages_per_task)
+    parser.add_argument("--parse-workers", type=int, default=IngestConfig.parse_workers)
+    parser.add_argument("--embed-workers", type=int, default=IngestConfig.embed_workers)
+    parser.add_argument("--upsert-workers", type=int, default=IngestConfig.upsert_workers)
+    parser.add_argument("--batch-size", type=int, default=IngestConfig.batch_size)
+    parser.add_argument("--queue-size", type=int, default=IngestConfig.queue_size)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Use the deterministic local embedder (no OpenAI calls)")
+    parser.add_argument("--embedding-cache", type=Path, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the persistent embedding cache")
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="Keep points in memory instead of Qdrant")
+    parser.add_argument("--report", type=Path, help="Write the per-file added/moved/removed report as JSON")
+    parser.add_argument("--lexical-dir", type=Path, default=None,
+                        help="Root of the BM25 index (default: .lexical_index); not updated on --dry-run")
+    parser.add_argument("--no-lexical-index", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    config = IngestConfig(
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        pages_per_task=args.pages_per_task,
+        parse_workers=args.parse_workers,
+        embed_workers=args.embed_workers,
+        upsert_workers=args.upsert_workers,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        state_dir=args.state_dir,
+    )
+    embedder = FakeEmbedder(dim=EMBEDDING_DIM) if args.fake_embeddings else OpenAIEmbedder(model=args.model)
+    embedder = with_cache(embedder, None if args.no_embedding_cache else args.embedding_cache)
+    lexical_store = None
+    if args.dry_run:
+        sink = MemorySink()
+    else:
+        sink = QdrantSink(os.getenv("QDRANT_URL"), os.getenv("QDRANT_API_KEY"), args.collection)
+        if not args.no_lexical_index:
+            from rag.lexical_index import DEFAULT_LEXICAL_DIR, LexicalSink, LexicalStore
+
+            lexical_root = (args.lexical_dir or DEFAULT_LEXICAL_DIR) / args.collection
+            lexical_store = LexicalStore(lexical_root / "store.sqlite")
+            sink = LexicalSink(sink, lexical_store)
+
+    async def run() -> List[FileReport]:
+        try:
+            return await IngestPipeline(embedder, sink, config).run(collect_pdfs(args.inputs))
+        finally:
+            await sink.close()
+
+    started = time.perf_counter()
+    reports = asyncio.run(run())
+    print(f"{'status':>9} {'chunks':>7} {'added':>7} {'moved':>7} {'removed':>8}  file")
+    for report in reports:
+        print(
+            f"{report.status:>9} {report.chunks:>7} {report.added:>7} {report.moved:>7} "
+            f"{report.removed:>8}  {report.filename}"
+        )
+    print(f"Done in {time.perf_counter() - started:.1f}s, {embedder.calls} embedding calls")
+    if hasattr(embedder, "hits"):
+        print(f"Embedding cache: {embedder.hits} hits, {embedder.misses} misses")
+    if lexical_store is not None:
+        from rag.lexical_index import compile_index
+
+        bm25_path = lexical_store.path.parent / "bm25"
+        if len(lexical_store) and (lexical_store.changed or not bm25_path.exists()):
+            index = compile_index(lexical_store, bm25_path)
+            print(f"BM25 index: {len(index)} chunks, {index.meta['terms']} terms")
+        lexical_store.close()
+    if args.report:
+        args.report.write_text(
+            json.dumps([asdict(report) for report in reports], ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+
+
+if __name__ == "__main__":
+    main()
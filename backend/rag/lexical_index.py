@@ -0,0 +1,451 @@
+"""
+Lexical BM25 index over the ingested chunk texts, fused with dense results.
+
+Dense retrieval alone misses exact drug names, dosages and disease names.
+Chunk texts are tokenized and stemmed (Russian Porter/Snowball stemmer,
+Latin words and numbers kept as is) when they are ingested, and kept in a
+SQLite store next to the collection. After each ingestion run the store is
+compiled into a compact on-disk inverted index:
+
+    meta.json          document count, average length, BM25 parameters
+    terms.json         sorted vocabulary
+    offsets.npy        CSR offsets into the postings per term
+    docs.npy, tfs.npy  postings: document row and term frequency
+    lengths.npy        document lengths in tokens
+    ids.npy            point ids, same as in Qdrant
+    payload/           columnar payloads (rag.local_index.PayloadStore)
+
+HybridRetriever merges BM25 and vector candidates with reciprocal rank
+fusion, which needs no score calibration between the two.
+
+Usage (from the backend directory):
+    python -m rag.lexical_index build --from-qdrant       # index an existing collection
+    python -m rag.lexical_index search "доза ивермектина для овец"
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.ingest import COLLECTION_NAME
+from rag.local_index import PayloadStore, replace_directory, top_k
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICAL_DIR = Path(os.getenv("LEXICAL_INDEX_DIR", ".lexical_index"))
+FORMAT_VERSION = 1
+# Payload fields kept with the lexical index, so lexical-only hits need no lookup
+STORED_FIELDS = ("text", "filename", "file_hash", "page_number", "chunk_index")
+
+STOPWORDS = frozenset("""
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот
+    от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять
+    уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+    будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+    почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+    над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+    иногда лучше чуть том нельзя такой им более всегда конечно всю между это также которые который которая
+""".split())
+
+TOKEN_RE = re.compile(r"[0-9]+(?:[.,][0-9]+)?|[a-zа-я][a-zа-я0-9]*")
+
+# --- Стеммер Портера для русского языка ---
+
+_VOWELS = "аеиоуыэюя"
+_RV = re.compile(rf"^(.*?[{_VOWELS}])(.*)$")
+_PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL = re.compile(rf".*[^{_VOWELS}]+[{_VOWELS}].*ость?$")
+_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    """Stem of a lowercase Russian word; other words are returned unchanged"""
+    match = _RV.match(word)
+    if not match or not "а" <= word[0] <= "я":
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub("", rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub("", rv, 1)
+        stripped = _ADJECTIVE.sub("", rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub("", stripped, 1)
+        else:
+            stripped = _VERB.sub("", rv, 1)
+            rv = _NOUN.sub("", rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = re.sub("и$", "", rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub("ость?$", "", rv, 1)
+    stripped = re.sub("ь$", "", rv, 1)
+    if stripped == rv:
+        rv = _SUPERLATIVE.sub("", rv, 1)
+        rv = re.sub("нн$", "н", rv, 1)
+    else:
+        rv = stripped
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed tokens without stopwords; numbers keep decimals (0,5 -> 0.5)"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in STOPWORDS or (len(token) == 1 and not token.isdigit()):
+            continue
+        tokens.append(token.replace(",", ".") if token[0].isdigit() else stem(token))
+    return tokens
+
+
+# --- Хранилище чанков, обновляемое при загрузке ---
+
+
+class LexicalStore:
+    """Analyzed chunks by point id, the source the BM25 index is compiled from"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Ingestion writes from worker threads, one at a time
+        self.db = sqlite3.connect(self.path, isolation_level=None, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                terms TEXT NOT NULL,
+                payload TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        self.changed = False
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, points: Iterable[Dict[str, Any]]) -> None:
+        rows = [
+            (
+                str(point["id"]),
+                " ".join(tokenize(point["payload"].get("text", ""))),
+                json.dumps({key: point["payload"].get(key) for key in STORED_FIELDS}, ensure_ascii=False),
+            )
+            for point in points
+        ]
+        with self._lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)", rows)
+            self.db.execute("COMMIT")
+            self.changed = True
+
+    def update_payloads(self, updates: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        with self._lock:
+            self.db.execute("BEGIN")
+            for point_id, fields in updates:
+                row = self.db.execute("SELECT payload FROM chunks WHERE id = ?", (str(point_id),)).fetchone()
+                if row:
+                    payload = json.loads(row[0])
+                    payload.update((key, value) for key, value in fields.items() if key in STORED_FIELDS)
+                    self.db.execute(
+                        "UPDATE chunks SET payload = ? WHERE id = ?",
+                        (json.dumps(payload, ensure_ascii=False), str(point_id)),
+                    )
+            self.db.execute("COMMIT")
+            self.changed = True
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM chunks WHERE id = ?", ((str(point_id),) for point_id in ids))
+            self.db.execute("COMMIT")
+            self.changed = True
+
+    def rows(self) -> Iterable[Tuple[str, str, str]]:
+        return self.db.execute("SELECT id, terms, payload FROM chunks ORDER BY id")
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class LexicalSink:
+    """Ingestion sink wrapper that also feeds the lexical store"""
+
+    def __init__(self, sink, store: LexicalStore):
+        self.sink = sink
+        self.store = store
+
+    async def ensure_collection(self, dim: int) -> None:
+        await self.sink.ensure_collection(dim)
+
+    async def existing_points(self, source: str) -> Dict[str, Dict[str, Any]]:
+        return await self.sink.existing_points(source)
+
+    async def upsert(self, points: List[Dict[str, Any]]) -> None:
+        await self.sink.upsert(points)
+        await asyncio.to_thread(self.store.add, points)
+
+    async def update_payloads(self, updates: List[Tuple[str, Dict[str, Any]]]) -> None:
+        await self.sink.update_payloads(updates)
+        await asyncio.to_thread(self.store.update_payloads, updates)
+
+    async def delete(self, ids: List[str]) -> None:
+        await self.sink.delete(ids)
+        await asyncio.to_thread(self.store.delete, ids)
+
+    async def close(self) -> None:
+        await self.sink.close()
+
+
+# --- BM25-индекс ---
+
+
+def compile_index(store: LexicalStore, path: Path, k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+    """Builds the inverted index from the store, replacing an existing one atomically"""
+    path = Path(path)
+    ids, lengths, payloads = [], [], []
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    for row, (point_id, terms, payload) in enumerate(store.rows()):
+        counts = Counter(terms.split())
+        ids.append(point_id)
+        lengths.append(sum(counts.values()))
+        payloads.append(json.loads(payload))
+        for term, tf in counts.items():
+            postings[term].append((row, tf))
+    if not ids:
+        raise ValueError(f"Lexical store {store.path} is empty")
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(postings[term]) for term in terms], out=offsets[1:])
+    docs = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.uint16)
+    for i, term in enumerate(terms):
+        items = np.asarray(postings[term], dtype=np.int64)
+        docs[offsets[i]:offsets[i + 1]] = items[:, 0]
+        tfs[offsets[i]:offsets[i + 1]] = np.minimum(items[:, 1], np.iinfo(np.uint16).max)
+
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "offsets.npy", offsets)
+    np.save(tmp / "docs.npy", docs)
+    np.save(tmp / "tfs.npy", tfs)
+    np.save(tmp / "lengths.npy", np.asarray(lengths, dtype=np.int32))
+    np.save(tmp / "ids.npy", np.asarray(ids))
+    (tmp / "terms.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+    fields = PayloadStore.write(tmp / "payload", payloads)
+    meta = {
+        "format": FORMAT_VERSION,
+        "count": len(ids),
+        "terms": len(terms),
+        "avg_length": float(np.mean(lengths)),
+        "k1": k1,
+        "b": b,
+        "fields": fields,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    replace_directory(tmp, path)
+    return BM25Index(path)
+
+
+class BM25Index:
+    """Read-only BM25 index, postings memory-mapped"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported lexical index format {self.meta['format']} in {self.path}")
+        self.count = self.meta["count"]
+        self.k1 = self.meta["k1"]
+        self.terms = {
+            term: i for i, term in enumerate(json.loads((self.path / "terms.json").read_text(encoding="utf-8")))
+        }
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        self.docs = np.load(self.path / "docs.npy", mmap_mode="r")
+        self.tfs = np.load(self.path / "tfs.npy", mmap_mode="r")
+        self.ids = np.load(self.path / "ids.npy")
+        lengths = np.load(self.path / "lengths.npy").astype(np.float32)
+        # Length normalization part of the BM25 denominator, per document
+        self.norms = self.k1 * (1 - self.meta["b"] + self.meta["b"] * lengths / self.meta["avg_length"])
+        self.payloads = PayloadStore(self.path / "payload", self.meta["fields"])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def idf(self, term: str) -> float:
+        """BM25 idf of a stemmed term; unknown terms get the idf of a unique term"""
+        term_id = self.terms.get(term)
+        df = 0 if term_id is None else int(self.offsets[term_id + 1] - self.offsets[term_id])
+        return float(np.log(1 + (self.count - df + 0.5) / (df + 0.5)))
+
+    def search(self, query: str, limit: int = 30) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and BM25 scores of the best matching chunks"""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end].astype(np.float32)
+            idf = np.log(1 + (self.count - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self.norms[docs])
+        rows = top_k(scores, limit)
+        rows = rows[scores[rows] > 0]
+        return rows, scores[rows]
+
+    def hits(self, query: str, limit: int = 30) -> List[Dict[str, Any]]:
+        """Search results as {"id", "score", "payload"} dicts"""
+        rows, scores = self.search(query, limit)
+        return [
+            {"id": str(self.ids[row]), "score": float(score), "payload": self.payloads.get(int(row))}
+            for row, score in zip(rows, scores)
+        ]
+
+
+# --- Гибридный поиск ---
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Dict[str, Any]]], limit: int, k: int = 60):
+    """Merges ranked hit lists: score = sum of 1 / (k + rank) over the lists"""
+    fused: Dict[str, Dict[str, Any]] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {"id": hit["id"], "score": 0.0, "payload": hit["payload"]})
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
+
+
+class HybridRetriever:
+    """Dense retriever (local index or Qdrant) + BM25, fused with RRF"""
+
+    def __init__(self, dense, lexical: BM25Index, limit: int = 30, candidates: int = 50, rrf_k: int = 60):
+        self.dense = dense
+        self.lexical = lexical
+        self.limit = limit
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    @property
+    def embedder(self):
+        return self.dense.embedder
+
+    async def search(self, question: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        query_vector = (await self.embedder.embed([question]))[0]
+        return await self.search_with_vector(question, query_vector, limit)
+
+    async def search_with_vector(self, question: str, query_vector, limit: Optional[int] = None):
+        """Hybrid search when the question embedding is already known"""
+        candidates = max(self.candidates, limit or self.limit)
+        dense_hits, lexical_hits = await asyncio.gather(
+            self.dense.search_vector(query_vector, candidates),
+            asyncio.to_thread(self.lexical.hits, question, candidates),
+        )
+        return reciprocal_rank_fusion([dense_hits, lexical_hits], limit or self.limit, self.rrf_k)
+
+    async def close(self) -> None:
+        await self.dense.close()
+
+
+# --- Построение индекса для уже загруженной коллекции ---
+
+
+async def fill_from_qdrant(store: LexicalStore, collection: str, page_size: int = 512) -> None:
+    from qdrant_client import AsyncQdrantClient
+
+    client = AsyncQdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    try:
+        offset = None
+        while True:
+            points, offset = await client.scroll(
+                collection_name=collection,
+                with_payload=list(STORED_FIELDS),
+                with_vectors=False,
+                limit=page_size,
+                offset=offset,
+            )
+            store.add({"id": str(point.id), "payload": point.payload or {}} for point in points)
+            logger.info(f"Lexical store: {len(store)} chunks from {collection}")
+            if offset is None:
+                return
+    finally:
+        await client.close()
+
+
+def fill_from_local_index(store: LexicalStore, path: Path) -> None:
+    from rag.local_index import LocalVectorIndex
+
+    index = LocalVectorIndex(path)
+    store.add(
+        {"id": str(index.ids[row]), "payload": index.payloads.get(row)}
+        for row in range(len(index))
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", COLLECTION_NAME))
+    parser.add_argument("--dir", type=Path, default=DEFAULT_LEXICAL_DIR, help="Lexical index root directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Compile the BM25 index from the lexical store")
+    source = build.add_mutually_exclusive_group()
+    source.add_argument("--from-qdrant", action="store_true", help="Refill the store from the Qdrant collection")
+    source.add_argument("--from-local-index", type=Path, help="Refill the store from a rag.local_index directory")
+
+    search = commands.add_parser("search", help="Query the BM25 index")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=10)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    root = args.dir / args.collection
+
+    if args.command == "build":
+        store = LexicalStore(root / "store.sqlite")
+        if args.from_qdrant:
+            asyncio.run(fill_from_qdrant(store, args.collection))
+        elif args.from_local_index:
+            fill_from_local_index(store, args.from_local_index)
+        started = time.perf_counter()
+        index = compile_index(store, root / "bm25")
+        print(f"BM25 index: {len(index)} chunks, {index.meta['terms']} terms "
+              f"in {time.perf_counter() - started:.1f}s -> {root / 'bm25'}")
+    else:
+        index = BM25Index(root / "bm25")
+        print(f"Query terms: {' '.join(tokenize(args.query))}")
+        for hit in index.hits(args.query, args.limit):
+            payload = hit["payload"]
+            text = payload.get("text", "").replace("\n", " ")[:100]
+            print(f"{hit['score']:7.2f}  {payload.get('filename')} p.{payload.get('page_number')}  {text}")
+
+
+if __name__ == "__main__":
+    main()
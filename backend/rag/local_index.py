@@ -0,0 +1,461 @@
+"""
+Local in-process vector index, an alternative to querying remote Qdrant.
+
+The knowledge base is a few reference books (tens of thousands of chunks),
+small enough to search in process without a network hop. An index directory
+holds:
+
+    meta.json          dimension, count, storage dtype, payload field kinds
+    ids.npy            point ids, same as in Qdrant
+    vectors.float32    unit-length rows, memory-mapped
+    vectors.int8       or int8 rows with per-row scales (scales.npy), 4x smaller
+    payload/           columnar payload store (see PayloadStore)
+    ivf.npz            optional IVF lists (k-means centroids + row lists)
+    hnsw.bin           optional HNSW graph (needs the hnswlib package)
+
+Exact search is a blockwise NumPy matrix-vector product over the memory map;
+IVF and HNSW trade a little recall for sub-linear search on larger corpora.
+
+Usage (from the backend directory):
+    python -m rag.local_index export --collection TailSense --dtype int8
+    python -m rag.local_index info .vector_index/TailSense
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.ingest import COLLECTION_NAME
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = Path(os.getenv("VECTOR_INDEX_DIR", ".vector_index"))
+FORMAT_VERSION = 1
+SCAN_BLOCK_ROWS = 4096  # keeps the int8 -> float32 block conversion in cache
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length, as float32"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: row ~= codes * scale"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.round(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k largest scores, best first"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def spherical_kmeans(matrix: np.ndarray, k: int, iterations: int = 10, sample: int = 50000, seed: int = 0):
+    """Unit-length centroids of k clusters of unit-length rows"""
+    rng = np.random.default_rng(seed)
+    if len(matrix) > sample:
+        matrix = matrix[rng.choice(len(matrix), sample, replace=False)]
+    centroids = matrix[rng.choice(len(matrix), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        for cluster in range(k):
+            members = matrix[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+def replace_directory(tmp: Path, path: Path) -> None:
+    """Moves a freshly written index directory over the current one"""
+    if path.exists():
+        old = path.with_name(path.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        path.rename(old)
+        tmp.rename(path)
+        shutil.rmtree(old)
+    else:
+        tmp.rename(path)
+
+
+# --- Колоночное хранилище payload ---
+
+
+class PayloadStore:
+    """Read-only columnar payload storage.
+
+    Each payload field is stored as one column: integers as an int64 array,
+    low-cardinality strings (filename, file_hash) as int32 codes plus a
+    vocabulary, long strings (chunk text) as one UTF-8 blob with offsets,
+    anything else as JSON in a blob. Columns are memory-mapped and a payload
+    is assembled only for the rows that are returned.
+    """
+
+    def __init__(self, path: Path, fields: Dict[str, Dict[str, Any]]):
+        self.path = Path(path)
+        self.fields = fields
+        self._columns = {name: self._open(name, spec) for name, spec in fields.items()}
+
+    @staticmethod
+    def write(path: Path, payloads: Sequence[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Writes the columns and returns the field specs for meta.json"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        names = list(dict.fromkeys(name for payload in payloads for name in payload))
+        fields = {}
+        for name in names:
+            values = [payload.get(name) for payload in payloads]
+            kind = PayloadStore._kind(values)
+            spec: Dict[str, Any] = {"kind": kind}
+            if kind == "int":
+                np.save(path / f"{name}.npy", np.asarray(values, dtype=np.int64))
+            elif kind == "category":
+                vocabulary = sorted(set(values))
+                codes = {value: code for code, value in enumerate(vocabulary)}
+                np.save(path / f"{name}.npy", np.asarray([codes[value] for value in values], dtype=np.int32))
+                spec["vocabulary"] = vocabulary
+            else:
+                encoded = [
+                    (value if kind == "text" else json.dumps(value, ensure_ascii=False)).encode("utf-8")
+                    for value in values
+                ]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(item) for item in encoded], out=offsets[1:])
+                np.save(path / f"{name}.offsets.npy", offsets)
+                with open(path / f"{name}.bin", "wb") as f:
+                    for item in encoded:
+                        f.write(item)
+            fields[name] = spec
+        return fields
+
+    @staticmethod
+    def _kind(values: List[Any]) -> str:
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return "int"
+        if all(isinstance(value, str) for value in values):
+            distinct = len(set(values))
+            return "category" if distinct <= max(256, len(values) // 8) else "text"
+        return "json"
+
+    def _open(self, name: str, spec: Dict[str, Any]):
+        if spec["kind"] in ("int", "category"):
+            return np.load(self.path / f"{name}.npy", mmap_mode="r")
+        offsets = np.load(self.path / f"{name}.offsets.npy", mmap_mode="r")
+        blob_path = self.path / f"{name}.bin"
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else np.zeros(0, np.uint8)
+        return offsets, blob
+
+    def value(self, name: str, row: int) -> Any:
+        spec, column = self.fields[name], self._columns[name]
+        if spec["kind"] == "int":
+            return int(column[row])
+        if spec["kind"] == "category":
+            return spec["vocabulary"][column[row]]
+        offsets, blob = column
+        raw = bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+        return raw if spec["kind"] == "text" else json.loads(raw)
+
+    def get(self, row: int, names: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        return {name: self.value(name, row) for name in (names or self.fields)}
+
+
+# --- Индекс ---
+
+
+def build_index(
+    path: Path,
+    ids: Sequence[str],
+    vectors,
+    payloads: Sequence[Dict[str, Any]],
+    dtype: str = "float32",
+    ivf_lists: int = 0,
+    hnsw: bool = False,
+    model: Optional[str] = None,
+) -> "LocalVectorIndex":
+    """Writes a new index directory, replacing an existing one atomically"""
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"Unsupported index dtype: {dtype}")
+    path = Path(path)
+    matrix = normalize(vectors)
+    if matrix.ndim != 2 or len(matrix) != len(ids) or len(ids) != len(payloads):
+        raise ValueError("ids, vectors and payloads must have the same length")
+
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    np.save(tmp / "ids.npy", np.asarray([str(point_id) for point_id in ids]))
+    if dtype == "int8":
+        codes, scales = quantize_int8(matrix)
+        codes.tofile(tmp / "vectors.int8")
+        np.save(tmp / "scales.npy", scales)
+    else:
+        matrix.tofile(tmp / "vectors.float32")
+    fields = PayloadStore.write(tmp / "payload", payloads)
+
+    if ivf_lists:
+        ivf_lists = min(ivf_lists, len(matrix))
+        centroids = spherical_kmeans(matrix, ivf_lists)
+        assignment = np.concatenate([
+            np.argmax(matrix[start:start + SCAN_BLOCK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(matrix), SCAN_BLOCK_ROWS)
+        ])
+        rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[rows], np.arange(ivf_lists + 1))
+        np.savez(tmp / "ivf.npz", centroids=centroids, rows=rows, offsets=offsets)
+
+    if hnsw:
+        import hnswlib
+
+        graph = hnswlib.Index(space="ip", dim=matrix.shape[1])
+        graph.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+        graph.add_items(matrix, np.arange(len(matrix)))
+        graph.save_index(str(tmp / "hnsw.bin"))
+
+    meta = {
+        "format": FORMAT_VERSION,
+        "count": len(matrix),
+        "dim": int(matrix.shape[1]),
+        "dtype": dtype,
+        "model": model,
+        "fields": fields,
+        "ivf_lists": ivf_lists,
+        "hnsw": hnsw,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    replace_directory(tmp, path)
+    return LocalVectorIndex(path)
+
+
+class LocalVectorIndex:
+    """Memory-mapped cosine index, read-only"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {self.meta['format']} in {self.path}")
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.dtype = self.meta["dtype"]
+
+        self.ids = np.load(self.path / "ids.npy")
+        shape = (self.count, self.dim)
+        if self.dtype == "int8":
+            self.vectors = np.memmap(self.path / "vectors.int8", dtype=np.int8, mode="r", shape=shape)
+            self.scales = np.load(self.path / "scales.npy")
+        else:
+            self.vectors = np.memmap(self.path / "vectors.float32", dtype=np.float32, mode="r", shape=shape)
+            self.scales = None
+        self.payloads = PayloadStore(self.path / "payload", self.meta["fields"])
+
+        self.ivf = None
+        if self.meta.get("ivf_lists"):
+            with np.load(self.path / "ivf.npz") as data:
+                self.ivf = {key: data[key] for key in ("centroids", "rows", "offsets")}
+        self.hnsw = None
+        if self.meta.get("hnsw"):
+            import hnswlib
+
+            self.hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self.hnsw.load_index(str(self.path / "hnsw.bin"), max_elements=self.count)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _scores(self, block: np.ndarray, query: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        if scales is None:
+            return block @ query
+        return (block.astype(np.float32) @ query) * scales
+
+    def _scan(self, query: np.ndarray, limit: int, rows: Optional[np.ndarray] = None):
+        """Exact scores over all rows (or the given rows), best `limit` first"""
+        total = self.count if rows is None else len(rows)
+        best_rows, best_scores = [], []
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(start + SCAN_BLOCK_ROWS, total))
+                block = self.vectors[start:start + SCAN_BLOCK_ROWS]
+            else:
+                block_rows = np.sort(rows[start:start + SCAN_BLOCK_ROWS])
+                block = self.vectors[block_rows]
+            scales = None if self.scales is None else self.scales[block_rows]
+            scores = self._scores(block, query, scales)
+            keep = top_k(scores, limit)
+            best_rows.append(block_rows[keep])
+            best_scores.append(scores[keep])
+        if not best_rows:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        all_rows, all_scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        keep = top_k(all_scores, limit)
+        return all_rows[keep], all_scores[keep]
+
+    def search(self, query_vector, limit: int = 30, mode: str = "auto", nprobe: int = 16, ef: int = 128):
+        """Rows and cosine scores of the nearest neighbours.
+
+        mode: "flat" (exact), "ivf", "hnsw" or "auto" (the fastest available).
+        """
+        query = normalize(query_vector)
+        if mode == "auto":
+            mode = "hnsw" if self.hnsw is not None else "ivf" if self.ivf is not None else "flat"
+
+        if mode == "hnsw":
+            if self.hnsw is None:
+                raise ValueError(f"Index {self.path} was built without HNSW")
+            self.hnsw.set_ef(max(ef, limit))
+            labels, distances = self.hnsw.knn_query(query, k=min(limit, self.count))
+            return labels[0].astype(np.int64), 1.0 - distances[0]
+
+        if mode == "ivf":
+            if self.ivf is None:
+                raise ValueError(f"Index {self.path} was built without IVF lists")
+            lists = top_k(self.ivf["centroids"] @ query, nprobe)
+            offsets = self.ivf["offsets"]
+            rows = np.concatenate([self.ivf["rows"][offsets[i]:offsets[i + 1]] for i in lists])
+            return self._scan(query, limit, rows)
+
+        return self._scan(query, limit)
+
+    def hits(self, query_vector, limit: int = 30, **search_options) -> List[Dict[str, Any]]:
+        """Search results as {"id", "score", "payload"} dicts, like QdrantRetriever"""
+        rows, scores = self.search(query_vector, limit, **search_options)
+        return [
+            {"id": str(self.ids[row]), "score": float(score), "payload": self.payloads.get(int(row))}
+            for row, score in zip(rows, scores)
+        ]
+
+
+class LocalRetriever:
+    """Drop-in replacement for QdrantRetriever over a local index directory"""
+
+    def __init__(
+        self,
+        embedder,
+        path: Path,
+        limit: int = 30,
+        mode: str = "auto",
+        nprobe: int = 16,
+    ):
+        self.embedder = embedder
+        self.index = LocalVectorIndex(path)
+        self.limit = limit
+        self.mode = mode
+        self.nprobe = nprobe
+        model = self.index.meta.get("model")
+        if model and getattr(embedder, "model", model) != model:
+            logger.warning(f"Index {path} was built with {model}, queries use {embedder.model}")
+
+    async def search(self, question: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top chunks for the question as {"id", "score", "payload"} dicts"""
+        query_vector = (await self.embedder.embed([question]))[0]
+        return await self.search_vector(query_vector, limit)
+
+    async def search_vector(self, query_vector: List[float], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Scanning tens of megabytes takes milliseconds; keep it off the event loop anyway
+        return await asyncio.to_thread(
+            self.index.hits, query_vector, limit or self.limit, mode=self.mode, nprobe=self.nprobe
+        )
+
+    async def close(self) -> None:
+        pass
+
+
+# --- Экспорт из Qdrant ---
+
+
+async def export_from_qdrant(
+    path: Path,
+    collection: str = COLLECTION_NAME,
+    url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    dtype: str = "float32",
+    ivf_lists: int = 0,
+    hnsw: bool = False,
+    model: Optional[str] = None,
+    page_size: int = 512,
+) -> LocalVectorIndex:
+    """Snapshots all points of a Qdrant collection into a local index"""
+    from qdrant_client import AsyncQdrantClient
+
+    client = AsyncQdrantClient(url=url or os.getenv("QDRANT_URL"), api_key=api_key or os.getenv("QDRANT_API_KEY"))
+    ids, vectors, payloads = [], [], []
+    try:
+        offset = None
+        while True:
+            points, offset = await client.scroll(
+                collection_name=collection,
+                with_payload=True,
+                with_vectors=True,
+                limit=page_size,
+                offset=offset,
+            )
+            for point in points:
+                vector = point.vector
+                if isinstance(vector, dict):
+                    vector = next(iter(vector.values()))
+                ids.append(str(point.id))
+                vectors.append(vector)
+                payloads.append(point.payload or {})
+            logger.info(f"Exported {len(ids)} points from {collection}")
+            if offset is None:
+                break
+    finally:
+        await client.close()
+
+    if not ids:
+        raise ValueError(f"Collection {collection} is empty")
+    return build_index(path, ids, np.asarray(vectors, dtype=np.float32), payloads, dtype, ivf_lists, hnsw, model)
+
+
+def main() -> None:
+    from rag.embeddings import EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Snapshot a Qdrant collection into a local index")
+    export.add_argument("--collection", default=os.getenv("COLLECTION_NAME", COLLECTION_NAME))
+    export.add_argument("--out", type=Path, default=None, help="Index directory (default: .vector_index/<collection>)")
+    export.add_argument("--dtype", choices=("float32", "int8"), default="float32")
+    export.add_argument("--ivf-lists", type=int, default=0, help="Build IVF lists (0 = exact search only)")
+    export.add_argument("--hnsw", action="store_true", help="Build an HNSW graph (pip install hnswlib)")
+    export.add_argument("--model", default=EMBEDDING_MODEL, help="Embedding model of the collection")
+
+    info = commands.add_parser("info", help="Print index metadata")
+    info.add_argument("path", type=Path)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "export":
+        out = args.out or DEFAULT_INDEX_DIR / args.collection
+        started = time.perf_counter()
+        index = asyncio.run(export_from_qdrant(
+            out, args.collection, dtype=args.dtype, ivf_lists=args.ivf_lists, hnsw=args.hnsw, model=args.model,
+        ))
+        print(f"Exported {len(index)} points to {out} in {time.perf_counter() - started:.1f}s")
+    else:
+        meta = dict(LocalVectorIndex(args.path).meta)
+        meta["fields"] = {name: spec["kind"] for name, spec in meta["fields"].items()}
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
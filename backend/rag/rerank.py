@@ -0,0 +1,152 @@
+"""
+Rerank stage between retrieval and generation.
+
+Retrieval returns ~30 chunks of ~1000 characters; most of them are weakly
+related to the question, and neighbouring chunks of one document overlap by
+chunk_overlap characters. The reranker rescores the candidates on CPU,
+merges chunks that are adjacent in their document (same filename,
+consecutive chunk_index) into one passage without the duplicated overlap,
+and keeps only the top-k passages for the prompt.
+
+Scorers:
+    lexical        idf-weighted coverage of the question stems, fused with the
+                   retrieval order; no model, a few milliseconds for 30 chunks
+    cross-encoder  a small multilingual cross-encoder through
+                   sentence-transformers (optional dependency), tens of
+                   milliseconds per question on CPU
+"""
+
+import math
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from rag.lexical_index import tokenize
+
+CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+SCORERS = ("lexical", "cross-encoder")
+
+
+class LexicalScorer:
+    """Question term coverage, weighted by idf when a BM25 index is given"""
+
+    def __init__(self, idf: Optional[Callable[[str], float]] = None):
+        self.idf = idf or (lambda term: 1.0)
+
+    def score(self, question: str, texts: Sequence[str]) -> List[float]:
+        terms = set(tokenize(question))
+        if not terms:
+            return [0.0] * len(texts)
+        weights = {term: self.idf(term) for term in terms}
+        total = sum(weights.values()) or 1.0
+        scores = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            # Covering a term matters most, repeating it adds a little
+            scores.append(sum(
+                weight * (1 + 0.2 * math.log(counts[term]))
+                for term, weight in weights.items() if counts[term]
+            ) / total)
+        return scores
+
+
+class CrossEncoderScorer:
+    """Relevance from a cross-encoder model (pip install sentence-transformers)"""
+
+    def __init__(self, model: str = CROSS_ENCODER_MODEL, max_length: int = 512):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model, max_length=max_length, device="cpu")
+
+    def score(self, question: str, texts: Sequence[str]) -> List[float]:
+        if not texts:
+            return []
+        return [float(score) for score in self.model.predict([(question, text) for text in texts])]
+
+
+def make_scorer(name: str, lexical_index=None):
+    """Scorer by name; the BM25 index, if given, provides idf weights"""
+    if name == "lexical":
+        return LexicalScorer(lexical_index.idf if lexical_index is not None else None)
+    if name == "cross-encoder":
+        return CrossEncoderScorer()
+    raise ValueError(f"Unknown rerank scorer: {name}")
+
+
+def merge_overlap(first: str, second: str, max_overlap: int = 400) -> str:
+    """Joins two consecutive chunks, dropping the text they share"""
+    for size in range(min(max_overlap, len(first), len(second)), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class Reranker:
+    """Rescore candidates, merge adjacent chunks, keep the top-k passages"""
+
+    def __init__(self, scorer, top_k: int = 6, rank_weight: float = 0.5, max_span: int = 3):
+        self.scorer = scorer
+        self.top_k = top_k
+        # Share of the retrieval order in the final ranking (lexical scorer only)
+        self.rank_weight = rank_weight if isinstance(scorer, LexicalScorer) else 0.0
+        self.max_span = max_span
+
+    def rerank(self, question: str, hits: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        if not hits:
+            return []
+        top_k = top_k or self.top_k
+        scores = self.scorer.score(question, [hit["payload"].get("text", "") for hit in hits])
+
+        # Rank fusion keeps the retriever's signal: the lexical score alone
+        # does not know about synonyms the embedding matched
+        by_score = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+        score_rank = {i: rank for rank, i in enumerate(by_score)}
+        final = [
+            (1 - self.rank_weight) / (60 + score_rank[i]) + self.rank_weight / (60 + i)
+            for i in range(len(hits))
+        ]
+        order = sorted(range(len(hits)), key=lambda i: final[i], reverse=True)
+
+        passages: List[Dict[str, Any]] = []
+        for position, i in enumerate(order):
+            hit = hits[i]
+            passage = self._adjacent_passage(passages, hit)
+            if passage is not None:
+                # Only well-ranked neighbours extend a passage, the rest are dropped as overlap
+                if position < 2 * top_k:
+                    self._merge(passage, hit)
+                continue
+            if len(passages) < top_k:
+                payload = dict(hit["payload"])
+                index = payload.get("chunk_index")
+                payload["chunk_span"] = [index, index]
+                passages.append({"id": hit["id"], "score": scores[i], "payload": payload})
+            elif position >= 2 * top_k:
+                break
+        return passages
+
+    @staticmethod
+    def _adjacent_passage(passages: List[Dict[str, Any]], hit: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Passage of the same document that contains or touches the hit's chunk"""
+        filename, index = hit["payload"].get("filename"), hit["payload"].get("chunk_index")
+        if index is None:
+            return None
+        for passage in passages:
+            payload = passage["payload"]
+            first, last = payload["chunk_span"]
+            if payload.get("filename") == filename and first is not None and first - 1 <= index <= last + 1:
+                return passage
+        return None
+
+    def _merge(self, passage: Dict[str, Any], hit: Dict[str, Any]) -> None:
+        payload = passage["payload"]
+        first, last = payload["chunk_span"]
+        index, text = hit["payload"]["chunk_index"], hit["payload"].get("text", "")
+        if first <= index <= last or last - first + 1 >= self.max_span:
+            return
+        if index == last + 1:
+            payload["text"] = merge_overlap(payload["text"], text)
+            payload["chunk_span"] = [first, index]
+        else:
+            payload["text"] = merge_overlap(text, payload["text"])
+            payload["chunk_span"] = [index, last]
+            payload["page_number"] = hit["payload"].get("page_number", payload.get("page_number"))
@@ -0,0 +1,54 @@
+"""
+Query-time retrieval from the knowledge base collection.
+
+Same search as `ask_qdrant` in the notebooks (embed the question, nearest
+neighbours in Qdrant), with question embeddings served from the persistent
+embedding cache when available.
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+from rag.ingest import COLLECTION_NAME
+
+
+class QdrantRetriever:
+    """Nearest-neighbour search over the Qdrant collection"""
+
+    def __init__(
+        self,
+        embedder,
+        url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        collection: str = COLLECTION_NAME,
+        limit: int = 30,
+    ):
+        from qdrant_client import AsyncQdrantClient
+
+        self.embedder = embedder
+        self.client = AsyncQdrantClient(
+            url=url or os.getenv("QDRANT_URL"),
+            api_key=api_key or os.getenv("QDRANT_API_KEY"),
+        )
+        self.collection = collection
+        self.limit = limit
+
+    async def search(self, question: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top chunks for the question as {"id", "score", "payload"} dicts"""
+        query_vector = (await self.embedder.embed([question]))[0]
+        return await self.search_vector(query_vector, limit)
+
+    async def search_vector(self, query_vector: List[float], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = await self.client.query_points(
+            collection_name=self.collection,
+            query=query_vector,
+            limit=limit or self.limit,
+            with_payload=True,
+        )
+        return [
+            {"id": str(point.id), "score": point.score, "payload": point.payload or {}}
+            for point in results.points
+        ]
+
+    async def close(self) -> None:
+        await self.client.close()
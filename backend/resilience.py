@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+
+from config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибки, при которых агент не начинал обработку запроса: повтор не задублирует сообщение в памяти сессии
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS_CODES = (429, 502, 503)
+
+
+class CircuitOpen(Exception):
+    """The agent is considered down: calls are rejected without waiting for a timeout"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Failures that happened before the agent processed the run"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def is_failure(error: BaseException) -> bool:
+    """Failures that count against the agent's availability"""
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+
+@dataclass
+class BreakerStats:
+    opened: int = 0
+    rejected: int = 0
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+
+
+class CircuitBreaker:
+    """Circuit breaker, retries and hedging around agent calls
+
+    Closed: calls go through; `breaker_failure_threshold` failures in a row
+    (timeouts, connection errors, 5xx, 429) open the circuit. Open: calls
+    are rejected with CircuitOpen for `breaker_open_seconds`, so handlers
+    can answer with the fallback text at once. Half-open: up to
+    `breaker_half_open_probes` calls probe the agent; a success closes the
+    circuit, a failure opens it again.
+
+    Failures before the agent processed the run (connection errors, 429,
+    502, 503) are retried up to `agent_retry_attempts` times with full
+    jitter backoff; read timeouts and other errors are not, as the run may
+    already be in the session memory. With `agent_hedge_enabled`, a call
+    that marks itself hedgeable is duplicated when it runs longer than
+    the p95 latency of recent calls, and the first answer wins.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.opened_at = 0.0
+        self.changed_at: Optional[str] = None
+        self.stats = BreakerStats()
+        self._probes = 0
+        self._latencies: Deque[float] = deque(maxlen=200)
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the open circuit lets a probe through"""
+        return max(0.0, self.opened_at + self.config.breaker_open_seconds - time.monotonic())
+
+    def check(self) -> None:
+        """Raise CircuitOpen if the circuit rejects calls right now (no state change)"""
+        if self.state == "open" and self.retry_after > 0:
+            self.stats.rejected += 1
+            raise CircuitOpen(self.retry_after)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Agent circuit {self.state} -> {state}")
+            self.state = state
+            self.changed_at = datetime.now().isoformat()
+
+    def _before_call(self) -> bool:
+        """Admit a call; returns True if it is a half-open probe"""
+        if self.state == "open":
+            if self.retry_after > 0:
+                self.stats.rejected += 1
+                raise CircuitOpen(self.retry_after)
+            self._set_state("half_open")
+            self._probes = 0
+        if self.state == "half_open":
+            if self._probes >= self.config.breaker_half_open_probes:
+                self.stats.rejected += 1
+                raise CircuitOpen(1.0)
+            self._probes += 1
+            return True
+        return False
+
+    def record_success(self, probe: bool = False) -> None:
+        self.consecutive_failures = 0
+        if probe:
+            self._probes -= 1
+        if self.state == "half_open":
+            self._set_state("closed")
+
+    def record_failure(self, error: BaseException, probe: bool = False) -> None:
+        self.consecutive_failures += 1
+        self.last_error = str(error) or error.__class__.__name__
+        if probe:
+            self._probes -= 1
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.config.breaker_failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            self.stats.opened += 1
+            self._set_state("open")
+
+    def hedge_delay(self) -> Optional[float]:
+        """p95 latency of recent calls, None until there are enough samples"""
+        if len(self._latencies) < self.config.agent_hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return max(ordered[int(0.95 * (len(ordered) - 1))], self.config.agent_hedge_min_delay)
+
+    async def call(self, call: Callable[[], Awaitable[T]], hedge: Optional[Callable[[], Awaitable[T]]] = None) -> T:
+        """Run an agent call under the breaker, with retries and optional hedging
+
+        `hedge` is the duplicate call started when `call` is slow; it must not
+        share state with `call` (e.g. the agent session of the request).
+
+        Raises:
+            CircuitOpen: The circuit rejected the call
+            Exception: The last error of the call
+        """
+        attempt = 0
+        while True:
+            probe = self._before_call()
+            started = time.monotonic()
+            try:
+                delay = self.hedge_delay() if hedge is not None and self.config.agent_hedge_enabled else None
+                result = await (self._hedged(call, hedge, delay) if delay is not None else call())
+            except Exception as e:
+                if is_failure(e):
+                    self.record_failure(e, probe)
+                else:
+                    # The agent answered (e.g. 401): it is up, the request is wrong
+                    self.record_success(probe)
+                if attempt < self.config.agent_retry_attempts and is_retryable(e) and self.state == "closed":
+                    attempt += 1
+                    self.stats.retries += 1
+                    backoff = self._backoff(attempt, e)
+                    logger.info(f"Retrying agent call in {backoff:.2f}s after: {e.__class__.__name__}")
+                    await asyncio.sleep(backoff)
+                    continue
+                raise
+            except BaseException:
+                # Cancelled: neither a success nor a failure, but the probe slot is freed
+                if probe:
+                    self._probes -= 1
+                raise
+            self.record_success(probe)
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        """Full jitter exponential backoff, at least the upstream Retry-After if it fits"""
+        cap = self.config.agent_retry_backoff_max
+        delay = random.uniform(0, min(cap, self.config.agent_retry_backoff * 2 ** attempt))
+        if isinstance(error, httpx.HTTPStatusError):
+            try:
+                delay = max(delay, min(float(error.response.headers.get("retry-after", 0)), cap))
+            except ValueError:
+                pass
+        return delay
+
+    async def _hedged(self, call: Callable[[], Awaitable[T]], hedge: Callable[[], Awaitable[T]], delay: float) -> T:
+        """Start the hedge call if the first one is slower than `delay`; the first to succeed wins"""
+        first = asyncio.ensure_future(call())
+        pending = {first}
+        errors = []
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self.stats.hedges += 1
+            second = asyncio.ensure_future(hedge())
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats.hedge_wins += 1
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, object]:
+        """Breaker state and counters for /health"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after, 1) if self.state == "open" else None,
+            "changed_at": self.changed_at,
+            "last_error": self.last_error,
+            "opened": self.stats.opened,
+            "rejected": self.stats.rejected,
+            "retries": self.stats.retries,
+            "hedges": self.stats.hedges,
+            "hedge_wins": self.stats.hedge_wins,
+        }
+
+
+def fallback_message(animal: Optional[str]) -> str:
+    """Answer served while the agent is unavailable (same text as the frontend fallback)"""
+    subject = f" о {animal.lower()}" if animal else ""
+    return f"Извините, временно не могу обработать ваш запрос{subject}. Пожалуйста, попробуйте позже."
+
+
+# Глобальный предохранитель вызовов агента
+agent_breaker = CircuitBreaker(settings)
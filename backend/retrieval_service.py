@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from config import Settings, settings
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_BACKENDS = ("none", "local", "qdrant")
+
+
+class RetrievalService:
+    """Knowledge base search exposed by the backend
+
+    Wraps either the in-process index (rag.local_index) or remote Qdrant
+    (rag.retrieval) behind one interface, optionally fused with the BM25
+    index (rag.lexical_index) and reranked (rag.rerank). The rag dependencies
+    (requirements-rag.txt) are imported only when retrieval is enabled.
+
+    Serves /api/v1/retrieve only; the agent flow runs its own Qdrant search.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.retriever = None
+        self.reranker = None
+        self.searches = 0
+        self.total_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.retriever is not None
+
+    @property
+    def backend(self) -> str:
+        if self.config.retrieval_hybrid:
+            return f"{self.config.retrieval_backend}+bm25"
+        return self.config.retrieval_backend
+
+    async def start(self) -> None:
+        """Open the configured retriever"""
+        backend = self.config.retrieval_backend
+        if backend == "none":
+            return
+        if backend not in RETRIEVAL_BACKENDS:
+            raise ValueError(f"Unknown retrieval backend: {backend}")
+
+        from rag.embedding_cache import DEFAULT_CACHE_DIR, with_cache
+        from rag.embeddings import OpenAIEmbedder
+
+        embedder = with_cache(OpenAIEmbedder(), DEFAULT_CACHE_DIR)
+        if backend == "local":
+            from rag.local_index import LocalRetriever
+
+            self.retriever = LocalRetriever(
+                embedder,
+                self.config.vector_index_path,
+                limit=self.config.retrieval_limit,
+                mode=self.config.retrieval_mode,
+                nprobe=self.config.retrieval_nprobe,
+            )
+            logger.info(
+                f"Local vector index loaded: {len(self.retriever.index)} chunks "
+                f"from {self.config.vector_index_path}"
+            )
+        else:
+            from rag.retrieval import QdrantRetriever
+
+            self.retriever = QdrantRetriever(
+                embedder,
+                collection=self.config.collection_name,
+                limit=self.config.retrieval_limit,
+            )
+
+        if self.config.retrieval_hybrid:
+            from rag.lexical_index import BM25Index, HybridRetriever
+
+            lexical = BM25Index(self.config.lexical_index_path)
+            self.retriever = HybridRetriever(
+                self.retriever,
+                lexical,
+                limit=self.config.retrieval_limit,
+                candidates=self.config.retrieval_candidates,
+                rrf_k=self.config.retrieval_rrf_k,
+            )
+            logger.info(f"BM25 index loaded: {len(lexical)} chunks from {self.config.lexical_index_path}")
+
+        if self.config.retrieval_rerank != "none":
+            from rag.rerank import Reranker, make_scorer
+
+            lexical = self.retriever.lexical if self.config.retrieval_hybrid else None
+            self.reranker = Reranker(
+                make_scorer(self.config.retrieval_rerank, lexical),
+                top_k=self.config.rerank_top_k,
+            )
+
+    async def search(self, query: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Top chunks for the query as {"id", "score", "payload"} dicts
+
+        With a reranker, retrieval_limit candidates are reranked down to
+        `limit` (default rerank_top_k) passages.
+        """
+        started = time.perf_counter()
+        with metrics.upstream_call("retrieval", self.config.retrieval_backend):
+            hits = await self.retriever.search(query, None if self.reranker is not None else limit)
+        if self.reranker is not None:
+            with metrics.upstream_call("retrieval", "rerank"):
+                hits = await asyncio.to_thread(self.reranker.rerank, query, hits, limit)
+        self.searches += 1
+        self.total_ms += (time.perf_counter() - started) * 1000
+        return hits
+
+    async def close(self) -> None:
+        if self.retriever is not None:
+            await self.retriever.close()
+            self.retriever = None
+
+
+# Глобальный сервис поиска по базе знаний
+retrieval_service = RetrievalService(settings)
@@ -0,0 +1,359 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config import Settings, settings
+from context_builder import summary_line
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKENDS = ("memory", "sqlite", "redis")
+
+# Формат записи: версия и порядок полей в compact-массиве (версия 1 — без полей памяти агента)
+RECORD_VERSION = 2
+ROLE_CODES = {"user": "u", "assistant": "a"}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+
+
+@dataclass
+class SessionRecord:
+    """Consultation state kept by the backend for one session"""
+    session_id: str
+    animal: Optional[str] = None
+    symptoms: List[str] = field(default_factory=list)
+    summary: List[str] = field(default_factory=list)
+    history: List[Tuple[str, str]] = field(default_factory=list)
+    message_count: int = 0
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    # Что видел агент в своей памяти сессии (см. context_builder)
+    agent_profile: Optional[List] = None  # [animal, symptoms], переданные агенту
+    agent_messages: int = 0  # сообщений в памяти агента
+    agent_seen: int = 0  # message_count на момент последнего ответа агента
+
+
+def encode_record(record: SessionRecord) -> bytes:
+    """Compact serialized form: a positional JSON array compressed with zlib"""
+    data = [
+        RECORD_VERSION,
+        record.animal,
+        record.symptoms,
+        record.summary,
+        [[ROLE_CODES.get(role, role), text] for role, text in record.history],
+        record.message_count,
+        round(record.created_at, 3),
+        round(record.updated_at, 3),
+        record.agent_profile,
+        record.agent_messages,
+        record.agent_seen,
+    ]
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def decode_record(session_id: str, blob: bytes) -> SessionRecord:
+    data = json.loads(zlib.decompress(blob))
+    version = data[0]
+    if version == 1:
+        # Память агента неизвестна: следующий запрос передаст историю целиком
+        data = data + [None, 0, 0]
+    elif version != RECORD_VERSION:
+        raise ValueError(f"Unsupported session record version: {version}")
+    (_, animal, symptoms, summary, history, count, created, updated,
+     agent_profile, agent_messages, agent_seen) = data
+    return SessionRecord(
+        session_id=session_id,
+        animal=animal,
+        symptoms=symptoms,
+        summary=summary,
+        history=[(ROLES.get(code, code), text) for code, text in history],
+        message_count=count,
+        created_at=created,
+        updated_at=updated,
+        agent_profile=agent_profile,
+        agent_messages=agent_messages,
+        agent_seen=agent_seen,
+    )
+
+
+class MemoryBackend:
+    """LRU-ordered dict of encoded records, bounded by entry count, with TTL"""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.evictions = 0
+        self.bytes = 0  # размер записей, обновляется при записи и удалении
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _pop(self, session_id: str) -> bool:
+        entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        self.bytes -= len(entry[1])
+        return True
+
+    async def get(self, session_id: str) -> Optional[bytes]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, blob = entry
+        if time.time() > expires_at:
+            self._pop(session_id)
+            return None
+        self._entries[session_id] = (time.time() + self.ttl, blob)
+        self._entries.move_to_end(session_id)
+        return blob
+
+    async def put(self, session_id: str, blob: bytes) -> None:
+        self._pop(session_id)
+        self._entries[session_id] = (time.time() + self.ttl, blob)
+        self.bytes += len(blob)
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    async def delete(self, session_id: str) -> bool:
+        return self._pop(session_id)
+
+    async def close(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+
+class SQLiteBackend:
+    """Records in a SQLite file, keyed by session id (primary key lookup)
+
+    Survives backend restarts and is shared by workers of one host; queries
+    run in worker threads so the event loop is not blocked on disk I/O.
+    Size counters are read from the file at open and then follow the writes
+    of this process, so snapshot() does not query the file; with several
+    workers each reports the file size as of its start plus its own writes.
+    """
+
+    def __init__(self, path: str, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            self.sessions, self.bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+            ).fetchone()
+
+    def __len__(self) -> int:
+        return self.sessions
+
+    def _get(self, session_id: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at >= ?", (session_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (now + self.ttl, session_id))
+        return row[0]
+
+    def _put(self, session_id: str, blob: bytes) -> None:
+        with self._lock:
+            old = self._db.execute("SELECT LENGTH(data) FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, blob, time.time() + self.ttl),
+            )
+            if old is None:
+                self.sessions += 1
+            self.bytes += len(blob) - (old[0] if old else 0)
+
+    def _delete(self, session_id: str) -> bool:
+        with self._lock:
+            old = self._db.execute("SELECT LENGTH(data) FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if old is None:
+                return False
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self.sessions -= 1
+            self.bytes -= old[0]
+            return True
+
+    async def get(self, session_id: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def put(self, session_id: str, blob: bytes) -> None:
+        await asyncio.to_thread(self._put, session_id, blob)
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, session_id)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class RedisBackend:
+    """Records in Redis with a sliding TTL, shared by all backend instances"""
+
+    def __init__(self, url: str, ttl: int, prefix: str = "tailsense:session:"):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, session_id: str) -> Optional[bytes]:
+        return await self._redis.getex(self.prefix + session_id, ex=self.ttl)
+
+    async def put(self, session_id: str, blob: bytes) -> None:
+        await self._redis.set(self.prefix + session_id, blob, ex=self.ttl)
+
+    async def delete(self, session_id: str) -> bool:
+        return await self._redis.delete(self.prefix + session_id) > 0
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class SessionStore:
+    """Server-side consultation sessions: animal, symptoms, history, summary
+
+    Records are stored serialized (see encode_record) in one of the backends:
+    in-process LRU with TTL (memory), a SQLite file (sqlite) or Redis
+    (redis, shared between instances). Memory per session is bounded: only
+    the last `session_max_messages` messages are kept verbatim, older ones
+    are folded into the summary, which is capped at `session_summary_chars`.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.backend = None
+        self.reads = 0
+        self.writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def start(self) -> None:
+        """Open the configured backend"""
+        name = self.config.session_backend
+        ttl = self.config.session_ttl_seconds
+        if name == "none":
+            return
+        if name == "memory":
+            self.backend = MemoryBackend(self.config.session_max_entries, ttl)
+        elif name == "sqlite":
+            self.backend = SQLiteBackend(self.config.session_sqlite_path, ttl)
+        elif name == "redis":
+            self.backend = RedisBackend(self.config.redis_url, ttl)
+        else:
+            raise ValueError(f"Unknown session backend: {name}")
+        logger.info(f"Session store started ({name}, ttl={ttl}s)")
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
+
+    async def get(self, session_id: str) -> Optional[SessionRecord]:
+        blob = await self.backend.get(session_id)
+        self.reads += 1
+        if blob is None:
+            return None
+        try:
+            return decode_record(session_id, blob)
+        except (ValueError, zlib.error) as e:
+            logger.warning(f"Dropping unreadable session {session_id}: {e}")
+            await self.backend.delete(session_id)
+            return None
+
+    async def save(self, record: SessionRecord) -> None:
+        record.updated_at = time.time()
+        await self.backend.put(record.session_id, encode_record(record))
+        self.writes += 1
+
+    async def delete(self, session_id: str) -> bool:
+        return await self.backend.delete(session_id)
+
+    async def update_profile(self, session_id: str, animal: Optional[str], symptoms: List[str]) -> SessionRecord:
+        """Create the session or replace its animal and symptoms"""
+        record = await self.get(session_id) or SessionRecord(session_id=session_id)
+        record.animal = animal
+        record.symptoms = list(symptoms)
+        await self.save(record)
+        return record
+
+    async def append_turn(self, session_id: str, question: str, answer: str,
+                          animal: Optional[str] = None, symptoms: Optional[List[str]] = None,
+                          agent_answered: bool = True) -> SessionRecord:
+        """Record a question and its answer
+
+        `agent_answered` is False for answers the agent of this session did
+        not produce (answer cache, a coalesced call): the turn is then not in
+        the agent memory, and the next agent input carries it.
+        Concurrent turns of one session are last-writer-wins; the frontend
+        sends one message at a time per session.
+        """
+        record = await self.get(session_id) or SessionRecord(session_id=session_id)
+        if animal:
+            record.animal = animal
+        if symptoms:
+            record.symptoms = list(symptoms)
+        record.history.append(("user", question))
+        record.history.append(("assistant", answer))
+        record.message_count += 2
+        if agent_answered:
+            # Агент видел профиль и все недостающие сообщения: они были во входе этого запроса
+            record.agent_profile = [record.animal, list(record.symptoms)]
+            record.agent_messages += 2
+            record.agent_seen = record.message_count
+        self._compact(record)
+        await self.save(record)
+        return record
+
+    def _compact(self, record: SessionRecord) -> None:
+        """Fold messages beyond session_max_messages into the summary"""
+        overflow = len(record.history) - self.config.session_max_messages
+        if overflow <= 0:
+            return
+        for role, text in record.history[:overflow]:
+            record.summary.append(summary_line(role, text))
+        del record.history[:overflow]
+
+        # Ранние строки краткого содержания отбрасываются первыми
+        while record.summary and sum(len(line) for line in record.summary) > self.config.session_summary_chars:
+            record.summary.pop(0)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Backend name, size and read/write counters"""
+        result: Dict[str, object] = {
+            "backend": self.config.session_backend,
+            "enabled": self.enabled,
+            "reads": self.reads,
+            "writes": self.writes,
+        }
+        if isinstance(self.backend, (MemoryBackend, SQLiteBackend)):
+            result["sessions"] = len(self.backend)
+            result["bytes"] = self.backend.bytes
+        if isinstance(self.backend, MemoryBackend):
+            result["evictions"] = self.backend.evictions
+        return result
+
+
+# Глобальное хранилище сессий
+session_store = SessionStore(settings)
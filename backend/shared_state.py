@@ -0,0 +1,53 @@
+import logging
+
+from config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKENDS = ("memory", "redis")
+
+
+class SharedState:
+    """Connection to the state shared by all backend worker processes
+
+    With STATE_BACKEND=memory (default) every process keeps its own answer
+    cache and client rate limit buckets, which is right for a single
+    worker. With STATE_BACKEND=redis they live in Redis (REDIS_URL), so
+    workers and instances agree on cached answers and a client's request
+    rate is limited once, not once per worker.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.redis = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis is not None
+
+    async def start(self) -> None:
+        """Open the Redis connection pool (called from the application lifespan)"""
+        name = self.config.state_backend
+        if name not in STATE_BACKENDS:
+            raise ValueError(f"Unknown state backend: {name}")
+        if name == "memory":
+            if self.config.web_concurrency > 1:
+                logger.warning(
+                    f"{self.config.web_concurrency} workers with STATE_BACKEND=memory: "
+                    f"answer cache and client rate limits are per worker"
+                )
+            return
+
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(self.config.redis_url)
+        logger.info("Shared state in Redis")
+
+    async def close(self) -> None:
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+
+# Глобальное подключение к общему состоянию воркеров
+shared_state = SharedState(settings)
@@ -0,0 +1,174 @@
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from config import Settings, settings
+
+
+class Flight:
+    """One upstream agent call and the answer it produces
+
+    The producer pushes text chunks (stream mode) or the whole answer; any
+    number of requests follow the same flight and receive every chunk, so
+    followers that join a streaming run mid-way first get the chunks they
+    missed.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.text: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.watchers = 1  # leader and followers still waiting for the answer
+        self.task: Optional[asyncio.Task] = None
+        self.agent_session = True  # the answer was produced in the leader's agent session
+        self._streaming = False
+        self._opened = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.text is not None or self.error is not None
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def open(self) -> None:
+        """The upstream accepted the run and chunks will follow"""
+        self._streaming = True
+        self._opened.set()
+
+    def push(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, text: str) -> None:
+        self.text = text
+        self._opened.set()
+        self._notify()
+
+    def fail(self, error: BaseException) -> None:
+        self.error = error
+        self._opened.set()
+        self._notify()
+
+    async def wait_opened(self) -> None:
+        """Wait until the upstream accepted the run; raises its error if it did not"""
+        await self._opened.wait()
+        if self.error is not None and not self._streaming:
+            raise self.error
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield the answer chunk by chunk; raises the producer's error"""
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.error is not None:
+                raise self.error
+            if self.text is not None:
+                if not self.chunks:
+                    # Flight of a non-streaming run: the answer comes at once
+                    yield self.text
+                return
+            await self._changed.wait()
+
+    async def result(self) -> str:
+        """The whole answer; raises the producer's error"""
+        while not self.done:
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+@dataclass
+class FlightStats:
+    upstream_calls: int = 0
+    coalesced: int = 0
+    max_followers: int = 0
+    abandoned: int = 0
+
+
+class SingleFlight:
+    """Deduplicates identical in-flight agent calls
+
+    Requests with the same key share one upstream call while it runs:
+    the first one starts the producer in a background task, later ones
+    follow its Flight. The producer does not depend on any client
+    connection, so a leader that disconnects does not fail its followers.
+    A request with key None always gets its own flight. When every request
+    of an unfinished flight has left (clients disconnected), the upstream
+    call is cancelled.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.stats = FlightStats()
+        self._flights: Dict[Hashable, Flight] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.coalesce_enabled
+
+    def run(self, key: Optional[Hashable], produce: Callable[[Flight], Awaitable[None]]) -> Tuple[Flight, bool]:
+        """Join the in-flight call for the key or start a new one
+
+        Returns:
+            (flight, leader): leader is False when the call was coalesced
+        """
+        if key is not None and self.enabled:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                flight.watchers += 1
+                self.stats.coalesced += 1
+                self.stats.max_followers = max(self.stats.max_followers, flight.followers)
+                return flight, False
+        else:
+            key = None
+
+        flight = Flight()
+        self.stats.upstream_calls += 1
+        if key is not None:
+            self._flights[key] = flight
+        flight.task = asyncio.create_task(self._produce(key, flight, produce))
+        return flight, True
+
+    def leave(self, flight: Flight) -> None:
+        """A request stopped following the flight; cancels the call nobody waits for"""
+        flight.watchers -= 1
+        if flight.watchers <= 0 and not flight.done and flight.task is not None:
+            self.stats.abandoned += 1
+            flight.task.cancel()
+
+    async def _produce(self, key: Optional[Hashable], flight: Flight,
+                       produce: Callable[[Flight], Awaitable[None]]) -> None:
+        try:
+            await produce(flight)
+        except Exception as e:
+            flight.fail(e)
+        finally:
+            if key is not None and self._flights.get(key) is flight:
+                del self._flights[key]
+            if not flight.done:
+                flight.fail(RuntimeError("Agent call ended without an answer"))
+
+    def snapshot(self) -> Dict[str, float]:
+        """Upstream calls, coalesced requests and calls in flight"""
+        requests = self.stats.upstream_calls + self.stats.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "upstream_calls": self.stats.upstream_calls,
+            "coalesced": self.stats.coalesced,
+            "max_followers": self.stats.max_followers,
+            "abandoned": self.stats.abandoned,
+            "coalesced_rate": round(self.stats.coalesced / requests, 4) if requests else 0.0,
+        }
+
+
+# Глобальный дедупликатор запросов к агенту
+single_flight = SingleFlight(settings)
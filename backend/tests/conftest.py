@@ -0,0 +1,105 @@
+import json
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def run_response(text: str, session_id: str = "s") -> Dict[str, Any]:
+    """Minimal LangFlow run response carrying the answer text"""
+    message = {"text": text, "data": {"text": text}}
+    return {"session_id": session_id, "outputs": [{"outputs": [{"results": {"message": message}}]}]}
+
+
+def sse_events(text: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """(event, data) pairs of a Server-Sent Events body"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class FakeAgent:
+    """LangFlow stand-in for httpx.MockTransport: answers every run with "Ответ: <input_value>"
+
+    Runs are recorded in `runs`; `status` makes every run fail with that
+    HTTP status, `health_status` does the same for the health endpoint.
+    """
+
+    def __init__(self):
+        self.runs: List[Dict[str, Any]] = []
+        self.status: Optional[int] = None
+        self.health_status = 200
+
+    def answer(self, payload: Dict[str, Any]) -> str:
+        return f"Ответ: {payload['input_value']}"
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/health":
+            return httpx.Response(self.health_status, json={"status": "ok"})
+        payload = json.loads(request.content)
+        self.runs.append(payload)
+        if self.status is not None:
+            return httpx.Response(self.status, json={"detail": "error"})
+        answer = self.answer(payload)
+        if request.url.params.get("stream") == "true":
+            words = answer.split(" ")
+            lines = [
+                json.dumps({"event": "token", "data": {"chunk": word if i == 0 else " " + word}}, ensure_ascii=False)
+                for i, word in enumerate(words)
+            ]
+            lines.append(json.dumps({"event": "end", "data": {"result": run_response(answer)}}, ensure_ascii=False))
+            return httpx.Response(200, content="\n\n".join(lines).encode("utf-8"),
+                                  headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=run_response(answer, payload.get("session_id", "s")))
+
+
+@pytest.fixture
+def fake_agent():
+    return FakeAgent()
+
+
+@pytest.fixture
+def backend(fake_agent, monkeypatch):
+    """Factory of an in-process backend talking to the fake agent
+
+    Components are fresh per test; settings can be overridden with
+    monkeypatch before entering the returned context manager.
+    """
+    import main
+    from admission import AdaptiveLimiter, ClientRateLimiter
+    from agent_client import agent_client
+    from answer_cache import AnswerCache
+    from config import settings
+    from resilience import CircuitBreaker
+    from session_store import SessionStore
+    from single_flight import SingleFlight
+
+    monkeypatch.setattr(settings, "external_api_url", "http://agent.test/api/v1/run/flow")
+    monkeypatch.setattr(settings, "health_check_interval", 3600.0)
+
+    @asynccontextmanager
+    async def start():
+        for name, component in {
+            "answer_cache": AnswerCache(settings),
+            "session_store": SessionStore(settings),
+            "single_flight": SingleFlight(settings),
+            "agent_breaker": CircuitBreaker(settings),
+            "agent_limiter": AdaptiveLimiter(settings),
+            "client_limiter": ClientRateLimiter(settings),
+        }.items():
+            monkeypatch.setattr(main, name, component)
+        agent_client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake_agent.handler))
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://backend.test") as client:
+                yield client
+
+    return start
@@ -0,0 +1,62 @@
+import pytest
+from starlette.requests import Request
+
+from admission import AdaptiveLimiter, ClientRateLimiter, client_address
+from config import Settings
+
+pytestmark = pytest.mark.anyio
+
+PROXY = Settings(trusted_proxies=["10.0.0.0/24"])
+
+
+def request(peer: str, **headers) -> Request:
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "client": (peer, 1234), "headers": raw})
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert client_address("203.0.113.7", "198.51.100.1", PROXY) == "203.0.113.7"
+
+
+def test_trusted_proxy_forwards_the_nearest_untrusted_address():
+    # The client prepended a fake entry; the proxies appended the real one
+    assert client_address("10.0.0.2", "1.2.3.4, 198.51.100.1, 10.0.0.3", PROXY) == "198.51.100.1"
+    assert client_address("10.0.0.2", None, PROXY) == "10.0.0.2"
+
+
+def test_client_id_splits_only_trusted_peers(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.settings, "trusted_proxies", ["10.0.0.0/24"])
+    assert main.client_identity(request("10.0.0.2", x_client_id="s1")) == "10.0.0.2/s1"
+    assert main.client_identity(request("203.0.113.7", x_client_id="s1", x_api_key="k")) == "203.0.113.7"
+
+
+async def test_rotating_headers_do_not_reset_the_bucket(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.settings, "trusted_proxies", ["10.0.0.0/24"])
+    limiter = ClientRateLimiter(Settings(client_rate_limit=0.1, client_rate_burst=2))
+    statuses = []
+    for i in range(3):
+        retry_after = await limiter.check(main.client_identity(request("203.0.113.7", x_client_id=f"c{i}")))
+        statuses.append(retry_after > 0)
+
+    assert statuses == [False, False, True]
+
+
+async def test_blocking_runs_use_the_wider_latency_tolerance():
+    limiter = AdaptiveLimiter(Settings(agent_latency_tolerance=2.0, agent_run_latency_tolerance=6.0))
+
+    async def calls(kind: str, latencies):
+        for latency in latencies:
+            slot = await limiter.acquire(kind)
+            slot.latency = latency
+            limiter.release(slot, None)
+
+    # Short answers first, then long ones: three times slower, as long answers take
+    await calls("run", [1.0] * 10 + [3.0] * 10)
+    assert limiter.stats.decreases == 0
+
+    await calls("stream", [0.1] * 10 + [0.3] * 10)
+    assert limiter.stats.decreases == 1
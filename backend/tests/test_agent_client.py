@@ -0,0 +1,70 @@
+import json
+
+import httpx
+import pytest
+
+from agent_client import AgentClient, end_message_text, event_decoder, extract_message_text, token_chunk
+from config import Settings
+from conftest import run_response
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_start_creates_one_pooled_client():
+    client = AgentClient(Settings(external_api_key="k"))
+    await client.start()
+    pooled = client.client
+    await client.start()
+
+    assert client.client is pooled
+    assert pooled.headers["x-api-key"] == "k"
+    await client.close()
+    assert client._client is None
+
+
+async def test_run_returns_the_raw_body(fake_agent):
+    client = AgentClient(Settings(external_api_url="http://agent.test/api/v1/run/flow"))
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake_agent.handler))
+
+    bodies = [await client.run({"input_value": f"вопрос {i}", "session_id": "s"}) for i in range(3)]
+
+    assert [extract_message_text(body) for body in bodies] == [f"Ответ: вопрос {i}" for i in range(3)]
+    assert len(fake_agent.runs) == 3
+    await client.close()
+
+
+async def test_run_raises_upstream_status(fake_agent):
+    fake_agent.status = 503
+    client = AgentClient(Settings(external_api_url="http://agent.test/api/v1/run/flow"))
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake_agent.handler))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await client.run({"input_value": "вопрос", "session_id": "s"})
+    await client.close()
+
+
+def test_health_url_strips_the_run_path():
+    client = AgentClient(Settings(external_api_url="http://agent:7860/api/v1/run/e68f"))
+    assert client.health_url == "http://agent:7860/health"
+
+
+def test_extract_message_text_reads_only_the_answer():
+    body = run_response("Мастит")
+    body["outputs"][0]["outputs"][0]["artifacts"] = {"message": "x", "files": []}
+    assert extract_message_text(json.dumps(body).encode()) == "Мастит"
+
+
+@pytest.mark.parametrize("body", [b"not json", b'{"outputs": []}', b'{"outputs": [{"outputs": [{}]}]}'])
+def test_extract_message_text_rejects_unexpected_structure(body):
+    with pytest.raises(ValueError):
+        extract_message_text(body)
+
+
+def test_stream_events_decode_lazily():
+    token = event_decoder.decode(json.dumps({"event": "token", "data": {"chunk": "Мас"}}))
+    end = event_decoder.decode(json.dumps({"event": "end", "data": {"result": run_response("Мастит")}}))
+    empty = event_decoder.decode(json.dumps({"event": "token", "data": None}))
+
+    assert (token.event, token_chunk(token)) == ("token", "Мас")
+    assert end_message_text(end) == "Мастит"
+    assert token_chunk(empty) == ""
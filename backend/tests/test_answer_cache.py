@@ -0,0 +1,106 @@
+import pytest
+
+from answer_cache import AnswerCache, exact_terms, make_cache_key
+from config import Settings, settings
+
+pytestmark = pytest.mark.anyio
+
+
+def cache(**overrides) -> AnswerCache:
+    return AnswerCache(Settings(**overrides))
+
+
+def key(question: str, animal: str = "Корова", symptoms=("Хромота",)):
+    return make_cache_key(animal, list(symptoms), question)
+
+
+def test_key_normalizes_case_punctuation_and_symptom_order():
+    assert make_cache_key("Корова", ["Хромота", "Отёк"], "Почему  хромает?") == \
+        make_cache_key("корова", ["отек", "хромота"], "почему хромает")
+
+
+def test_exact_hit_and_miss():
+    answers = cache()
+    answers.put(key("Почему корова хромает?"), "Ответ")
+
+    assert answers.get(key("почему корова хромает")) == ("Ответ", "exact")
+    assert answers.get(key("Почему корова хромает?", animal="Коза")) == (None, "miss")
+
+
+def test_similarity_tier_is_off_by_default():
+    answers = cache()
+    answers.put(key("почему корова хромает на заднюю ногу"), "Ответ")
+
+    assert answers.get(key("почему корова хромает на задню ногу")) == (None, "miss")
+
+
+def test_similarity_tier_matches_rephrasings():
+    answers = cache(cache_similarity_threshold=0.8)
+    answers.put(key("почему корова хромает на заднюю ногу"), "Ответ")
+
+    assert answers.get(key("почему корова хромает на задню ногу")) == ("Ответ", "semantic")
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("сколько давать ивермектин 0.2 мг на кг", "сколько давать ивермектин 2 мг на кг"),
+    ("сколько давать ивермектин 2 мг на кг", "сколько давать ивермектин 20 мг на кг"),
+    ("чем лечить мастит", "чем не лечить мастит"),
+    ("можно ли давать аспирин", "нельзя ли давать аспирин"),
+])
+def test_similarity_tier_is_exact_on_numbers_and_negations(stored, asked):
+    answers = cache(cache_similarity_threshold=0.5)
+    answers.put(key(stored), "Ответ")
+
+    assert answers.get(key(asked)) == (None, "miss")
+
+
+def test_exact_terms():
+    assert exact_terms("ивермектин 0 2 мг на кг") == ("0", "2")
+    assert exact_terms("чем не лечить мастит без антибиотиков") == ("не", "без")
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    answers = cache(cache_max_entries=2, cache_ttl_seconds=10)
+    for question in ("один", "два", "три"):
+        answers.put(key(question), question)
+
+    assert answers.get(key("один")) == (None, "miss")
+    assert answers.stats.evictions == 1
+
+    import answer_cache
+    now = answer_cache.time.monotonic()
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now + 11)
+    assert answers.get(key("три")) == (None, "miss")
+    assert answers.stats.expirations == 1
+
+
+async def test_cache_is_keyed_on_the_question_not_the_agent_input(backend, fake_agent, monkeypatch):
+    monkeypatch.setattr(settings, "session_backend", "memory")
+    profile = {"animal": "Корова", "symptoms": ["Хромота"]}
+    async with backend() as client:
+        first = await client.post("/api/v1/chat", json={
+            **profile, "session_id": "a", "question": "это ящур?",
+            "input_value": "Животное: Корова\nНаблюдаемые симптомы: Хромота\nТекущий вопрос: это ящур?",
+        })
+        other = await client.post("/api/v1/chat", json={
+            **profile, "session_id": "b", "question": "это заразно для людей?",
+            "input_value": "Животное: Корова\nНаблюдаемые симптомы: Хромота\nТекущий вопрос: это заразно для людей?",
+        })
+        same = await client.post("/api/v1/chat", json={
+            **profile, "session_id": "c", "question": "Это ящур", "input_value": "Это ящур",
+        })
+
+    assert [r.headers["X-Cache"] for r in (first, other, same)] == ["MISS", "MISS", "HIT-EXACT"]
+    assert same.json()["message"] == first.json()["message"]
+    assert len(fake_agent.runs) == 2
+
+
+async def test_cache_is_skipped_once_the_session_has_history(backend, fake_agent, monkeypatch):
+    monkeypatch.setattr(settings, "session_backend", "memory")
+    async with backend() as client:
+        first = await client.post("/api/v1/chat", json={"input_value": "чем лечить мастит", "session_id": "a"})
+        follow_up = await client.post("/api/v1/chat", json={"input_value": "а сколько дней", "session_id": "a"})
+        elsewhere = await client.post("/api/v1/chat", json={"input_value": "а сколько дней", "session_id": "b"})
+
+    assert [r.headers["X-Cache"] for r in (first, follow_up, elsewhere)] == ["MISS", "BYPASS", "MISS"]
+    assert len(fake_agent.runs) == 3
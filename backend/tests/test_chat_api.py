@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from conftest import sse_events
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_chat_returns_the_agent_answer(backend, fake_agent):
+    async with backend() as client:
+        response = await client.post("/api/v1/chat", json={"input_value": "Почему корова хромает?", "session_id": "s1"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Ответ: Почему корова хромает?", "session_id": "s1"}
+    assert response.headers["X-Cache"] == "MISS"
+    assert fake_agent.runs[0]["session_id"] == "s1"
+
+
+async def test_chat_maps_upstream_errors(backend, fake_agent):
+    fake_agent.status = 401
+    async with backend() as client:
+        response = await client.post("/api/v1/chat", json={"input_value": "вопрос"})
+
+    assert response.status_code == 500
+    assert response.json()["error"] == "Authorization error in external API"
+
+
+async def test_stream_relays_tokens_and_end(backend):
+    async with backend() as client:
+        response = await client.post("/api/v1/chat/stream", json={"input_value": "Почему коза хромает?", "session_id": "s2"})
+
+    events = sse_events(response.text)
+    assert response.status_code == 200
+    assert "".join(data["chunk"] for event, data in events if event == "token") == "Ответ: Почему коза хромает?"
+    assert events[-1] == ("end", {"message": "Ответ: Почему коза хромает?", "session_id": "s2"})
+
+
+async def test_stream_error_event_does_not_count_against_the_agent(backend, fake_agent, monkeypatch):
+    import main
+
+    def error_stream(request):
+        return httpx.Response(200, content=b'{"event": "error", "data": {"error": "tool failed"}}',
+                              headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setattr(fake_agent, "handler", error_stream)
+    async with backend() as client:
+        response = await client.post("/api/v1/chat/stream", json={"input_value": "вопрос"})
+
+    assert sse_events(response.text)[-1][0] == "error"
+    assert main.agent_breaker.consecutive_failures == 0
+
+
+async def test_agent_input_is_built_from_the_stored_session(backend, fake_agent):
+    profile = {"animal": "Корова", "symptoms": ["Хромота"], "session_id": "s"}
+    async with backend() as client:
+        await client.post("/api/v1/chat", json={**profile, "input_value": "Почему корова хромает?"})
+        await client.post("/api/v1/chat/stream", json={**profile, "input_value": "Что делать?"})
+        session = await client.get("/api/v1/sessions/s")
+
+    assert [run["input_value"] for run in fake_agent.runs] == [
+        "Животное: Корова\nНаблюдаемые симптомы: Хромота\nТекущий вопрос: Почему корова хромает?",
+        "Что делать?",
+    ]
+    assert [message["content"] for message in session.json()["history"]] == [
+        "Почему корова хромает?", "Ответ: " + fake_agent.runs[0]["input_value"],
+        "Что делать?", "Ответ: Что делать?",
+    ]
+
+
+async def test_cache_key_uses_the_stored_profile(backend, fake_agent):
+    async with backend() as client:
+        await client.put("/api/v1/sessions/cow", json={"animal": "Корова", "symptoms": ["Хромота"]})
+        await client.put("/api/v1/sessions/dog", json={"animal": "Собака", "symptoms": ["Рвота"]})
+        cow = await client.post("/api/v1/chat", json={"input_value": "Чем лечить?", "session_id": "cow"})
+        dog = await client.post("/api/v1/chat", json={"input_value": "Чем лечить?", "session_id": "dog"})
+
+    assert [cow.headers["X-Cache"], dog.headers["X-Cache"]] == ["MISS", "MISS"]
+    assert len(fake_agent.runs) == 2
+    assert fake_agent.runs[1]["input_value"].startswith("Животное: Собака\nНаблюдаемые симптомы: Рвота")
+
+
+async def test_hedged_duplicate_runs_in_a_throwaway_agent_session(backend, fake_agent, monkeypatch):
+    import main
+
+    for name, value in {"agent_hedge_enabled": True, "agent_hedge_min_samples": 1, "agent_hedge_min_delay": 0.05}.items():
+        monkeypatch.setattr(main.settings, name, value)
+    answer = fake_agent.handler
+    stalled = []
+
+    async def first_run_stalls(request):
+        if request.url.path != "/health" and not stalled:
+            stalled.append(json.loads(request.content)["session_id"])
+            await asyncio.sleep(60)
+        return answer(request)
+
+    monkeypatch.setattr(fake_agent, "handler", first_run_stalls)
+    async with backend() as client:
+        main.agent_breaker._latencies.append(0.01)
+        await client.post("/api/v1/chat", json={"input_value": "Почему корова хромает?", "session_id": "s"})
+        await client.post("/api/v1/chat", json={"input_value": "Что делать?", "session_id": "s"})
+
+    assert stalled == ["s"]
+
+    assert fake_agent.runs[0]["session_id"].startswith("hedge-")
+    # The agent session "s" never stored the first turn, so the next input carries it
+    assert fake_agent.runs[1]["session_id"] == "s"
+    assert "Пользователь: Почему корова хромает?" in fake_agent.runs[1]["input_value"]
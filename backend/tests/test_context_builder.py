@@ -0,0 +1,81 @@
+import pytest
+
+from config import Settings
+from context_builder import build_agent_input, shorten
+from session_store import SessionStore
+
+pytestmark = pytest.mark.anyio
+
+PROFILE = {"animal": "Корова", "symptoms": ["Хромота", "Лихорадка"]}
+HEADER = "Животное: Корова\nНаблюдаемые симптомы: Хромота, Лихорадка"
+
+
+@pytest.fixture
+async def store():
+    store = SessionStore(Settings(session_backend="memory"))
+    await store.start()
+    yield store
+    await store.close()
+
+
+async def ask(store, question, config=None, **profile):
+    record = await store.get("s") or await store.update_profile("s", None, [])
+    return build_agent_input(record, question, config or store.config, **{**PROFILE, **profile})
+
+
+async def test_first_question_carries_the_profile(store):
+    assert await ask(store, "Почему корова хромает?") == f"{HEADER}\nТекущий вопрос: Почему корова хромает?"
+
+
+async def test_after_an_agent_answer_only_the_question_is_sent(store):
+    await store.append_turn("s", "Почему корова хромает?", "Осмотрите копыта.", **PROFILE)
+
+    assert await ask(store, "А если копыта в порядке?") == "А если копыта в порядке?"
+
+
+async def test_turns_answered_without_the_agent_are_sent_again(store):
+    await store.append_turn("s", "Почему корова хромает?", "Осмотрите копыта.", **PROFILE)
+    await store.append_turn("s", "Это ящур?", "Ответ из кэша.", agent_answered=False, **PROFILE)
+
+    assert await ask(store, "Что делать?") == (
+        "Предыдущие сообщения:\nПользователь: Это ящур?\nВетеринар: Ответ из кэша.\nТекущий вопрос: Что делать?"
+    )
+
+
+async def test_a_session_the_agent_never_answered_is_sent_in_full(store):
+    await store.append_turn("s", "Почему корова хромает?", "Ответ из кэша.", agent_answered=False, **PROFILE)
+
+    text = await ask(store, "Что делать?")
+    assert text.startswith(HEADER + "\nПредыдущие сообщения:\nПользователь: Почему корова хромает?")
+
+
+async def test_a_changed_profile_is_sent_again(store):
+    await store.append_turn("s", "Почему корова хромает?", "Осмотрите копыта.", **PROFILE)
+
+    assert await ask(store, "А у козы?", animal="Коза") == (
+        "Животное: Коза\nНаблюдаемые симптомы: Хромота, Лихорадка\nТекущий вопрос: А у козы?"
+    )
+
+
+async def test_messages_pushed_out_of_the_agent_memory_are_summarized(store):
+    config = Settings(agent_memory_messages=4, context_max_tokens=400, context_summary_tokens=100)
+    for i in range(6):
+        await store.append_turn("s", f"Вопрос {i}.", f"Ответ {i}. " + "Пояснение. " * 40, **PROFILE)
+
+    text = await ask(store, "Что дальше?", config)
+
+    assert "Вопрос 4" not in text and "Вопрос 5" not in text
+    assert "Краткое содержание предыдущей части консультации:" in text
+    assert text.endswith("Текущий вопрос: Что дальше?")
+    assert len(text) / 3 <= config.context_max_tokens
+
+
+async def test_without_agent_memory_the_history_is_sent_every_time(store):
+    await store.append_turn("s", "Почему корова хромает?", "Осмотрите копыта.", **PROFILE)
+
+    text = await ask(store, "Что делать?", Settings(agent_memory=False))
+    assert "Пользователь: Почему корова хромает?\nВетеринар: Осмотрите копыта." in text
+
+
+def test_shorten_keeps_whole_sentences_without_markdown():
+    assert shorten("**Первое.** Второе предложение. Третье.", 30) == "Первое. Второе предложение. …"
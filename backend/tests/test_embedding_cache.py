@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from rag.embedding_cache import CachedEmbedder, EmbeddingCache
+from rag.embeddings import FakeEmbedder
+
+pytestmark = pytest.mark.anyio
+
+DIM = 8
+
+
+def open_cache(tmp_path, **kwargs) -> EmbeddingCache:
+    return EmbeddingCache(tmp_path, "fake-embedding", DIM, **kwargs)
+
+
+def test_round_trip_and_misses(tmp_path):
+    cache = open_cache(tmp_path, dtype="float32")
+    cache.put_many(["a", "b"], [[1.0] * DIM, [2.0] * DIM])
+
+    assert cache.get_many(["b", "c", "a"]) == [[2.0] * DIM, None, [1.0] * DIM]
+    assert len(cache) == 2
+    cache.close()
+
+
+def test_evicts_least_recently_used_and_reuses_rows(tmp_path):
+    cache = open_cache(tmp_path, dtype="float32", max_bytes=4 * DIM * 4)
+    for i, text in enumerate("abcd"):
+        cache.put_many([text], [[float(i)] * DIM])
+    cache.get_many(["a"])
+    cache.put_many(["e"], [[5.0] * DIM])
+
+    assert cache.get_many(["a", "b", "c", "e"]) == [[0.0] * DIM, None, None, [5.0] * DIM]
+    assert (tmp_path / "fake-embedding-8" / "vectors.float32").stat().st_size <= 4 * DIM * 4
+    cache.close()
+
+
+def test_rejects_a_different_dtype(tmp_path):
+    open_cache(tmp_path).close()
+    with pytest.raises(ValueError):
+        open_cache(tmp_path, dtype="float32")
+
+
+async def test_cached_embedder_keeps_the_loop_free(tmp_path, monkeypatch):
+    cache = open_cache(tmp_path)
+    embedder = CachedEmbedder(FakeEmbedder(dim=DIM), cache)
+    loop_thread = threading.get_ident()
+    threads = set()
+
+    def recording(method):
+        def call(*args):
+            threads.add(threading.get_ident())
+            return method(*args)
+        return call
+
+    for name in ("get_many", "put_many"):
+        monkeypatch.setattr(cache, name, recording(getattr(cache, name)))
+
+    first, second = await asyncio.gather(
+        embedder.embed(["мастит", "хромота", "мастит"]),
+        embedder.embed(["хромота", "ящур"]),
+    )
+    hits = embedder.hits
+    again = await embedder.embed(["ящур", "мастит"])
+
+    assert threads and loop_thread not in threads
+    assert first[0] == first[2]
+    assert np.allclose(again, [second[1], first[0]], atol=1e-3)
+    assert embedder.hits == hits + 2
+    cache.close()
@@ -0,0 +1,110 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from rag import ingest
+from rag.embeddings import FakeEmbedder
+from rag.ingest import IngestConfig, IngestPipeline, MemorySink, collect_pdfs
+
+
+class RecordingEmbedder(FakeEmbedder):
+    """FakeEmbedder that remembers which texts it was asked to embed"""
+
+    def __init__(self):
+        super().__init__(dim=8)
+        self.texts = []
+
+    async def embed(self, texts):
+        self.texts.extend(texts)
+        return await super().embed(texts)
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Text files stand in for PDFs: pages are separated by form feeds, one chunk per page"""
+
+    def read(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read().split("\f")
+
+    def parse(path, start, end, chunk_size, chunk_overlap):
+        return [(number, text) for number, text in enumerate(read(path)) if start <= number < end]
+
+    monkeypatch.setattr(ingest, "count_pages", lambda path: len(read(path)))
+    monkeypatch.setattr(ingest, "parse_page_range", parse)
+
+    def write(path, *texts):
+        path.write_text("\f".join(texts), encoding="utf-8")
+        return path
+
+    return write
+
+
+def run(paths, embedder, sink, tmp_path):
+    config = IngestConfig(pages_per_task=2, parse_workers=2, embed_workers=1, upsert_workers=1,
+                          state_dir=tmp_path / "state")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        return asyncio.run(IngestPipeline(embedder, sink, config).run(paths, executor))
+
+
+def test_new_edition_embeds_only_changed_chunks(tmp_path, pages):
+    sink = MemorySink()
+    source = pages(tmp_path / "mastitis.pdf", "Мастит.", "Лечение.", "Профилактика.")
+    first, = run([source], RecordingEmbedder(), sink, tmp_path)
+    assert (first.added, first.moved, first.removed) == (3, 0, 0)
+
+    # A page inserted at the start, the last one dropped
+    pages(source, "Введение.", "Мастит.", "Лечение.")
+    embedder = RecordingEmbedder()
+    second, = run([source], embedder, sink, tmp_path)
+
+    assert embedder.texts == ["Введение."]
+    assert (second.added, second.moved, second.unchanged, second.removed) == (1, 2, 0, 1)
+    stored = {point["payload"]["text"]: point["payload"]["page_number"] for point in sink.points.values()}
+    assert stored == {"Введение.": 0, "Мастит.": 1, "Лечение.": 2}
+
+
+def test_unchanged_file_is_skipped(tmp_path, pages):
+    sink = MemorySink()
+    source = pages(tmp_path / "mastitis.pdf", "Мастит.", "Лечение.")
+    run([source], RecordingEmbedder(), sink, tmp_path)
+
+    embedder = RecordingEmbedder()
+    report, = run([source], embedder, sink, tmp_path)
+
+    assert report.status == "skipped"
+    assert embedder.texts == []
+    assert len(sink.points) == 2
+
+
+def test_reverted_edition_is_ingested_again(tmp_path, pages):
+    sink = MemorySink()
+    source = pages(tmp_path / "mastitis.pdf", "Мастит.", "Лечение.")
+    run([source], RecordingEmbedder(), sink, tmp_path)
+    pages(source, "Мастит.", "Новое лечение.")
+    run([source], RecordingEmbedder(), sink, tmp_path)
+
+    # Back to the first edition: its checkpoint is complete, but the stored points are the second edition's
+    pages(source, "Мастит.", "Лечение.")
+    report, = run([source], RecordingEmbedder(), sink, tmp_path)
+
+    assert (report.status, report.added, report.removed) == ("ingested", 1, 1)
+    assert sorted(point["payload"]["text"] for point in sink.points.values()) == ["Лечение.", "Мастит."]
+
+
+def test_equally_named_files_in_subdirectories_are_separate_sources(tmp_path, pages):
+    for animal in ("cows", "goats"):
+        (tmp_path / "papers" / animal).mkdir(parents=True)
+    pages(tmp_path / "papers" / "cows" / "guide.pdf", "Коровы.", "Общее.")
+    pages(tmp_path / "papers" / "goats" / "guide.pdf", "Козы.", "Общее.")
+    sink = MemorySink()
+    files = collect_pdfs([str(tmp_path / "papers")])
+    run(files, RecordingEmbedder(), sink, tmp_path)
+    reports = run(files, RecordingEmbedder(), sink, tmp_path)
+
+    assert [source for _, source in files] == ["cows/guide.pdf", "goats/guide.pdf"]
+    assert [report.status for report in reports] == ["skipped", "skipped"]
+    assert len(sink.points) == 4
@@ -0,0 +1,45 @@
+import pytest
+
+from config import Settings
+from metrics import Metrics
+
+pytestmark = pytest.mark.anyio
+
+
+def families(text: str):
+    """Metric names with HELP, with TYPE and with samples in an exposition text"""
+    helps, types, samples = set(), set(), set()
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            helps.add(line.split()[2])
+        elif line.startswith("# TYPE "):
+            types.add(line.split()[2])
+        elif line:
+            name = line.split("{")[0].split()[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in types:
+                    name = name[:-len(suffix)]
+            samples.add(name)
+    return helps, types, samples
+
+
+def test_collector_fields_are_gauges_with_help():
+    registry = Metrics(Settings())
+    registry.add_collector("cache", "Answer cache", lambda: {"hits": 3, "hit_ratio": 0.5, "enabled": True, "path": "x"})
+    text = registry.render()
+
+    assert "# HELP tailsense_cache_hit_ratio Answer cache: hit ratio\n" in text
+    assert "# TYPE tailsense_cache_hit_ratio gauge\ntailsense_cache_hit_ratio 0.5\n" in text
+    assert "tailsense_cache_enabled 1\n" in text
+    assert "tailsense_cache_path" not in text
+
+
+async def test_every_family_on_the_endpoint_has_help_and_type(backend):
+    async with backend() as client:
+        await client.post("/api/v1/chat", json={"input_value": "вопрос"})
+        response = await client.get("/metrics")
+
+    helps, types, samples = families(response.text)
+    assert {"tailsense_http_request_duration_seconds", "tailsense_admission_limit"} <= samples
+    assert samples <= helps
+    assert samples <= types
@@ -0,0 +1,132 @@
+import asyncio
+
+import httpx
+import pytest
+
+from config import Settings
+from resilience import CircuitBreaker, CircuitOpen
+
+pytestmark = pytest.mark.anyio
+
+
+def breaker(**overrides) -> CircuitBreaker:
+    config = {"breaker_failure_threshold": 2, "agent_retry_backoff": 0.0, "agent_retry_backoff_max": 0.0}
+    return CircuitBreaker(Settings(**{**config, **overrides}))
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://agent.test/run")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def failing(error: Exception):
+    async def call():
+        raise error
+    return call
+
+
+async def ok():
+    return "ok"
+
+
+async def test_failures_open_the_circuit():
+    circuit = breaker(agent_retry_attempts=0)
+    for _ in range(2):
+        with pytest.raises(httpx.ReadTimeout):
+            await circuit.call(failing(httpx.ReadTimeout("slow")))
+
+    assert circuit.state == "open"
+    with pytest.raises(CircuitOpen):
+        await circuit.call(ok)
+    assert circuit.stats.rejected == 1
+
+
+async def test_client_errors_do_not_count_as_failures():
+    circuit = breaker(agent_retry_attempts=0)
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await circuit.call(failing(status_error(401)))
+
+    assert circuit.state == "closed"
+    assert circuit.consecutive_failures == 0
+
+
+async def test_retries_failures_before_the_agent_processed_the_run():
+    circuit = breaker(breaker_failure_threshold=5, agent_retry_attempts=2)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise status_error(503)
+        return "ok"
+
+    assert await circuit.call(flaky) == "ok"
+    assert circuit.stats.retries == 2
+
+    attempts.clear()
+    with pytest.raises(httpx.ReadTimeout):
+        await circuit.call(failing(httpx.ReadTimeout("slow")))
+    assert circuit.stats.retries == 2
+
+
+async def test_half_open_probe_closes_or_reopens(monkeypatch):
+    circuit = breaker(agent_retry_attempts=0, breaker_open_seconds=0.0)
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await circuit.call(failing(httpx.ConnectError("down")))
+    assert circuit.state == "open"
+
+    with pytest.raises(httpx.ConnectError):
+        await circuit.call(failing(httpx.ConnectError("down")))
+    assert circuit.state == "open"
+
+    assert await circuit.call(ok) == "ok"
+    assert circuit.state == "closed"
+
+
+async def test_cancelled_probe_releases_its_slot():
+    circuit = breaker(agent_retry_attempts=0, breaker_open_seconds=0.0)
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await circuit.call(failing(httpx.ConnectError("down")))
+
+    started = asyncio.Event()
+
+    async def hanging():
+        started.set()
+        await asyncio.sleep(60)
+
+    probe = asyncio.ensure_future(circuit.call(hanging))
+    await started.wait()
+    with pytest.raises(CircuitOpen):
+        await circuit.call(ok)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert circuit.state == "half_open"
+    assert await circuit.call(ok) == "ok"
+    assert circuit.state == "closed"
+
+
+async def test_cancelled_hedged_call_cancels_the_running_call():
+    circuit = breaker(agent_hedge_enabled=True, agent_hedge_min_samples=1, agent_hedge_min_delay=10.0)
+    circuit._latencies.append(1.0)
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def hanging():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    call = asyncio.ensure_future(circuit.call(hanging, hedge=hanging))
+    await started.wait()
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    await asyncio.wait_for(cancelled.wait(), 1.0)
@@ -0,0 +1,84 @@
+import json
+import zlib
+
+import pytest
+
+from config import Settings
+from session_store import MemoryBackend, SessionRecord, SessionStore, SQLiteBackend, decode_record, encode_record
+
+pytestmark = pytest.mark.anyio
+
+
+def test_record_round_trip():
+    record = SessionRecord(
+        session_id="s", animal="Корова", symptoms=["Хромота"], summary=["Пользователь: вопрос"],
+        history=[("user", "Почему корова хромает?"), ("assistant", "Осмотрите копыта.")], message_count=3,
+        created_at=1.0, updated_at=2.0, agent_profile=["Корова", ["Хромота"]], agent_messages=2, agent_seen=3,
+    )
+    assert decode_record("s", encode_record(record)) == record
+
+
+def test_decodes_version_1_records():
+    blob = zlib.compress(json.dumps([1, "Коза", [], [], [["u", "вопрос"], ["a", "ответ"]], 2, 1.0, 2.0]).encode())
+    record = decode_record("s", blob)
+
+    assert record.history == [("user", "вопрос"), ("assistant", "ответ")]
+    assert (record.agent_profile, record.agent_messages, record.agent_seen) == (None, 0, 0)
+
+
+def test_rejects_unknown_versions():
+    with pytest.raises(ValueError):
+        decode_record("s", zlib.compress(b"[9]"))
+
+
+async def test_old_messages_are_folded_into_the_summary():
+    store = SessionStore(Settings(session_backend="memory", session_max_messages=4, session_summary_chars=400))
+    await store.start()
+    for i in range(4):
+        await store.append_turn("s", f"Вопрос {i}?", f"**Ответ** {i}. " + "Подробности. " * 40)
+    record = await store.get("s")
+
+    assert record.message_count == 8
+    assert [role for role, _ in record.history] == ["user", "assistant"] * 2
+    assert record.summary[-1].startswith("Ветеринар: Ответ 1.")
+    assert sum(len(line) for line in record.summary) <= 400
+    await store.close()
+
+
+async def test_only_agent_answers_update_the_agent_memory():
+    store = SessionStore(Settings(session_backend="memory"))
+    await store.start()
+    await store.append_turn("s", "вопрос", "ответ", animal="Корова", symptoms=["Хромота"])
+    record = await store.append_turn("s", "вопрос", "ответ из кэша", agent_answered=False)
+
+    assert record.agent_profile == ["Корова", ["Хромота"]]
+    assert (record.agent_messages, record.agent_seen, record.message_count) == (2, 2, 4)
+    await store.close()
+
+
+async def test_memory_backend_counts_bytes_as_it_goes():
+    backend = MemoryBackend(max_entries=2, ttl=60)
+    await backend.put("a", b"x" * 10)
+    await backend.put("a", b"x" * 4)
+    await backend.put("b", b"x" * 5)
+    await backend.put("c", b"x" * 6)
+
+    assert (len(backend), backend.bytes, backend.evictions) == (2, 11, 1)
+    await backend.delete("b")
+    assert backend.bytes == 6
+
+
+async def test_sqlite_backend_counts_without_querying_on_snapshot(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    backend = SQLiteBackend(path, ttl=60)
+    await backend.put("a", b"x" * 10)
+    await backend.put("a", b"x" * 4)
+    await backend.put("b", b"x" * 5)
+    assert await backend.delete("b")
+    assert not await backend.delete("b")
+    assert (len(backend), backend.bytes) == (1, 4)
+    await backend.close()
+
+    reopened = SQLiteBackend(path, ttl=60)
+    assert (len(reopened), reopened.bytes) == (1, 4)
+    await reopened.close()
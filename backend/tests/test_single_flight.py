@@ -0,0 +1,183 @@
+import asyncio
+
+import httpx
+import pytest
+
+from config import Settings
+from conftest import sse_events
+from resilience import CircuitBreaker
+from single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def collect(flight):
+    return [chunk async for chunk in flight.follow()]
+
+
+async def fail():
+    raise httpx.ConnectError("down")
+
+
+async def ok():
+    return "ok"
+
+
+def gate():
+    """Producer that streams one chunk and finishes with "ответ" once `release` is set"""
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def produce(flight):
+        started.set()
+        flight.open()
+        flight.push("от")
+        await release.wait()
+        flight.push("вет")
+        flight.finish("ответ")
+
+    return produce, started, release
+
+
+async def test_identical_requests_share_one_call():
+    flights = SingleFlight(Settings())
+    produce, started, release = gate()
+    flight, leader = flights.run("key", produce)
+    await started.wait()
+    joined, follower_leads = flights.run("key", produce)
+
+    assert (leader, follower_leads, joined is flight) == (True, False, True)
+    follower = asyncio.ensure_future(asyncio.wait_for(collect(joined), 1))
+    release.set()
+    assert await flight.result() == "ответ"
+    # The follower joined after the first chunk and still gets it
+    assert await follower == ["от", "вет"]
+    assert flights.snapshot()["upstream_calls"] == 1
+    assert flights.snapshot()["in_flight"] == 0
+
+
+async def test_requests_without_a_key_are_not_coalesced():
+    flights = SingleFlight(Settings())
+    produce, _, release = gate()
+    first, _ = flights.run(None, produce)
+    second, leader = flights.run(None, produce)
+    release.set()
+
+    assert leader and first is not second
+    assert await first.result() == await second.result() == "ответ"
+
+
+async def test_call_is_cancelled_only_when_every_request_left():
+    flights = SingleFlight(Settings())
+    produce, started, _ = gate()
+    flight, _ = flights.run("key", produce)
+    await started.wait()
+    flights.run("key", produce)
+
+    flights.leave(flight)
+    await asyncio.sleep(0)
+    assert not flight.task.done()
+
+    flights.leave(flight)
+    with pytest.raises(asyncio.CancelledError):
+        await flight.task
+    assert flights.snapshot()["abandoned"] == 1
+    assert flights.snapshot()["in_flight"] == 0
+
+
+async def test_abandoned_probe_does_not_wedge_the_breaker():
+    circuit = CircuitBreaker(Settings(breaker_failure_threshold=1, breaker_open_seconds=0.0, agent_retry_attempts=0))
+    with pytest.raises(httpx.ConnectError):
+        await circuit.call(fail)
+
+    flights = SingleFlight(Settings())
+    started = asyncio.Event()
+
+    async def hanging():
+        started.set()
+        await asyncio.sleep(60)
+
+    async def produce(flight):
+        flight.finish(await circuit.call(hanging))
+
+    flight, _ = flights.run("key", produce)
+    await started.wait()
+    flights.leave(flight)
+    with pytest.raises(asyncio.CancelledError):
+        await flight.task
+
+    assert await circuit.call(ok) == "ok"
+    assert circuit.state == "closed"
+
+
+def hold_agent(fake_agent, monkeypatch) -> asyncio.Event:
+    """Make the fake agent answer runs only once the returned event is set"""
+    release = asyncio.Event()
+    answer = fake_agent.handler
+
+    async def slow_agent(request):
+        if request.url.path != "/health":
+            await release.wait()
+        return answer(request)
+
+    monkeypatch.setattr(fake_agent, "handler", slow_agent)
+    return release
+
+
+async def wait_for(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+async def test_coalesced_turn_reaches_the_follower_agent_session(backend, fake_agent, monkeypatch):
+    import main
+
+    release = hold_agent(fake_agent, monkeypatch)
+    question = {"input_value": "Почему корова хромает?", "animal": "Корова"}
+    async with backend() as client:
+        leader = asyncio.ensure_future(client.post("/api/v1/chat", json={**question, "session_id": "a"}))
+        await wait_for(lambda: main.single_flight.snapshot()["in_flight"])
+        follower = asyncio.ensure_future(client.post("/api/v1/chat/stream", json={**question, "session_id": "b"}))
+        await wait_for(lambda: main.single_flight.snapshot()["coalesced"])
+        release.set()
+        responses = await asyncio.gather(leader, follower)
+        await client.post("/api/v1/chat", json={"input_value": "Что делать?", "session_id": "b"})
+
+    assert [response.headers["X-Cache"] for response in responses] == ["MISS", "COALESCED"]
+    assert sse_events(responses[1].text)[-1][0] == "end"
+    assert [run["session_id"] for run in fake_agent.runs] == ["a", "b"]
+    # The agent never saw the coalesced turn in session b, so its next input carries it
+    assert "Пользователь: Почему корова хромает?" in fake_agent.runs[1]["input_value"]
+
+
+async def test_coalescing_does_not_depend_on_the_answer_cache(backend, fake_agent, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.settings, "cache_enabled", False)
+    release = hold_agent(fake_agent, monkeypatch)
+    question = {"input_value": "Чем лечить?", "animal": "Корова", "use_cache": False}
+    async with backend() as client:
+        first = asyncio.ensure_future(client.post("/api/v1/chat", json={**question, "session_id": "a"}))
+        await wait_for(lambda: main.single_flight.snapshot()["in_flight"])
+        second = asyncio.ensure_future(client.post("/api/v1/chat", json={**question, "session_id": "b"}))
+        await wait_for(lambda: main.single_flight.snapshot()["coalesced"])
+        release.set()
+        await asyncio.gather(first, second)
+
+    assert len(fake_agent.runs) == 1
+
+
+async def test_sessions_with_different_stored_profiles_are_not_coalesced(backend, fake_agent, monkeypatch):
+    import main
+
+    release = hold_agent(fake_agent, monkeypatch)
+    async with backend() as client:
+        await client.put("/api/v1/sessions/cow", json={"animal": "Корова"})
+        await client.put("/api/v1/sessions/dog", json={"animal": "Собака"})
+        cow = asyncio.ensure_future(client.post("/api/v1/chat", json={"input_value": "Чем лечить?", "session_id": "cow"}))
+        dog = asyncio.ensure_future(client.post("/api/v1/chat", json={"input_value": "Чем лечить?", "session_id": "dog"}))
+        await wait_for(lambda: main.single_flight.snapshot()["in_flight"] == 2)
+        release.set()
+        responses = await asyncio.gather(cow, dog)
+
+    assert [response.headers["X-Cache"] for response in responses] == ["MISS", "MISS"]
+    assert "Собака" in responses[1].json()["message"]
@@ -0,0 +1,158 @@
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from opentelemetry import context, trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTERS = ("none", "console", "file", "otlp")
+
+tracer = trace.get_tracer("tailsense.backend")
+
+
+class Tracing:
+    """OpenTelemetry tracing of chat requests
+
+    With TRACING_EXPORTER=none (default) no SDK provider is installed and
+    all spans are the no-op spans of the OpenTelemetry API. Otherwise spans
+    are exported in batches from a background thread: to stdout (console),
+    as JSON lines to a local file (file, works offline) or to an OTLP
+    collector (otlp, needs opentelemetry-exporter-otlp-proto-http). Root
+    traces are sampled with TRACING_SAMPLE_RATIO; requests that carry a
+    traceparent header follow the caller's sampling decision.
+    """
+
+    def __init__(self, config: Settings):
+        self.config = config
+        self.provider = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+
+    def start(self) -> None:
+        """Install the tracer provider and exporter (called from the application lifespan)"""
+        exporter_name = self.config.tracing_exporter
+        if exporter_name == "none" or self.provider is not None:
+            return
+        if exporter_name not in TRACING_EXPORTERS:
+            raise ValueError(f"Unknown tracing exporter: {exporter_name}")
+
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+        if exporter_name == "console":
+            exporter = ConsoleSpanExporter()
+        elif exporter_name == "file":
+            exporter = ConsoleSpanExporter(
+                out=open(self.config.tracing_file, "a", encoding="utf-8"),
+                formatter=lambda span: span.to_json(indent=None) + "\n",
+            )
+        else:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            exporter = OTLPSpanExporter(endpoint=self.config.tracing_otlp_endpoint or None)
+
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": self.config.tracing_service_name}),
+            sampler=ParentBased(TraceIdRatioBased(self.config.tracing_sample_ratio)),
+        )
+        self.provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(self.provider)
+        logger.info(f"Tracing started ({exporter_name}, sample ratio {self.config.tracing_sample_ratio})")
+
+    def close(self) -> None:
+        """Flush pending spans"""
+        if self.provider is not None:
+            self.provider.shutdown()
+            self.provider = None
+
+
+@contextmanager
+def span(name: str, kind: SpanKind = SpanKind.INTERNAL, **attributes: Any) -> Iterator[trace.Span]:
+    """Child span of the current one; exceptions are recorded and re-raised"""
+    with tracer.start_as_current_span(name, kind=kind, attributes=attributes or None) as current:
+        yield current
+
+
+def route_template(scope: Dict[str, Any]) -> Optional[str]:
+    """Path template of the route that served the request, None if nothing matched"""
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", None)
+    endpoint = scope.get("endpoint")
+    if endpoint is None or "app" not in scope:
+        return None
+    # Starlette до 0.33 не кладет route в scope: ищем маршрут по обработчику
+    for candidate in scope["app"].routes:
+        if getattr(candidate, "endpoint", None) is endpoint:
+            return getattr(candidate, "path", None)
+    return None
+
+
+def set_span_attributes(attributes: Dict[str, Any]) -> None:
+    """Annotate the current span (the request span in handlers)"""
+    trace.get_current_span().set_attributes(attributes)
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Headers carrying the current trace context (traceparent) to an upstream service"""
+    headers = dict(headers or {})
+    inject(headers)
+    return headers
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the server span of each HTTP request
+
+    The trace context of the caller (traceparent header from the frontend)
+    becomes the parent. The span is named after the route template once the
+    request was routed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        token = context.attach(extract(carrier))
+        status = {"code": 500}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            with tracer.start_as_current_span(
+                f"{scope['method']} {scope['path']}",
+                kind=SpanKind.SERVER,
+                attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+            ) as server_span:
+                try:
+                    await self.app(scope, receive, send_traced)
+                finally:
+                    route = route_template(scope)
+                    if route is not None:
+                        server_span.update_name(f"{scope['method']} {route}")
+                        server_span.set_attribute("http.route", route)
+                    server_span.set_attribute("http.response.status_code", status["code"])
+                    if status["code"] >= 500:
+                        server_span.set_status(Status(StatusCode.ERROR))
+        finally:
+            context.detach(token)
+
+
+# Глобальная настройка трассировки
+tracing = Tracing(settings)
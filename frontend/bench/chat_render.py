@@ -0,0 +1,93 @@
+"""
+Rerun time of the chat screen versus the consultation length: the whole
+history rendered on every rerun (CHAT_PAGE_SIZE=0, as before) versus the
+paginated history (only the last page of messages).
+
+The chat screen is run headless with streamlit.testing (no browser, no
+backend calls), with a synthetic history of alternating questions and
+--answer-chars long answers. Each rerun is what Streamlit executes on any
+interaction with the page. Reported per history length and variant: median
+and p95 rerun time in ms and the markdown characters the rerun sends to the
+browser.
+
+Usage (from the frontend directory):
+    python -m bench.chat_render --lengths 10 50 100 200 --reruns 20
+"""
+
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# Проверка доступности backend в боковой панели не должна ждать сеть
+os.environ.setdefault("BACKEND_URL", "http://127.0.0.1:9")
+import streamlit.logger
+from streamlit.testing.v1 import AppTest
+
+from components.chat_widget import CHAT_RENDER_CONFIG, new_message
+
+# Обращения к состоянию теста из главного потока предупреждают об отсутствии контекста
+streamlit.logger.set_log_level("error")
+
+APP = str(Path(__file__).resolve().parents[1] / "app.py")
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def synthetic_history(length: int, answer_chars: int) -> List[Dict[str, Any]]:
+    answer = ("Корова хромает из-за поражения копыта, рекомендую осмотр. " * (answer_chars // 58 + 1))[:answer_chars]
+    return [
+        new_message("user", f"Вопрос {i // 2}: почему корова хромает?") if i % 2 == 0 else new_message("assistant", answer)
+        for i in range(length)
+    ]
+
+
+def measure(history: List[Dict[str, Any]], reruns: int) -> Dict[str, float]:
+    """Reruns the chat screen, returns rerun times in ms and markdown characters per rerun"""
+    app = AppTest.from_file(APP, default_timeout=60)
+    app.session_state.page = 3
+    app.session_state.selected_animal = "Корова"
+    app.session_state.selected_symptoms = ["Хромота"]
+    app.session_state.chat_history = history
+    app.run()  # Прогрев: импорт модулей, проверка backend
+    streamlit.logger.set_log_level("error")  # Первый запуск применяет уровень из конфигурации Streamlit
+
+    times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        times.append((time.perf_counter() - started) * 1000)
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return {
+        "p50": statistics.median(times),
+        "p95": percentile(times, 0.95),
+        "chars": sum(len(element.value) for element in app.markdown)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 100, 200], help="History lengths, messages")
+    parser.add_argument("--reruns", type=int, default=20, help="Measured reruns per point")
+    parser.add_argument("--answer-chars", type=int, default=2000, help="Length of each answer")
+    parser.add_argument("--page-size", type=int, default=CHAT_RENDER_CONFIG["page_size"])
+    args = parser.parse_args()
+
+    variants = {"full history": 0, f"page of {args.page_size}": args.page_size}
+    print(f"{'messages':>8}  {'variant':<14} {'p50 ms':>8} {'p95 ms':>8} {'md chars':>10}")
+    for length in args.lengths:
+        history = synthetic_history(length, args.answer_chars)
+        for name, page_size in variants.items():
+            CHAT_RENDER_CONFIG["page_size"] = page_size
+            result = measure(history, args.reruns)
+            print(f"{length:>8}  {name:<14} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['chars']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Per-message latency through the backend: a new connection per request (plain
+requests.post, as the frontend did before) versus the shared requests.Session
+with a keep-alive pool (utils.api_client).
+
+Messages are sent one by one to /api/v1/chat, alternating the variants so
+that both see the same backend state. By default every message is the same
+question, so after the first one the backend answers from its answer cache
+and the measured time is the frontend -> backend transport plus request
+handling; --no-cache sends every message on to the agent. Reported per
+variant: mean, p50, p95 and max latency in ms, and the time saved per
+message by connection reuse.
+
+Usage (from the frontend directory, with the backend running):
+    python -m bench.connection_reuse --url http://localhost:8000 --messages 200
+    python -m bench.connection_reuse --url http://backend:8000 --no-cache --messages 20
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+from typing import Callable, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def message_payload(question: str, use_cache: bool) -> Dict[str, object]:
+    return {
+        "input_value": question,
+        "session_id": str(uuid.uuid4()),
+        "question": question,
+        "animal": "Корова",
+        "symptoms": ["Хромота"],
+        "use_cache": use_cache
+    }
+
+
+def measure(post: Callable[..., requests.Response], url: str, payload: Dict[str, object], timeout: float) -> float:
+    """Sends one message, returns its latency in ms"""
+    started = time.perf_counter()
+    response = post(url, json=payload, headers={"X-Client-Id": payload["session_id"]}, timeout=timeout)
+    response.raise_for_status()
+    response.json()
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="Backend base URL")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per variant")
+    parser.add_argument("--question", default="Почему корова хромает на заднюю ногу?")
+    parser.add_argument("--no-cache", action="store_true", help="Send every message on to the agent")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + "/api/v1/chat"
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=20))
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=20))
+    variants = {"new connection": requests.post, "pooled session": session.post}
+
+    # Прогрев: первый ответ попадает в кэш backend, пул открывает соединение
+    for post in variants.values():
+        measure(post, url, message_payload(args.question, not args.no_cache), args.timeout)
+
+    latencies: Dict[str, List[float]] = {name: [] for name in variants}
+    for i in range(args.messages):
+        question = f"{args.question} ({i})" if args.no_cache else args.question
+        for name, post in variants.items():
+            latencies[name].append(measure(post, url, message_payload(question, not args.no_cache), args.timeout))
+
+    print(f"{args.messages} messages per variant to {url}{' (no cache)' if args.no_cache else ''}")
+    print(f"{'variant':<16} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+    for name, values in latencies.items():
+        print(
+            f"{name:<16} {statistics.mean(values):>8.2f} {percentile(values, 0.5):>8.2f} "
+            f"{percentile(values, 0.95):>8.2f} {max(values):>8.2f}"
+        )
+    saved = statistics.mean(latencies["new connection"]) - statistics.mean(latencies["pooled session"])
+    print(f"saved per message: {saved:.2f} ms ({saved / statistics.mean(latencies['new connection']):.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,67 @@
 Компонент чата для отображения истории сообщений.
 """
 
+import os
 import streamlit as st
 from datetime import datetime
+from typing import Any, Dict, Optional
+
+CHAT_RENDER_CONFIG = {
+    "page_size": int(os.getenv("CHAT_PAGE_SIZE", "20"))  # Сообщений истории на страницу, 0 - вся история
+}
+
+def new_message(role: str, content: str) -> Dict[str, Any]:
+    """
+    Создает сообщение для истории чата с временем отправки.
+    
+    Args:
+        role (str): Роль отправителя ("user" или "assistant")
+        content (str): Содержимое сообщения
+    
+    Returns:
+        Dict[str, Any]: Сообщение истории чата
+    """
+    return {"role": role, "content": content, "time": datetime.now().strftime("%H:%M")}
 
 def show_chat_interface():
     """
     Отображает интерфейс чата с историей сообщений.
     """
     
-    # Контейнер для сообщений чата
-    chat_container = st.container()
+    # Если нет истории, показываем приветственное сообщение
+    if not st.session_state.chat_history:
+        show_welcome_message()
+    else:
+        show_chat_history()
+
+@st.fragment
+def show_chat_history():
+    """
+    Отображает последние сообщения истории, более ранние - по кнопке.
     
-    with chat_container:
-        # Если нет истории, показываем приветственное сообщение
-        if not st.session_state.chat_history:
-            show_welcome_message()
-        else:
-            # Отображаем все сообщения из истории
-            for message in st.session_state.chat_history:
-                show_message(message["role"], message["content"])
+    Выводится только последняя страница истории (CHAT_PAGE_SIZE сообщений),
+    поэтому время перезапуска страницы не растет с длиной консультации.
+    Каждый полный перезапуск скрипта по-прежнему выводит эту страницу
+    заново; фрагмент лишь избавляет от полного перезапуска при подгрузке
+    предыдущих сообщений.
+    """
+    
+    history = st.session_state.chat_history
+    page_size = CHAT_RENDER_CONFIG["page_size"]
+    if page_size <= 0:
+        start = 0
+    else:
+        start = max(0, len(history) - page_size * st.session_state.get("chat_pages", 1))
+    
+    if start > 0:
+        st.button(f"⬆️ Показать предыдущие сообщения ({start})", key="chat_show_older", on_click=_show_older_messages)
+    
+    for message in history[start:]:
+        show_message(message["role"], message["content"], message.get("time"))
+
+def _show_older_messages():
+    """Добавляет к выводу еще одну страницу предыдущих сообщений."""
+    st.session_state.chat_pages = st.session_state.get("chat_pages", 1) + 1
 
 def show_welcome_message():
     """Отображает приветственное сообщение от ветеринара."""
@@ -52,13 +94,14 @@ def show_welcome_message():
         💬 *Опишите проблему в поле ввода ниже...*
         """)
 
-def show_message(role, content):
+def show_message(role: str, content: str, sent_at: Optional[str] = None):
     """
     Отображает одно сообщение в чате.
     
     Args:
         role (str): Роль отправителя ("user" или "assistant")
         content (str): Содержимое сообщения
+        sent_at (Optional[str]): Время отправки из истории чата
     """
     
     with st.chat_message(role):
@@ -69,9 +112,9 @@ def show_message(role, content):
             # Сообщение ассистента с дополнительным форматированием
             st.markdown(content)
             
-            # Добавляем время отправки для сообщений ассистента
-            current_time = datetime.now().strftime("%H:%M")
-            st.caption(f"Отправлено в {current_time}")
+            # Время отправки сохранено в сообщении, а не берется при отрисовке
+            if sent_at:
+                st.caption(f"Отправлено в {sent_at}")
 
 def show_chat_stats():
     """Отображает статистику чата в боковой панели."""
@@ -87,6 +130,7 @@ def show_chat_stats():
 def clear_chat_history():
     """Очищает историю чата."""
     st.session_state.chat_history = []
+    st.session_state.chat_pages = 1
 
 def export_chat_history():
     """
@@ -113,7 +157,8 @@ def export_chat_history():
     
     for i, message in enumerate(st.session_state.chat_history, 1):
         role_name = "ПОЛЬЗОВАТЕЛЬ" if message["role"] == "user" else "ВЕТЕРИНАР"
-        export_text += f"{i}. {role_name}:\n{message['content']}\n\n"
+        sent_at = f" ({message['time']})" if message.get("time") else ""
+        export_text += f"{i}. {role_name}{sent_at}:\n{message['content']}\n\n"
     
     return export_text
 
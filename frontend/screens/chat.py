@@ -3,8 +3,9 @@
 """
 
 import streamlit as st
-from components.chat_widget import show_chat_interface
-from utils.api_client import send_message, reset_agent_session
+from components.chat_widget import new_message, show_chat_interface, show_message
+from utils.api_client import submit_message, reset_agent_session
+from utils.chat_worker import CHAT_WORKER_CONFIG
 
 def show_chat_screen():
     """Отображает экран чата с ветеринаром-помощником."""
@@ -20,16 +21,19 @@ def show_chat_screen():
         
         # Кнопка изменения настроек
         if st.button("⚙️ Изменить настройки", use_container_width=True):
-            reset_agent_session()  # Сбрасываем сессию агента
+            # Сессия агента сохраняется: новый профиль backend передаст со следующим вопросом
+            _cancel_pending_answer()
             st.session_state.page = 2
             st.rerun()
         
         # Кнопка начать заново
         if st.button("🔄 Начать заново", use_container_width=True):
             # Очищаем данные сессии
+            _cancel_pending_answer()
             st.session_state.selected_animal = ""
             st.session_state.selected_symptoms = []
             st.session_state.chat_history = []
+            st.session_state.chat_pages = 1
             reset_agent_session()  # Сбрасываем сессию агента
             st.session_state.page = 1
             st.rerun()
@@ -47,37 +51,33 @@ def show_chat_screen():
     # Интерфейс чата
     show_chat_interface()
     
-    # Поле ввода сообщения
-    user_message = st.chat_input("Опишите проблему вашего питомца...")
+    # Ответ генерируется в фоновом потоке, страница остается интерактивной
+    job = st.session_state.get("chat_job")
+    if job is not None:
+        if job.done:
+            _finish_pending_answer()
+            job = None
+        else:
+            _show_pending_answer()
+    
+    # Поле ввода сообщения; пока ответ не получен, новое сообщение не принимается
+    user_message = st.chat_input("Опишите проблему вашего питомца...", disabled=job is not None)
     
     if user_message:
-        # Добавляем сообщение пользователя в историю
-        st.session_state.chat_history.append({
-            "role": "user", 
-            "content": user_message
-        })
-        
-        # Получаем ответ от API (пока заглушка)
-        try:
-            with st.spinner("Ветеринар думает..."):
-                response = send_message(
-                    animal=st.session_state.selected_animal,
-                    symptoms=st.session_state.selected_symptoms,
-                    message=user_message,
-                    history=st.session_state.chat_history
-                )
-                
-                # Добавляем ответ ассистента в историю
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": response
-                })
-                
-                # Перезагружаем страницу для обновления чата
-                st.rerun()
-                
-        except Exception as e:
-            st.error(f"Ошибка при получении ответа: {str(e)}")
+        question = new_message("user", user_message)
+        job = submit_message(
+            animal=st.session_state.selected_animal,
+            symptoms=st.session_state.selected_symptoms,
+            message=user_message,
+            history=st.session_state.chat_history + [question]
+        )
+        if job is None:
+            st.warning("⏳ Сервис сейчас загружен, отправьте сообщение еще раз через несколько секунд.")
+        else:
+            # Добавляем сообщение пользователя в историю
+            st.session_state.chat_history.append(question)
+            st.session_state.chat_job = job
+            st.rerun()
     
     # Дополнительная информация
     with st.sidebar:
@@ -114,3 +114,50 @@ def show_chat_screen():
         При серьезных симптомах обязательно обратитесь к ветеринару!
         """)
 
+
+@st.fragment(run_every=CHAT_WORKER_CONFIG["poll_interval"])
+def _show_pending_answer():
+    """
+    Показывает генерируемый ответ и кнопку остановки.
+    
+    Фрагмент перерисовывается по таймеру отдельно от остальной страницы;
+    когда ответ готов, страница перезапускается целиком.
+    """
+    
+    job = st.session_state.get("chat_job")
+    if job is None:
+        return
+    
+    with st.chat_message("assistant"):
+        if job.chunks:
+            st.markdown(job.text + " ▌")
+        else:
+            st.markdown("_Ветеринар печатает..._")
+        if st.button("⏹️ Остановить", key="cancel_answer"):
+            job.cancel()
+    
+    if job.done:
+        st.rerun()
+
+def _finish_pending_answer():
+    """Переносит готовый или остановленный ответ в историю чата."""
+    
+    job = st.session_state.pop("chat_job")
+    if job.error:
+        st.error(f"Ошибка при обращении к ИИ-агенту: {job.error}")
+    
+    response = job.text
+    if job.cancelled:
+        response = f"{response}\n\n_Ответ остановлен._" if response else "_Ответ остановлен._"
+    
+    # Добавляем ответ ассистента в историю
+    answer = new_message("assistant", response)
+    st.session_state.chat_history.append(answer)
+    show_message("assistant", answer["content"], answer["time"])
+
+def _cancel_pending_answer():
+    """Останавливает генерацию ответа при уходе с экрана чата."""
+    
+    job = st.session_state.pop("chat_job", None)
+    if job is not None:
+        job.cancel()
@@ -0,0 +1,92 @@
+import pytest
+import requests
+import streamlit as st
+
+from utils import api_client
+
+
+def test_backend_request_carries_only_the_question_and_the_profile():
+    payload, headers = api_client._backend_request("Почему корова хромает?", "Корова", ["Хромота"], session_id="s")
+
+    assert payload == {
+        "output_type": "chat",
+        "input_type": "chat",
+        "input_value": "Почему корова хромает?",
+        "session_id": "s",
+        "animal": "Корова",
+        "symptoms": ["Хромота"],
+    }
+    assert headers == {"X-Client-Id": "s"}
+
+
+class FakeSession:
+    def __init__(self, error=None):
+        self.deleted = []
+        self.error = error
+
+    def delete(self, url, timeout):
+        if self.error:
+            raise self.error
+        self.deleted.append(url)
+
+
+def test_reset_deletes_the_backend_session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(api_client, "_get_http_session", lambda: session)
+    st.session_state.agent_session_id = "old"
+
+    api_client.reset_agent_session()
+
+    assert session.deleted == [f"{api_client.BACKEND_API_CONFIG['sessions_url']}/old"]
+    assert "agent_session_id" not in st.session_state
+    api_client.reset_agent_session()
+    assert len(session.deleted) == 1
+
+
+def test_reset_ignores_an_unreachable_backend(monkeypatch):
+    monkeypatch.setattr(api_client, "_get_http_session", lambda: FakeSession(requests.ConnectionError()))
+    st.session_state.agent_session_id = "old"
+
+    api_client.reset_agent_session()
+
+    assert "agent_session_id" not in st.session_state
+
+
+class FakeStream:
+    def __init__(self, lines):
+        self.lines = lines
+        self.status_code = 200
+        self.headers = {"X-Cache": "MISS"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+def stream(monkeypatch, lines):
+    session = type("Session", (), {"post": lambda self, url, **kwargs: FakeStream(lines)})()
+    monkeypatch.setattr(api_client, "_get_http_session", lambda: session)
+    return api_client._stream_backend_api("вопрос", "Корова", [], session_id="s")
+
+
+def test_stream_yields_chunks_until_end(monkeypatch):
+    lines = ['event: token', 'data: {"chunk": "Осмотрите "}', '', 'event: token', 'data: {"chunk": "копыта."}', '',
+             'event: end', 'data: {"message": "Осмотрите копыта."}', '']
+
+    assert list(stream(monkeypatch, lines)) == ["Осмотрите ", "копыта."]
+
+
+def test_stream_closed_without_end_is_an_error(monkeypatch):
+    chunks = stream(monkeypatch, ['event: token', 'data: {"chunk": "Осмотрите "}', ''])
+
+    assert next(chunks) == "Осмотрите "
+    with pytest.raises(RuntimeError):
+        next(chunks)
@@ -0,0 +1,59 @@
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from components.chat_widget import CHAT_RENDER_CONFIG
+
+
+@pytest.fixture(autouse=True)
+def restore_render_config():
+    saved = dict(CHAT_RENDER_CONFIG)
+    yield
+    CHAT_RENDER_CONFIG.update(saved)
+
+
+def app(page_size: int, messages: int):
+    import streamlit as st
+
+    from components import chat_widget
+
+    chat_widget.CHAT_RENDER_CONFIG["page_size"] = page_size
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = [
+            chat_widget.new_message("user" if i % 2 == 0 else "assistant", f"Сообщение {i}")
+            for i in range(messages)
+        ]
+    chat_widget.show_chat_history()
+
+
+def chat_app(page_size: int, messages: int) -> AppTest:
+    return AppTest.from_function(app, kwargs={"page_size": page_size, "messages": messages}).run()
+
+
+def shown(at) -> list:
+    return [markdown.value for markdown in at.markdown]
+
+
+def test_only_the_last_page_is_rendered():
+    at = chat_app(page_size=4, messages=10)
+
+    assert shown(at) == [f"Сообщение {i}" for i in range(6, 10)]
+    assert at.button[0].label == "⬆️ Показать предыдущие сообщения (6)"
+
+
+def test_older_messages_are_added_page_by_page():
+    at = chat_app(page_size=4, messages=10)
+
+    at.button[0].click().run()
+    assert shown(at) == [f"Сообщение {i}" for i in range(2, 10)]
+    assert at.button[0].label == "⬆️ Показать предыдущие сообщения (2)"
+
+    at.button[0].click().run()
+    assert shown(at) == [f"Сообщение {i}" for i in range(10)]
+    assert len(at.button) == 0
+
+
+def test_page_size_zero_renders_the_whole_history():
+    at = chat_app(page_size=0, messages=30)
+
+    assert len(shown(at)) == 30
+    assert len(at.button) == 0
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from utils.chat_worker import ChatJob, ChatWorkerPool
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class FakeResponse:
+    """Streaming backend response: reading blocks until it is closed"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def streaming(*chunks, release=None):
+    """Job function yielding the chunks, then waiting for `release` or for the response to close"""
+    def produce(job):
+        response = FakeResponse()
+        job.attach(response)
+        yield from chunks
+        while not (release and release.is_set()):
+            if response.closed.wait(0.01):
+                raise ConnectionError("Response ended prematurely")
+
+    return produce
+
+
+@pytest.fixture
+def pool():
+    pool = ChatWorkerPool(workers=1, max_queued=1)
+    yield pool
+    pool._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def test_jobs_over_the_workers_and_queue_are_rejected(pool):
+    release = threading.Event()
+    jobs = [ChatJob() for _ in range(3)]
+
+    accepted = [pool.submit(job, streaming(release=release)) for job in jobs]
+
+    assert accepted == [True, True, False]
+    assert pool.full and pool.rejected == 1
+    release.set()
+    wait_until(lambda: jobs[0].done and jobs[1].done)
+    assert pool.active == 0 and not pool.full
+
+
+def test_chunks_are_collected_until_the_job_is_done(pool):
+    release = threading.Event()
+    job = ChatJob()
+    pool.submit(job, streaming("Осмотрите ", "копыта.", release=release))
+
+    wait_until(lambda: job.text == "Осмотрите копыта.")
+    assert not job.done
+    release.set()
+    wait_until(lambda: job.done)
+    assert job.error is None
+
+
+def test_cancel_closes_the_response_and_frees_the_worker(pool):
+    job = ChatJob()
+    pool.submit(job, streaming("Осмотрите "))
+    wait_until(lambda: job.text)
+
+    job.cancel()
+
+    # Done at once, without waiting for the worker thread
+    assert job.done and job.cancelled
+    wait_until(lambda: pool.active == 0)
+    assert job.error is None
+    assert job.text == "Осмотрите "
+    release = threading.Event()
+    release.set()
+    assert pool.submit(ChatJob(), streaming(release=release))
+
+
+def test_response_attached_after_cancel_is_closed():
+    job = ChatJob()
+    job.cancel()
+    response = FakeResponse()
+
+    job.attach(response)
+
+    assert response.closed.is_set()
+
+
+def test_job_function_errors_are_reported(pool):
+    def failing(job):
+        yield "Осмотрите "
+        raise RuntimeError("Поток ответа прервался до завершения")
+
+    job = ChatJob()
+    pool.submit(job, failing)
+
+    wait_until(lambda: job.done)
+    assert job.error == "Поток ответа прервался до завершения"
+    assert pool.active == 0
@@ -3,31 +3,47 @@ API клиент для взаимодействия с ИИ-агентом ве
 """
 
 import requests
+import json
 import uuid
-import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Optional
 import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from utils.chat_worker import ChatJob, get_worker_pool
+from utils.tracing import SpanKind, init_tracing, span, trace_headers
 
 # Конфигурация API агента
 import os
 
-# Определяем URL агента в зависимости от окружения
-AGENT_HOST = os.getenv("AGENT_HOST", "agent")  # agent - имя сервиса в docker-compose
-AGENT_PORT = os.getenv("AGENT_PORT", "7860")
+# Все запросы к ИИ-агенту идут через backend: таймауты, кэш ответов и
+# ограничения backend применяются и к сообщениям из интерфейса
+BACKEND_HOST = os.getenv("BACKEND_HOST", "backend")  # backend - имя сервиса в docker-compose
+BACKEND_PORT = os.getenv("BACKEND_PORT", "8000")
+BACKEND_URL = os.getenv("BACKEND_URL", f"http://{BACKEND_HOST}:{BACKEND_PORT}").rstrip("/")
 
-AGENT_API_CONFIG = {
-    "url": f"http://{AGENT_HOST}:{AGENT_PORT}/api/v1/run/e68ff0eb-0690-43b7-acb6-c3e8ea8ecea1",
-    "api_key": "sk-WFRz8a28DHL31Sr-qN0K8WFFnzKeeVaJJLq5RYAF7dg",
-    "headers": {
-        "Content-Type": "application/json",
-        "x-api-key": "sk-WFRz8a28DHL31Sr-qN0K8WFFnzKeeVaJJLq5RYAF7dg"
-    },
-    "timeout": 60  # Таймаут в секундах
+BACKEND_API_CONFIG = {
+    "base_url": BACKEND_URL,
+    "stream_url": f"{BACKEND_URL}/api/v1/chat/stream",
+    "sessions_url": f"{BACKEND_URL}/api/v1/sessions",
+    "health_url": f"{BACKEND_URL}/health",
+    "connect_timeout": float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3")),  # Установка соединения, секунды
+    "timeout": float(os.getenv("BACKEND_TIMEOUT", "60")),  # Ожидание ответа или следующего фрагмента, секунды
+    "pool_size": int(os.getenv("BACKEND_POOL_SIZE", "20")),  # Keep-alive соединений к backend на процесс
+    "health_timeout": 3,  # Таймаут проверки доступности, секунды
+    "health_ttl": 30  # Сколько секунд переиспользуется результат проверки
 }
 
-def send_message(animal: str, symptoms: List[str], message: str, history: List[Dict[str, Any]]) -> str:
+init_tracing()
+
+def submit_message(animal: str, symptoms: List[str], message: str, history: List[Dict[str, Any]]) -> Optional[ChatJob]:
     """
-    Отправляет сообщение пользователя в ИИ-агент и получает ответ от ветеринара.
+    Запускает генерацию ответа в фоновом пуле и сразу возвращает задачу.
+    
+    Backend получает только вопрос, сессию, животное и симптомы: историю
+    консультации он хранит сам и добавляет к вопросу то, чего агент еще
+    не видел. session_id берется здесь, в потоке скрипта: st.session_state
+    из потоков пула недоступен. Экран чата опрашивает задачу и может
+    отменить ее; отмена закрывает соединение с backend.
     
     Args:
         animal (str): Тип животного
@@ -36,21 +52,37 @@ def send_message(animal: str, symptoms: List[str], message: str, history: List[D
         history (List[Dict[str, Any]]): История чата
     
     Returns:
-        str: Ответ от ИИ-ветеринара
+        Optional[ChatJob]: Задача генерации или None, если пул занят
     """
     
-    # Формируем контекстное сообщение с информацией о животном и симптомах
-    context_message = _build_context_message(animal, symptoms, message, history)
-    
-    try:
-        # Отправляем запрос к ИИ-агенту
-        response_text = _call_agent_api(context_message)
-        return response_text
-        
-    except Exception as e:
-        st.error(f"Ошибка при обращении к ИИ-агенту: {str(e)}")
-        # Возвращаем заглушку в случае ошибки
-        return _get_fallback_response(animal, symptoms, message)
+    pool = get_worker_pool()
+    if pool.full:
+        return None
+    
+    attributes = _span_attributes(animal, history)
+    session_id = _get_agent_session_id()
+    
+    def produce(job: ChatJob) -> Iterator[str]:
+        with span("send_message", attributes=attributes) as message_span:
+            received_any = False
+            try:
+                for chunk in _stream_backend_api(message, animal, symptoms, message_span,
+                                                 session_id=session_id, on_response=job.attach):
+                    if not received_any:
+                        message_span.add_event("first_chunk")
+                    received_any = True
+                    yield chunk
+            except Exception as e:
+                if job.cancel_requested:
+                    message_span.add_event("cancelled")
+                    return
+                message_span.record_exception(e)
+                job.error = str(e)
+                if not received_any:
+                    yield _get_fallback_response(animal, symptoms, message)
+    
+    job = ChatJob()
+    return job if pool.submit(job, produce) else None
 
 def generate_mock_responses(animal: str, symptoms: List[str], message: str, history: List[Dict[str, Any]]) -> List[str]:
     """
@@ -111,34 +143,75 @@ def generate_mock_responses(animal: str, symptoms: List[str], message: str, hist
     
     return base_responses
 
+@st.cache_resource(show_spinner=False)
+def _get_http_session() -> requests.Session:
+    """
+    Возвращает HTTP-сессию с пулом keep-alive соединений к backend.
+    
+    Сессия создается один раз на процесс и общая для всех сессий Streamlit,
+    поэтому сообщения не открывают новое TCP-соединение. Пул urllib3
+    потокобезопасен; если все pool_size соединений заняты, открывается
+    дополнительное, которое закрывается после запроса.
+    
+    Returns:
+        requests.Session: Общая HTTP-сессия
+    """
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BACKEND_API_CONFIG["pool_size"])
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _timeout(read_timeout: float) -> tuple:
+    """
+    Возвращает таймауты запроса к backend: установка соединения и чтение.
+    
+    Args:
+        read_timeout (float): Таймаут чтения, секунды
+    
+    Returns:
+        tuple: (connect, read) для requests
+    """
+    return (BACKEND_API_CONFIG["connect_timeout"], read_timeout)
+
+@st.cache_data(ttl=BACKEND_API_CONFIG["health_ttl"], show_spinner=False)
+def _fetch_health_status(health_url: str) -> Dict[str, Any]:
+    """
+    Запрашивает /health бэкенда. Результат кэшируется на health_ttl секунд
+    и общий для всех сессий Streamlit в процессе.
+    
+    Args:
+        health_url (str): URL эндпоинта /health
+    
+    Returns:
+        Dict[str, Any]: Ответ /health или пустой словарь, если бэкенд недоступен
+    """
+    
+    try:
+        response = _get_http_session().get(health_url, timeout=_timeout(BACKEND_API_CONFIG["health_timeout"]))
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return {}
+
 def check_backend_connection() -> bool:
     """
     Проверяет доступность ИИ-агента.
     
+    Использует легкий /health бэкенда, который сообщает последнее известное
+    состояние агента без запуска консультации.
+    
     Returns:
         bool: True если агент доступен, False если нет
     """
     
-    try:
-        # Пробуем отправить простой тестовый запрос
-        test_payload = {
-            "output_type": "chat",
-            "input_type": "chat",
-            "input_value": "Тестовое соединение",
-            "session_id": str(uuid.uuid4())
-        }
-        
-        response = requests.post(
-            AGENT_API_CONFIG["url"],
-            json=test_payload,
-            headers=AGENT_API_CONFIG["headers"],
-            timeout=10  # Короткий таймаут для проверки
-        )
-        
-        return response.status_code == 200
-        
-    except Exception:
+    health = _fetch_health_status(BACKEND_API_CONFIG["health_url"])
+    if not health:
         return False
+    
+    agent_status = (health.get("agent") or {}).get("status")
+    return agent_status != "down"
 
 def get_api_status() -> Dict[str, Any]:
     """
@@ -154,94 +227,127 @@ def get_api_status() -> Dict[str, Any]:
         "status": "connected" if is_connected else "disconnected",
         "message": "ИИ-агент доступен" if is_connected else "ИИ-агент недоступен",
         "agent_connected": is_connected,
-        "agent_url": AGENT_API_CONFIG["url"],
+        "backend_url": BACKEND_API_CONFIG["base_url"],
         "version": "1.0.0-agent"
     }
 
-def _build_context_message(animal: str, symptoms: List[str], message: str, history: List[Dict[str, Any]]) -> str:
+def _span_attributes(animal: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Формирует контекстное сообщение для ИИ-агента.
+    Атрибуты спана сообщения: сессия агента, животное и длина истории.
     
     Args:
         animal (str): Тип животного
-        symptoms (List[str]): Список симптомов
-        message (str): Сообщение пользователя
         history (List[Dict[str, Any]]): История чата
     
     Returns:
-        str: Сформированное контекстное сообщение
+        Dict[str, Any]: Атрибуты спана
     """
+    return {
+        "tailsense.session_id": _get_agent_session_id(),
+        "tailsense.animal": animal or "",
+        "tailsense.history_messages": len(history)
+    }
+
+def _get_agent_session_id() -> str:
+    """
+    Возвращает постоянный session_id агента, создавая его при первом обращении.
     
-    # Формируем контекст с информацией о животном и симптомах
-    context_parts = []
-    
-    if animal:
-        context_parts.append(f"Животное: {animal}")
-    
-    if symptoms:
-        symptoms_text = ", ".join(symptoms)
-        context_parts.append(f"Наблюдаемые симптомы: {symptoms_text}")
-    
-    # Добавляем историю чата (последние несколько сообщений)
-    if history:
-        recent_history = history[-4:]  # Берем последние 4 сообщения для контекста
-        context_parts.append("Предыдущие сообщения:")
-        for msg in recent_history:
-            role = "Пользователь" if msg["role"] == "user" else "Ветеринар"
-            context_parts.append(f"{role}: {msg['content']}")
-    
-    # Добавляем текущий вопрос
-    context_parts.append(f"Текущий вопрос: {message}")
-    
-    return "\n".join(context_parts)
+    Returns:
+        str: Идентификатор сессии агента
+    """
+    if 'agent_session_id' not in st.session_state:
+        st.session_state.agent_session_id = str(uuid.uuid4())
+    return st.session_state.agent_session_id
 
-def _call_agent_api(message: str) -> str:
+def _backend_request(question: str, animal: str = None, symptoms: List[str] = None,
+                     session_id: str = None) -> tuple:
     """
-    Выполняет запрос к API ИИ-агента.
+    Формирует тело и заголовки запроса к чату backend.
     
     Args:
-        message (str): Сообщение для отправки агенту
+        question (str): Вопрос пользователя
+        animal (str): Тип животного
+        symptoms (List[str]): Список симптомов
+        session_id (str): Сессия агента; по умолчанию берется из st.session_state
     
     Returns:
-        str: Ответ от агента
-    
-    Raises:
-        requests.RequestException: Ошибка при выполнении запроса
-        ValueError: Ошибка при парсинге ответа
+        tuple: (payload, headers)
     """
     
-    # Получаем или создаем постоянный session_id для пользователя
-    if 'agent_session_id' not in st.session_state:
-        st.session_state.agent_session_id = str(uuid.uuid4())
-    
-    # Подготавливаем payload для API запроса
     payload = {
         "output_type": "chat",
-        "input_type": "chat", 
-        "input_value": message,
-        "session_id": st.session_state.agent_session_id
+        "input_type": "chat",
+        "input_value": question,
+        "session_id": session_id or _get_agent_session_id(),
+        "animal": animal,
+        "symptoms": symptoms or []
     }
+    # Все пользователи приходят с адреса frontend: backend из TRUSTED_PROXIES считает лимит частоты по сессии
+    headers = {"X-Client-Id": payload["session_id"]}
+    return payload, headers
+
+def _stream_backend_api(question: str, animal: str = None, symptoms: List[str] = None,
+                        parent_span=None, session_id: str = None,
+                        on_response: Callable[[requests.Response], None] = None) -> Iterator[str]:
+    """
+    Выполняет потоковый запрос к backend API и разбирает Server-Sent Events.
     
-    # Выполняем запрос к API
-    response = requests.post(
-        AGENT_API_CONFIG["url"],
-        json=payload,
-        headers=AGENT_API_CONFIG["headers"],
-        timeout=AGENT_API_CONFIG["timeout"]
-    )
+    Args:
+        question (str): Вопрос пользователя
+        animal (str): Тип животного
+        symptoms (List[str]): Список симптомов
+        parent_span (Span): Спан сообщения, контекст трассы передается backend
+        session_id (str): Сессия агента; по умолчанию берется из st.session_state
+        on_response (Callable): Получает открытый ответ, чтобы его можно было закрыть из другого потока
     
-    # Проверяем статус ответа
-    response.raise_for_status()
+    Yields:
+        str: Фрагменты текста ответа
     
-    # Парсим JSON ответа
-    resp_json = response.json()
+    Raises:
+        requests.RequestException: Ошибка при выполнении запроса
+        RuntimeError: Сервер сообщил об ошибке во время генерации или поток
+            закрылся без события end (ответ неполный)
+    """
     
-    # Извлекаем текст ответа из структуры API
-    try:
-        answer_text = resp_json["outputs"][0]["outputs"][0]["results"]["message"]["data"]["text"]
-        return answer_text
-    except (KeyError, IndexError) as e:
-        raise ValueError(f"Неожиданная структура ответа API: {e}")
+    payload, headers = _backend_request(question, animal, symptoms, session_id)
+    headers["Accept"] = "text/event-stream"
+    
+    with span("POST /api/v1/chat/stream", parent=parent_span, kind=SpanKind.CLIENT) as request_span:
+        # Ответ закрывается по выходу из блока, и соединение возвращается в пул
+        with _get_http_session().post(
+            BACKEND_API_CONFIG["stream_url"],
+            json=payload,
+            headers=trace_headers(request_span, headers),
+            stream=True,
+            timeout=_timeout(BACKEND_API_CONFIG["timeout"])
+        ) as response:
+            if on_response is not None:
+                on_response(response)
+            request_span.set_attribute("http.response.status_code", response.status_code)
+            request_span.set_attribute("tailsense.cache", response.headers.get("X-Cache", ""))
+            response.raise_for_status()
+            # Без charset в заголовке requests декодирует как latin-1
+            response.encoding = "utf-8"
+        
+            event, data_lines = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[len("data:"):].strip())
+                elif not line and data_lines:
+                    # Пустая строка завершает событие
+                    data = json.loads("\n".join(data_lines))
+                    if event == "token":
+                        yield data.get("chunk", "")
+                    elif event == "error":
+                        raise RuntimeError(data.get("error", "Ошибка генерации ответа"))
+                    elif event == "end":
+                        return
+                    event, data_lines = None, []
+            
+            # Перезапуск backend или таймаут прокси: без end ответ оборван, а не завершен
+            raise RuntimeError("Поток ответа прервался до завершения")
 
 def _get_fallback_response(animal: str, symptoms: List[str], message: str) -> str:
     """
@@ -266,9 +372,19 @@ def _get_fallback_response(animal: str, symptoms: List[str], message: str) -> st
 
 def reset_agent_session():
     """
-    Сбрасывает сессию агента, создавая новый session_id.
-    Используется при начале новой консультации.
+    Начинает новую консультацию: удаляет сессию на backend и создает новый session_id.
+    
+    Смена животного или симптомов сессию не сбрасывает: backend сам
+    передает агенту новый профиль со следующим вопросом.
     """
-    if 'agent_session_id' in st.session_state:
-        del st.session_state.agent_session_id
-
+    session_id = st.session_state.pop("agent_session_id", None)
+    if session_id is None:
+        return
+    try:
+        _get_http_session().delete(
+            f"{BACKEND_API_CONFIG['sessions_url']}/{session_id}",
+            timeout=_timeout(BACKEND_API_CONFIG["health_timeout"])
+        )
+    except requests.RequestException:
+        # Сессия истечет на backend по TTL
+        pass
@@ -0,0 +1,146 @@
+"""
+Фоновая генерация ответов чата.
+
+Запрос к backend выполняется в пуле потоков, общем для всех сессий
+Streamlit процесса, а не в потоке скрипта: пока агент отвечает, страница
+остается интерактивной (прокрутка, экспорт, кнопка остановки), а экран
+чата периодически перерисовывает фрагмент с уже полученным текстом.
+
+Размер пула ограничен CHAT_WORKERS (одновременные генерации) и
+CHAT_MAX_QUEUED (ожидающие свободного потока); сверх этого новые сообщения
+сразу отклоняются, чтобы один процесс не накапливал бесконечную очередь.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+import streamlit as st
+
+CHAT_WORKER_CONFIG = {
+    "workers": int(os.getenv("CHAT_WORKERS", "20")),  # Одновременные запросы к backend на процесс
+    "max_queued": int(os.getenv("CHAT_MAX_QUEUED", "20")),  # Сообщения, ожидающие свободного потока
+    "poll_interval": float(os.getenv("CHAT_POLL_INTERVAL", "0.5"))  # Период перерисовки ответа, секунды
+}
+
+
+class ChatJob:
+    """
+    Генерация одного ответа: накопленный текст, состояние и отмена.
+
+    Поток пула дописывает фрагменты, поток скрипта Streamlit читает их;
+    список только дополняется, поэтому чтение без блокировки безопасно.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self.started_at = time.time()
+        self._cancel = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def text(self) -> str:
+        """Полученная часть ответа."""
+        return "".join(self.chunks)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def attach(self, response) -> None:
+        """
+        Запоминает открытый HTTP-ответ backend, чтобы отмена могла его закрыть.
+
+        Args:
+            response (requests.Response): Потоковый ответ backend
+        """
+        with self._lock:
+            self._response = response
+            cancelled = self._cancel.is_set()
+        if cancelled:
+            response.close()
+
+    def cancel(self) -> None:
+        """
+        Останавливает генерацию.
+
+        Закрывает соединение с backend (backend прерывает вызов агента) и
+        сразу помечает задачу завершенной, не дожидаясь потока пула.
+        """
+        with self._lock:
+            self._cancel.set()
+            response = self._response
+        self.cancelled = True
+        self.done = True
+        if response is not None:
+            response.close()
+
+
+class ChatWorkerPool:
+    """Ограниченный пул потоков для генерации ответов."""
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.active = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-worker")
+        self._lock = threading.Lock()
+
+    @property
+    def full(self) -> bool:
+        """Все потоки и места в очереди заняты."""
+        return self.active >= self.workers + self.max_queued
+
+    def submit(self, job: ChatJob, produce: Callable[[ChatJob], Iterator[str]]) -> bool:
+        """
+        Запускает генерацию ответа в пуле.
+
+        Args:
+            job (ChatJob): Задача, в которую записываются фрагменты ответа
+            produce (Callable[[ChatJob], Iterator[str]]): Генератор фрагментов ответа
+
+        Returns:
+            bool: False, если пул и очередь заполнены и задача не принята
+        """
+        with self._lock:
+            if self.full:
+                self.rejected += 1
+                return False
+            self.active += 1
+        self._executor.submit(self._run, job, produce)
+        return True
+
+    def _run(self, job: ChatJob, produce: Callable[[ChatJob], Iterator[str]]) -> None:
+        chunks = produce(job)
+        try:
+            for chunk in chunks:
+                if job.cancel_requested:
+                    break
+                job.chunks.append(chunk)
+        except Exception as e:
+            # После отмены ошибка чтения закрытого соединения ожидаема
+            if not job.cancel_requested:
+                job.error = str(e)
+        finally:
+            chunks.close()
+            job.done = True
+            with self._lock:
+                self.active -= 1
+
+
+@st.cache_resource(show_spinner=False)
+def get_worker_pool() -> ChatWorkerPool:
+    """
+    Возвращает пул генерации ответов, общий для всех сессий процесса.
+
+    Returns:
+        ChatWorkerPool: Пул потоков
+    """
+    return ChatWorkerPool(CHAT_WORKER_CONFIG["workers"], CHAT_WORKER_CONFIG["max_queued"])
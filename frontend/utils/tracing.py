@@ -0,0 +1,126 @@
+"""
+Трассировка OpenTelemetry запросов frontend к backend и агенту.
+
+Каждое сообщение пользователя — корневой спан send_message с дочерним
+клиентским спаном HTTP-запроса; контекст трассы передается дальше в
+заголовке traceparent, так что спаны backend и LangFlow попадают в ту же
+трассу.
+
+Экспорт включается переменной TRACING_EXPORTER: console (stdout), file
+(JSON-строки в TRACING_FILE, работает без сети) или otlp (коллектор
+OpenTelemetry, нужен пакет opentelemetry-exporter-otlp-proto-http). По
+умолчанию (none) спаны не записываются и стоят почти ничего. Доля
+записываемых трасс — TRACING_SAMPLE_RATIO; решение о выборке передается в
+traceparent, и backend следует ему.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from opentelemetry import trace
+from opentelemetry.propagate import inject
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+
+TRACING_CONFIG = {
+    "exporter": os.getenv("TRACING_EXPORTER", "none"),  # none, console, file или otlp
+    "sample_ratio": float(os.getenv("TRACING_SAMPLE_RATIO", "0.1")),  # Доля записываемых трасс
+    "service_name": os.getenv("TRACING_SERVICE_NAME", "tailsense-frontend"),
+    "file": os.getenv("TRACING_FILE", ".traces.jsonl"),
+    "otlp_endpoint": os.getenv("TRACING_OTLP_ENDPOINT", "")  # По умолчанию http://localhost:4318/v1/traces
+}
+
+tracer = trace.get_tracer("tailsense.frontend")
+
+_provider = None
+
+
+def init_tracing() -> None:
+    """
+    Устанавливает провайдер трассировки и экспортер один раз на процесс.
+
+    Streamlit перезапускает скрипт страницы при каждом действии
+    пользователя, поэтому повторные вызовы ничего не делают.
+
+    Raises:
+        ValueError: Неизвестное значение TRACING_EXPORTER
+    """
+    global _provider
+    exporter_name = TRACING_CONFIG["exporter"]
+    if exporter_name == "none" or _provider is not None:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    elif exporter_name == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_CONFIG["file"], "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    elif exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        exporter = OTLPSpanExporter(endpoint=TRACING_CONFIG["otlp_endpoint"] or None)
+    else:
+        raise ValueError(f"Неизвестный экспортер трассировки: {exporter_name}")
+
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_CONFIG["service_name"]}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_CONFIG["sample_ratio"]))
+    )
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, kind: SpanKind = SpanKind.INTERNAL,
+         attributes: Optional[Dict[str, Any]] = None) -> Iterator[Span]:
+    """
+    Открывает спан на время блока, не делая его текущим.
+
+    Родитель передается явно: спаны используются внутри генератора ответа,
+    который выполняется в потоке пула ChatWorkerPool, а фрагмент страницы
+    тем временем периодически перерисовывает накопленный текст ChatJob.
+    Между фрагментами ответа генератор приостановлен, и текущий контекст
+    потока ему не принадлежит.
+
+    Args:
+        name (str): Имя спана
+        parent (Optional[Span]): Родительский спан, None — новая трасса
+        kind (SpanKind): Тип спана
+        attributes (Optional[Dict[str, Any]]): Атрибуты спана
+
+    Yields:
+        Span: Открытый спан; исключение блока записывается в него
+    """
+    context = trace.set_span_in_context(parent) if parent is not None else None
+    current = tracer.start_span(name, context=context, kind=kind, attributes=attributes)
+    try:
+        yield current
+    except Exception as e:
+        current.record_exception(e)
+        current.set_status(Status(StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        current.end()
+
+
+def trace_headers(current: Span, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Добавляет к заголовкам запроса контекст трассы спана.
+
+    Args:
+        current (Span): Спан, который станет родителем на стороне сервера
+        headers (Optional[Dict[str, str]]): Исходные заголовки
+
+    Returns:
+        Dict[str, str]: Заголовки с traceparent
+    """
+    headers = dict(headers or {})
+    inject(headers, context=trace.set_span_in_context(current))
+    return headers